@@ -0,0 +1,94 @@
+"""
+Analyse de cohorte hors ligne : compare entre eux les PDF d'un lot (les mémoires d'une promotion)
+et, sauf avec --no-corpus, chacun au corpus courant, en une seule passe (voir app/cohort.py).
+
+Exemples (depuis la racine du projet) :
+    python analyze_cohort.py rendus/ --output resultats_promo
+    python analyze_cohort.py rendus/*.pdf --output resultats_promo --no-corpus --format html
+
+Écrit dans le dossier de sortie :
+    cohorte.json   matrice, paires suspectes et résultats de chaque document
+    matrice.csv    part des phrases de chaque document (ligne) retrouvées dans chaque autre (colonne)
+    rapports/      le rapport de chaque document (constats du corpus et de la cohorte), sauf avec --format none
+"""
+import argparse
+import json
+import os
+import time
+
+from app.cohort import document_report_data, matrix_csv, unique_names
+
+
+def pdf_paths(paths):
+    """Fichiers PDF désignés par `paths` (fichiers ou dossiers, non récursif), dans l'ordre alphabétique par dossier."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith('.pdf'))
+        else:
+            found.append(path)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="Fichiers PDF ou dossiers de PDF")
+    parser.add_argument('--output', required=True, help="Dossier de sortie")
+    parser.add_argument('--min-score', type=float, default=0.5, help="Score composite minimal d'un constat")
+    parser.add_argument('--no-corpus', action='store_true', help="Comparer les documents entre eux seulement")
+    parser.add_argument('--format', choices=('pdf', 'html', 'none'), default='pdf', help="Format des rapports par document")
+    args = parser.parse_args()
+
+    # Imports différés : les modèles ne sont chargés qu'une fois les arguments validés
+    from app.analysis_logic import bi_encoder_signature, load_bi_encoder, load_cross_encoder
+    from app.embedding_cache import EMBEDDING_CACHE_ENABLED, EmbeddingCache
+    from app.pdf_extraction import shutdown_extraction_pool
+    from app.report_generator import render_report
+    from app.workers import analyze_cohort_documents, load_models
+
+    paths = pdf_paths(args.paths)
+    if len(paths) < 2:
+        raise SystemExit("Une cohorte compte au moins 2 documents.")
+    names = unique_names([os.path.basename(path) for path in paths])
+
+    if args.no_corpus:
+        models = {
+            'bi_encoder': load_bi_encoder(),
+            'cross_encoder': load_cross_encoder(),
+            'embedding_cache': EmbeddingCache(bi_encoder_signature()) if EMBEDDING_CACHE_ENABLED else None,
+            'corpus_version': None,
+        }
+    else:
+        models = load_models()
+
+    start = time.perf_counter()
+    try:
+        results = analyze_cohort_documents(paths, names, args.min_score, models=models, with_corpus=not args.no_corpus)
+    finally:
+        shutdown_extraction_pool()
+    print(f"{len(paths)} documents analysés en {time.perf_counter() - start:.1f} s")
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'cohorte.json'), 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(args.output, 'matrice.csv'), 'w', encoding='utf-8', newline='') as f:
+        f.write(matrix_csv(results))
+
+    if args.format != 'none':
+        reports_dir = os.path.join(args.output, 'rapports')
+        os.makedirs(reports_dir, exist_ok=True)
+        for document in results['documents']:
+            report, _ = render_report(document_report_data(document, results['version_corpus']), document['document'], args.format)
+            name = f"Rapport_{os.path.splitext(document['document'])[0]}.{args.format}"
+            with open(os.path.join(reports_dir, name), 'wb' if args.format == 'pdf' else 'w') as f:
+                f.write(report)
+
+    print(f"Paires suspectes : {results['summary']['paires_suspectes']}")
+    for pair in results['paires'][:10]:
+        print(f"  {pair['document_a']} ↔ {pair['document_b']} : {pair['phrases_a_dans_b']} / {pair['phrases_b_dans_a']} phrases "
+              f"({pair['part_a']:.0%} / {pair['part_b']:.0%})")
+    print(f"Résultats écrits dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
+import hashlib
 import os
+import time
 
-import fitz  # PyMuPDF
 import nltk
 
 import numpy as np
@@ -8,10 +9,13 @@ import pandas as pd
 import faiss
 from sentence_transformers import SentenceTransformer, CrossEncoder
 
-from .functions.lexical_metrics import calculate_lexical_metrics
-from .functions.get_verdict import get_final_verdict, get_highlighted_diff_html
+from .corpus_store import CorpusStore
+from .index_builder import configure_search, read_index_mmap
+from .pdf_extraction import iter_pdf_sentences
+from .shingle_index import ShingleIndex, shingle_index_exists
+from .functions.get_verdict import VERDICT_THRESHOLDS, get_highlighted_diff_html
 from .functions.is_citation import is_citation_or_reference
-from .functions.ngram_jaccard import calculate_ngram_jaccard
+from .functions.lexical_batch import lexical_scores, score_pairs
 # ==============================================================================
 # 1. CONFIGURATION DES CHEMINS
 #    (Assurez-vous que ces chemins sont corrects par rapport à la racine du projet)
@@ -29,36 +33,153 @@ CORPUS_DIR = os.path.join(BASE_DIR, "corpus")
 BI_ENCODER_NAME = 'sentence-transformers/msmarco-distilbert-base-v4'
 CROSS_ENCODER_NAME = 'antoinelouis/crossencoder-camemberta-base-mmarcoFR'
 
+# Moteur d'inférence des deux modèles :
+#   "torch" (défaut), "onnx" (ONNX Runtime, fp32) ou "onnx-int8" (quantification dynamique int8).
+# Les modèles ONNX sont exportés une fois dans MODELS_DIR avec export_models.py.
+INFERENCE_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+INFERENCE_BACKEND = os.environ.get('APLAG_INFERENCE_BACKEND', 'torch')
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+# Jeu d'instructions visé par la quantification int8 : arm64, avx2, avx512 ou avx512_vnni
+ONNX_QUANTIZATION = os.environ.get('APLAG_ONNX_QUANTIZATION', 'avx2')
+
 
 # On utilise os.path.join pour construire le chemin correct et complet
 FAISS_INDEX_PATH = os.path.join(CORPUS_DIR, 'corpus_doc.index')
 CORPUS_DF_PATH = os.path.join(CORPUS_DIR, 'corpus_dataframe_doc.pkl')
+CORPUS_STORE_DIR = os.path.join(CORPUS_DIR, 'corpus_store')
+CORPUS_SHINGLES_DIR = os.path.join(CORPUS_DIR, 'corpus_shingles')
 TEXT_COLUMN = 'content_block'
 SOURCE_COLUMN = 'title'
 
+# Paramètres de recherche des index approximatifs (voir build_index.py) :
+# nombre de listes IVF visitées et taille de la file de candidats HNSW.
+FAISS_NPROBE = int(os.environ['APLAG_FAISS_NPROBE']) if os.environ.get('APLAG_FAISS_NPROBE') else None
+FAISS_EF_SEARCH = int(os.environ['APLAG_FAISS_EF_SEARCH']) if os.environ.get('APLAG_FAISS_EF_SEARCH') else None
+# Index projeté en mémoire en lecture seule : les workers partagent les pages du fichier au lieu d'en avoir chacun une copie.
+FAISS_MMAP = os.environ.get('APLAG_FAISS_MMAP', '0') == '1'
+
+# Nombre de paires (phrase, hit) envoyées au Cross-Encoder par passe avant.
+RERANK_BATCH_SIZE = int(os.environ.get('APLAG_RERANK_BATCH_SIZE', 256))
+# Nombre de phrases re-classées entre deux notifications de progression.
+RERANK_CHUNK_SENTENCES = int(os.environ.get('APLAG_RERANK_CHUNK_SENTENCES', 128))
+
+# Cascade Bi-Encoder -> Cross-Encoder (désactivée tant que les variables ne sont pas définies) :
+#   - une phrase dont le meilleur score Bi-Encoder (cosinus) est sous le plancher est écartée sans re-ranking ;
+#   - seuls les hits à moins de `marge` du meilleur score sont re-classés (au moins MIN_RERANK_K).
+BI_SCORE_FLOOR = float(os.environ['APLAG_BI_SCORE_FLOOR']) if os.environ.get('APLAG_BI_SCORE_FLOOR') else None
+BI_SCORE_MARGIN = float(os.environ['APLAG_BI_SCORE_MARGIN']) if os.environ.get('APLAG_BI_SCORE_MARGIN') else None
+MIN_RERANK_K = int(os.environ.get('APLAG_MIN_RERANK_K', 1))
+# Choix du hit retenu pour chaque phrase : meilleur score du Cross-Encoder (défaut)
+# ou meilleur score composite parmi tous les hits re-classés.
+SCORE_ALL_HITS = os.environ.get('APLAG_SCORE_ALL_HITS', '0') == '1'
+# Voie rapide des copies mot pour mot (index de shingles, voir shingle_index.py) : une phrase dont au moins
+# FAST_PATH_MIN_OVERLAP des shingles se trouvent dans un même passage est un copié-collé, sans passer par les modèles.
+FAST_PATH = os.environ.get('APLAG_FAST_PATH', '1') == '1'
+FAST_PATH_MIN_OVERLAP = float(os.environ.get('APLAG_FAST_PATH_MIN_OVERLAP', 0.9))
+# Nombre minimal de shingles d'une phrase (une phrase plus courte passe par les modèles)
+FAST_PATH_MIN_SHINGLES = int(os.environ.get('APLAG_FAST_PATH_MIN_SHINGLES', 3))
+
 # S'assurer que le tokenizer 'punkt' de NLTK est disponible
 
 
 
-def load_bi_encoder():
-    """Charge le modèle Bi-Encoder."""
-    return SentenceTransformer(BI_ENCODER_NAME)
+def exported_model_dir(model_name):
+    """Répertoire de l'export ONNX d'un modèle (voir export_models.py)."""
+    return os.path.join(MODELS_DIR, model_name.replace('/', '__'))
+
+def quantized_model_file(quantization=ONNX_QUANTIZATION):
+    """Fichier du modèle quantifié en int8, relatif au répertoire d'export."""
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+def _model_source(model_name, backend):
+    """Chemin et options de chargement d'un modèle pour le moteur d'inférence `backend`."""
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Moteur d'inférence inconnu : {backend} (attendu : {', '.join(INFERENCE_BACKENDS)})")
+    if backend == 'torch':
+        return model_name, {}
+    export_dir = exported_model_dir(model_name)
+    options = {'backend': 'onnx'}
+    if backend == 'onnx-int8':
+        options['model_kwargs'] = {'file_name': quantized_model_file()}
+    if not os.path.exists(os.path.join(export_dir, options.get('model_kwargs', {}).get('file_name', 'onnx/model.onnx'))):
+        raise FileNotFoundError(f"Modèle {backend} introuvable pour {model_name} dans {export_dir} : lancez export_models.py.")
+    return export_dir, options
+
+def model_signature():
+    """Modèles et moteur d'inférence en service : ils font partie des clés des caches de résultats."""
+    if INFERENCE_BACKEND == 'torch':
+        return [BI_ENCODER_NAME, CROSS_ENCODER_NAME]
+    return [BI_ENCODER_NAME, CROSS_ENCODER_NAME, INFERENCE_BACKEND, ONNX_QUANTIZATION if INFERENCE_BACKEND == 'onnx-int8' else '']
+
+def bi_encoder_signature(backend=None):
+    """Bi-Encoder et moteur d'inférence qui produisent les embeddings : clé du cache d'embeddings."""
+    backend = backend or INFERENCE_BACKEND
+    if backend == 'torch':
+        return BI_ENCODER_NAME
+    return "|".join([BI_ENCODER_NAME, backend, ONNX_QUANTIZATION if backend == 'onnx-int8' else ''])
+
+def load_bi_encoder(backend=None):
+    """Charge le modèle Bi-Encoder (moteur d'inférence APLAG_INFERENCE_BACKEND par défaut)."""
+    source, options = _model_source(BI_ENCODER_NAME, backend or INFERENCE_BACKEND)
+    return SentenceTransformer(source, **options)
 
-def load_cross_encoder():
-    """Charge le modèle Cross-Encoder."""
-    return CrossEncoder(CROSS_ENCODER_NAME)
+def load_cross_encoder(backend=None):
+    """Charge le modèle Cross-Encoder (moteur d'inférence APLAG_INFERENCE_BACKEND par défaut)."""
+    source, options = _model_source(CROSS_ENCODER_NAME, backend or INFERENCE_BACKEND)
+    return CrossEncoder(source, **options)
 
-def load_faiss_index():
-    """Charge l'index FAISS depuis le disque."""
-    if not os.path.exists(FAISS_INDEX_PATH):
-        raise FileNotFoundError(f"L'index FAISS est introuvable au chemin : {FAISS_INDEX_PATH}")
-    return faiss.read_index(FAISS_INDEX_PATH)
+def _current_snapshot():
+    from .snapshots import resolve_snapshot  # import différé : snapshots.py dépend de ce module
+    return resolve_snapshot()
+
+def load_faiss_index(index_path=None):
+    """
+    Charge l'index FAISS depuis le disque (exact, IVF ou HNSW) et applique les paramètres de recherche.
+    Par défaut, l'index de la version courante du corpus (voir snapshots.py).
+    Avec APLAG_FAISS_MMAP=1, l'index est projeté en mémoire en lecture seule.
+    """
+    index_path = index_path or _current_snapshot()['index_path']
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"L'index FAISS est introuvable au chemin : {index_path}")
+    index = read_index_mmap(index_path) if FAISS_MMAP else faiss.read_index(index_path)
+    return configure_search(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+
+def load_corpus_dataframe(store_dir=None):
+    """
+    Charge le corpus depuis le disque sous forme de `CorpusStore` projeté en mémoire
+    (par défaut, celui de la version courante du corpus).
+    Si le store n'existe pas encore, il est construit une fois à partir de l'ancien pickle.
+    """
+    store_dir = store_dir or _current_snapshot()['store_dir']
+    if not os.path.exists(os.path.join(store_dir, 'offsets.npy')):
+        if store_dir != CORPUS_STORE_DIR or not os.path.exists(CORPUS_DF_PATH):
+            raise FileNotFoundError(f"Le corpus est introuvable aux chemins : {store_dir}, {CORPUS_DF_PATH}")
+        CorpusStore.from_dataframe(pd.read_pickle(CORPUS_DF_PATH), TEXT_COLUMN, SOURCE_COLUMN).save(store_dir)
+    return CorpusStore.load(store_dir)
+
+def load_shingle_index(shingles_dir=None):
+    """
+    Charge l'index de shingles de la voie rapide (par défaut, celui de la version courante du corpus).
+    Retourne None si la voie rapide est désactivée ou si l'index n'a pas été construit.
+    """
+    if not FAST_PATH:
+        return None
+    shingles_dir = shingles_dir or _current_snapshot()['shingles_dir']
+    if not shingle_index_exists(shingles_dir):
+        return None
+    return ShingleIndex.load(shingles_dir)
 
-def load_corpus_dataframe():
-    """Charge le DataFrame du corpus depuis le disque."""
-    if not os.path.exists(CORPUS_DF_PATH):
-        raise FileNotFoundError(f"Le DataFrame du corpus est introuvable au chemin : {CORPUS_DF_PATH}")
-    return pd.read_pickle(CORPUS_DF_PATH)
+def get_corpus_version():
+    """
+    Identifiant de la version des anciens fichiers du corpus (index FAISS + store du corpus),
+    utilisé tant qu'aucun instantané n'a été publié (voir snapshots.py).
+    Il change dès que l'un de ces fichiers est réécrit.
+    """
+    signature = []
+    for path in (FAISS_INDEX_PATH, os.path.join(CORPUS_STORE_DIR, 'offsets.npy'), os.path.join(CORPUS_STORE_DIR, 'texts.bin')):
+        stat = os.stat(path)
+        signature.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("|".join(signature).encode()).hexdigest()[:16]
 
 # ==============================================================================
 # 2. FONCTIONS DE CHARGEMENT DES RESSOURCES
@@ -66,95 +187,381 @@ def load_corpus_dataframe():
 # ==============================================================================
 
 
+# ==============================================================================
+# 3. RE-RANKING PAR LOTS
+# ==============================================================================
+
+def bi_encoder_similarities(index, distances):
+    """
+    Convertit les distances FAISS en similarités cosinus (embeddings normalisés) :
+    produit scalaire tel quel, ou 1 - d²/2 pour un index L2.
+    """
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1.0 - distances / 2.0
+
+def select_candidates(indices, similarities, score_floor=None, score_margin=None, min_k=MIN_RERANK_K):
+    """
+    Première étape de la cascade : choisit, pour chaque phrase, les hits à envoyer au Cross-Encoder.
+    Les résultats FAISS sont triés du plus proche au plus lointain, les hits retenus forment donc un préfixe,
+    dont on retire les résultats manquants (-1 : top-k incomplet d'un index IVF ou HNSW, d'une fusion de shards,
+    ou identifiant inconnu du store) : CorpusStore lirait sinon le dernier passage du corpus.
+    Retourne une liste de tableaux d'ids (vide pour une phrase écartée).
+    """
+    n_sentences, k = indices.shape
+    keep = np.full(n_sentences, k)
+    if score_margin is not None and k > 0:
+        keep = np.count_nonzero(similarities >= similarities[:, :1] - score_margin, axis=1)
+        keep = np.clip(keep, min(min_k, k), k)
+    if score_floor is not None and k > 0:
+        keep[similarities[:, 0] < score_floor] = 0
+    return [row[:n][row[:n] >= 0] for row, n in zip(indices, keep.tolist())]
+
+def rerank_hits(query_sentences, candidate_ids, df_corpus, cross_encoder, batch_size=RERANK_BATCH_SIZE, all_hits=False):
+    """
+    Re-classe en une seule passe toutes les paires (phrase, hit) d'un ensemble de phrases.
+    `candidate_ids` contient, pour chaque phrase, les ids du corpus à comparer (le nombre peut varier).
+    Les paires sont triées par longueur pour limiter le padding dans chaque lot,
+    puis les scores sont remis dans l'ordre pour retrouver le meilleur hit de chaque phrase
+    (None pour une phrase sans candidat).
+    Avec `all_hits=True`, retourne pour chaque phrase la liste de tous ses hits re-classés.
+    """
+    lengths = [len(ids) for ids in candidate_ids]
+    if sum(lengths) == 0:
+        return [None] * len(lengths)
+
+    flat_ids = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in candidate_ids])
+    flat_texts = df_corpus.get_texts(flat_ids)
+    bounds = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+    pairs = []
+    for query, start, end in zip(query_sentences, bounds[:-1], bounds[1:]):
+        pairs.extend([query, hit] for hit in flat_texts[start:end])
+
+    order = sorted(range(len(pairs)), key=lambda p: len(pairs[p][0]) + len(pairs[p][1]))
+    sorted_scores = np.asarray(cross_encoder.predict(
+        [pairs[p] for p in order], batch_size=batch_size, show_progress_bar=False
+    ))
+    scores = np.empty_like(sorted_scores)
+    scores[order] = sorted_scores
+
+    if all_hits:
+        return [
+            [{'corpus_id': flat_ids[h], 'sentence': flat_texts[h], 'cross_score': scores[h]} for h in range(start, end)]
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+    best_hits = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            best_hits.append(None)
+            continue
+        best = start + int(np.argmax(scores[start:end]))
+        best_hits.append({
+            'corpus_id': flat_ids[best],
+            'sentence': flat_texts[best],
+            'cross_score': scores[best]
+        })
+    return best_hits
+
+def _score_hits(query_sentences, best_hits, df_corpus, min_verdict_score):
+    """Calcule le score composite de chaque meilleur hit et retourne les constats au-dessus du seuil."""
+    findings = []
+    # Métriques lexicales et verdicts de toutes les paires du paquet en une passe (functions/lexical_batch.py)
+    scores = score_pairs(query_sentences, [best_hit['sentence'] for best_hit in best_hits],
+                         [best_hit['cross_score'] for best_hit in best_hits], n=3)
+    suspect = np.flatnonzero(scores['composite'] >= min_verdict_score).tolist()
+    sources = df_corpus.get_sources([best_hits[p]['corpus_id'] for p in suspect])
+    # On ne garde que les résultats dépassant un certain seuil de suspicion
+    for p, source_document in zip(suspect, sources):
+        query_sentence, best_hit = query_sentences[p], best_hits[p]
+        html_diff = get_highlighted_diff_html(query_sentence, best_hit['sentence'])
+
+        finding = {
+            "phrase_suspecte": query_sentence,
+            "score_composite": round(float(scores['composite'][p]), 3),
+            "verdict": scores['verdicts'][p],
+            "details": {
+                "score_cross_encoder": round(float(best_hit['cross_score']), 3),
+                "levenshtein": float(scores['levenshtein'][p]),
+                "jaccard": float(scores['jaccard'][p]),
+                "score_ngram_jaccard": round(float(scores['ngram'][p]), 3)
+            },
+            "source_trouvee": best_hit['sentence'],
+            "document_source": source_document,
+            "html_diff_suspecte": html_diff[0],
+            "html_diff_source": html_diff[1]
+        }
+        findings.append(finding)
+    return findings
+
+def best_composite_hits(query_sentences, hits_per_sentence):
+    """
+    Retient pour chaque phrase le hit re-classé de meilleur score composite (au lieu du meilleur
+    score du Cross-Encoder), en évaluant toutes les paires d'un coup. None pour une phrase sans hit.
+    """
+    queries = [q for q, hits in zip(query_sentences, hits_per_sentence) for _ in hits]
+    flat_hits = [hit for hits in hits_per_sentence for hit in hits]
+    if not flat_hits:
+        return [None] * len(hits_per_sentence)
+    composite = score_pairs(queries, [hit['sentence'] for hit in flat_hits],
+                            np.asarray([hit['cross_score'] for hit in flat_hits]), n=3)['composite']
+    best_hits, start = [], 0
+    for hits in hits_per_sentence:
+        end = start + len(hits)
+        best_hits.append(flat_hits[start + int(np.argmax(composite[start:end]))] if hits else None)
+        start = end
+    return best_hits
+
+def fast_path_findings(query_sentences, positions, overlaps, df_corpus):
+    """
+    Constats des phrases résolues par l'index de shingles : verdict de copié-collé, score composite
+    égal au recouvrement des shingles (pas de score du Cross-Encoder), métriques lexicales en une passe.
+    """
+    sources = df_corpus.get_texts(positions)
+    documents = df_corpus.get_sources(positions)
+    scores = lexical_scores(query_sentences, sources, n=3)
+    findings = []
+    for p, (query_sentence, source, source_document) in enumerate(zip(query_sentences, sources, documents)):
+        html_diff = get_highlighted_diff_html(query_sentence, source)
+        findings.append({
+            "phrase_suspecte": query_sentence,
+            "score_composite": round(float(overlaps[p]), 3),
+            "verdict": VERDICT_THRESHOLDS[0][1],
+            "details": {
+                "score_cross_encoder": None,
+                "levenshtein": float(scores['levenshtein'][p]),
+                "jaccard": float(scores['jaccard'][p]),
+                "score_ngram_jaccard": round(float(scores['ngram'][p]), 3),
+                "recouvrement_shingles": round(float(overlaps[p]), 3)
+            },
+            "source_trouvee": source,
+            "document_source": source_document,
+            "html_diff_suspecte": html_diff[0],
+            "html_diff_source": html_diff[1]
+        })
+    return findings
+
 # ==============================================================================
 # 4. FONCTION PRINCIPALE D'ANALYSE
 # ==============================================================================
 
-def analyze_pdf_for_plagiarism(file_path: str, bi_encoder, cross_encoder, index, df_corpus, top_k_retrieve=10, min_verdict_score=0.7):
+def _progress_event(stage, done=0, total=0):
+    return {"type": "progress", "etape": stage, "phrases_traitees": done, "phrases_totales": total}
+
+def _sentence_chunks(sentences, chunk_size):
+    """Regroupe un flux de phrases en paquets de `chunk_size`."""
+    chunk = []
+    for sentence in sentences:
+        chunk.append(sentence)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _add_timing(timings, stage, start):
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def iter_pdf_analysis(file_path: str, bi_encoder, cross_encoder, index, df_corpus, top_k_retrieve=10, min_verdict_score=0.7, rerank_batch_size=RERANK_BATCH_SIZE, sentence_cache=None,
+                      bi_score_floor=BI_SCORE_FLOOR, bi_score_margin=BI_SCORE_MARGIN, min_rerank_k=MIN_RERANK_K, stats=None, chunk_size=RERANK_CHUNK_SENTENCES, timings=None,
+                      score_all_hits=SCORE_ALL_HITS, shingle_index=None, fast_path_min_overlap=FAST_PATH_MIN_OVERLAP, embedding_cache=None, sentences=None):
+    """
+    Analyse un PDF par paquets de `chunk_size` phrases et produit les événements au fil de l'eau :
+      - {"type": "progress", "etape", "phrases_traitees", "phrases_totales"}
+      - {"type": "finding", "finding": {...}}   dès que le paquet de la phrase est re-classé
+      - {"type": "summary", "summary": {...}}   en dernier
+      - {"type": "message", "message": "..."}   à la place du résumé si le document n'a rien à analyser
+    Les phrases arrivent de l'extraction parallèle (`iter_pdf_sentences`) au fur et à mesure :
+    le premier paquet est analysé pendant que les pages suivantes sont encore extraites,
+    et "phrases_totales" compte les phrases extraites jusque-là.
+    Les paramètres sont ceux de `analyze_pdf_for_plagiarism` (`file_path` peut aussi être le contenu du PDF).
+    """
+    # --- 1. EXTRACTION ET FILTRAGE DU TEXTE DU PDF ---
+    yield _progress_event("extraction")
+    extraction = {}
+    extracted = {"phrases": 0}
+
+    def relevant_sentences():
+        for sentence in iter_pdf_sentences(file_path, report=extraction) if sentences is None else sentences:
+            extracted["phrases"] += 1
+            t0 = time.perf_counter()
+            relevant = not is_citation_or_reference(sentence)
+            _add_timing(timings, "filtrage", t0)
+            if relevant:
+                yield sentence
+
+    retrieval_signature = f"{top_k_retrieve}|{bi_score_floor}|{bi_score_margin}|{min_rerank_k}"
+    if score_all_hits:
+        # Le hit conservé en cache dépend de la règle de choix
+        retrieval_signature += "|composite"
+    counters = {"phrases_cache": 0, "phrases_ecartees": 0, "paires_reclassees": 0, "paires_elaguees": 0, "phrases_voie_rapide": 0}
+    total_sentences = total_suspect = 0
+    for chunk_sentences in _sentence_chunks(relevant_sentences(), chunk_size):
+        start = total_sentences
+        total_sentences += len(chunk_sentences)
+
+        if shingle_index is not None:
+            # --- 1 bis. VOIE RAPIDE : copies mot pour mot reconnues par l'index de shingles ---
+            t0 = time.perf_counter()
+            positions, overlaps = shingle_index.match(chunk_sentences, min_shingles=FAST_PATH_MIN_SHINGLES)
+            resolved = (positions >= 0) & (overlaps >= fast_path_min_overlap)
+            fast_findings = fast_path_findings(
+                [s for s, r in zip(chunk_sentences, resolved) if r], positions[resolved], overlaps[resolved], df_corpus
+            )
+            fast_findings = [f for f in fast_findings if f['score_composite'] >= min_verdict_score]
+            _add_timing(timings, "voie_rapide", t0)
+            for finding in fast_findings:
+                yield {"type": "finding", "finding": finding}
+            total_suspect += len(fast_findings)
+            counters["phrases_voie_rapide"] += int(resolved.sum())
+            # Seules les autres phrases passent par les modèles
+            chunk_sentences = [s for s, r in zip(chunk_sentences, resolved) if not r]
+
+        cached_hits, cache_keys = {}, []
+        if sentence_cache is not None:
+            cache_keys = [sentence_cache.make_key(s, retrieval_signature) for s in chunk_sentences]
+            cached_hits = sentence_cache.get_many(cache_keys)
+        chunk_misses = [p for p in range(len(chunk_sentences)) if not cache_keys or cache_keys[p] not in cached_hits]
+        chunk_hits = {}
+
+        if chunk_misses:
+            # --- 2. ÉTAPE DE "RETRIEVE" (Bi-Encoder) ---
+            miss_sentences = [chunk_sentences[p] for p in chunk_misses]
+            yield _progress_event("encodage", start, total_sentences)
+            t0 = time.perf_counter()
+            if embedding_cache is not None:
+                query_embeddings = embedding_cache.encode(bi_encoder, miss_sentences)
+            else:
+                query_embeddings = bi_encoder.encode(miss_sentences, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+            _add_timing(timings, "encodage", t0)
+            yield _progress_event("recherche", start, total_sentences)
+            t0 = time.perf_counter()
+            distances, indices = index.search(query_embeddings, top_k_retrieve)
+            # Index à identifiants stables : identifiants FAISS -> positions dans le corpus
+            indices = df_corpus.positions_of(indices)
+            candidates = select_candidates(
+                indices, bi_encoder_similarities(index, distances),
+                score_floor=bi_score_floor, score_margin=bi_score_margin, min_k=min_rerank_k
+            )
+            _add_timing(timings, "recherche", t0)
+
+            # --- 3. ÉTAPE DE "RE-RANK" (Cross-Encoder) ---
+            yield _progress_event("re-ranking", start, total_sentences)
+            t0 = time.perf_counter()
+            reranked = rerank_hits(miss_sentences, candidates, df_corpus, cross_encoder, batch_size=rerank_batch_size, all_hits=score_all_hits)
+            _add_timing(timings, "re-ranking", t0)
+            if score_all_hits:
+                t0 = time.perf_counter()
+                reranked = best_composite_hits(miss_sentences, reranked)
+                _add_timing(timings, "scoring", t0)
+            # Les phrases écartées par la cascade n'ont pas de meilleur hit
+            chunk_hits = {p: hit for p, hit in zip(chunk_misses, reranked) if hit is not None}
+            reranked_pairs = sum(len(ids) for ids in candidates)
+            counters["paires_reclassees"] += reranked_pairs
+            counters["paires_elaguees"] += len(chunk_misses) * top_k_retrieve - reranked_pairs
+            counters["phrases_ecartees"] += len(chunk_misses) - len(chunk_hits)
+            if sentence_cache is not None:
+                sentence_cache.put_many([(cache_keys[p], hit['corpus_id'], hit['cross_score']) for p, hit in chunk_hits.items()])
+
+        chunk_cached = [p for p in range(len(chunk_sentences)) if cache_keys and cache_keys[p] in cached_hits]
+        cached_ids = [cached_hits[cache_keys[p]][0] for p in chunk_cached]
+        for p, corpus_id, text in zip(chunk_cached, cached_ids, df_corpus.get_texts(cached_ids)):
+            chunk_hits[p] = {'corpus_id': corpus_id, 'sentence': text, 'cross_score': cached_hits[cache_keys[p]][1]}
+        counters["phrases_cache"] += len(chunk_cached)
+
+        # --- 4. ANALYSE COMPOSITE ---
+        yield _progress_event("scoring", start, total_sentences)
+        t0 = time.perf_counter()
+        scored_positions = [p for p in range(len(chunk_sentences)) if p in chunk_hits]
+        chunk_findings = _score_hits(
+            [chunk_sentences[p] for p in scored_positions],
+            [chunk_hits[p] for p in scored_positions],
+            df_corpus, min_verdict_score
+        )
+        _add_timing(timings, "scoring", t0)
+        for finding in chunk_findings:
+            yield {"type": "finding", "finding": finding}
+        total_suspect += len(chunk_findings)
+        yield _progress_event("scoring", total_sentences, total_sentences)
+
+    if timings is not None:
+        for stage in ("extraction", "segmentation"):
+            timings[stage] = timings.get(stage, 0.0) + extraction.get("durees", {}).get(stage, 0.0)
+
+    if extracted["phrases"] == 0:
+        yield {"type": "message", "message": "Le document PDF est vide ou ne contient pas de texte."}
+        return
+    if total_sentences == 0:
+        yield {"type": "message", "message": "Aucune phrase pertinente à analyser après filtrage."}
+        return
+
+    # Compteurs de l'analyse (cache, voie rapide, cascade) : exposés par /metrics via `stats` (metrics.py)
+    if stats is not None:
+        stats.update(counters)
+
+    # --- 5. RÉSUMÉ ---
+    suspicion_ratio = total_suspect / total_sentences if total_sentences > 0 else 0
+    yield {
+        "type": "summary",
+        "summary": {
+            "phrases_analysees": total_sentences,
+            "phrases_suspectes": total_suspect,
+            "ratio_suspicion": f"{suspicion_ratio:.1%}",
+            "phrases_voie_rapide": counters["phrases_voie_rapide"],
+            "ratio_voie_rapide": f"{counters['phrases_voie_rapide'] / total_sentences:.1%}"
+        }
+    }
+
+def analyze_pdf_for_plagiarism(file_path: str, bi_encoder, cross_encoder, index, df_corpus, top_k_retrieve=10, min_verdict_score=0.7, rerank_batch_size=RERANK_BATCH_SIZE, progress_callback=None, sentence_cache=None,
+                               bi_score_floor=BI_SCORE_FLOOR, bi_score_margin=BI_SCORE_MARGIN, min_rerank_k=MIN_RERANK_K, stats=None, timings=None,
+                               score_all_hits=SCORE_ALL_HITS, shingle_index=None, fast_path_min_overlap=FAST_PATH_MIN_OVERLAP, embedding_cache=None, sentences=None):
     """
-    Fonction principale qui orchestre l'analyse de plagiat d'un fichier PDF.
-    Elle prend les modèles pré-chargés en arguments pour être efficace.
+    Fonction principale qui orchestre l'analyse de plagiat d'un fichier PDF
+    (`file_path` : chemin du fichier ou son contenu en bytes).
+    Elle prend les modèles pré-chargés en arguments pour être efficace
+    (`df_corpus` est le `CorpusStore` renvoyé par `load_corpus_dataframe`).
+    `index`, `df_corpus` et `shingle_index` peuvent être un même `ShardedCorpus` (sharding.py) : chaque recherche
+    interroge alors tous les shards en parallèle et leurs top-k sont fusionnés avant le re-ranking.
+    Si `progress_callback` est fourni, il est appelé avec (étape, phrases traitées, phrases totales).
+    Si `sentence_cache` est fourni, seules les phrases absentes du cache passent
+    par le Bi-Encoder, FAISS et le Cross-Encoder.
+    `bi_score_floor`, `bi_score_margin` et `min_rerank_k` règlent la cascade (voir `select_candidates`).
+    Si `stats` est un dictionnaire, il reçoit les compteurs de l'analyse (cache, paires re-classées et élaguées).
+    Si `timings` est un dictionnaire, il cumule la durée (en secondes) de chaque étape.
+    Avec `score_all_hits=True`, le hit retenu pour chaque phrase est celui de meilleur score composite
+    parmi tous les hits re-classés, et non le meilleur score du Cross-Encoder.
+    Si `shingle_index` est fourni (`load_shingle_index`), les phrases dont au moins `fast_path_min_overlap`
+    des shingles se trouvent dans un même passage sont des copiés-collés reconnus sans les modèles ;
+    le résumé indique la part de phrases ainsi résolues ("ratio_voie_rapide").
+    Si `embedding_cache` est fourni (`EmbeddingCache`), les embeddings des phrases déjà encodées
+    (quel que soit le document ou la version du corpus) sont relus au lieu d'être recalculés.
+    Si `sentences` est fourni (phrases déjà extraites du document, voir cohort.py), l'extraction est sautée.
     """
     try:
-        # --- 1. EXTRACTION ET FILTRAGE DU TEXTE DU PDF ---
-        doc = fitz.open(file_path)
-        full_text = "".join(page.get_text() for page in doc)
-        doc.close()
-
-        if not full_text.strip():
-            return {"message": "Le document PDF est vide ou ne contient pas de texte."}
-
-        all_sentences = nltk.sent_tokenize(full_text, language='french')
-        
-        sentences_to_analyze = [s for s in all_sentences if not is_citation_or_reference(s)]
-        
-        if not sentences_to_analyze:
-            return {"message": "Aucune phrase pertinente à analyser après filtrage."}
-
-        # --- 2. ÉTAPE DE "RETRIEVE" (Bi-Encoder) ---
-        query_embeddings = bi_encoder.encode(sentences_to_analyze, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
-        distances, indices = index.search(query_embeddings, top_k_retrieve)
-
-        # --- 3. ÉTAPE DE "RE-RANK" ET ANALYSE COMPOSITE ---
         all_findings = []
-        for i, query_sentence in enumerate(sentences_to_analyze):
-            
-            # Créer les paires pour le cross-encoder
-            retrieved_hits = [{'corpus_id': idx, 'sentence': df_corpus.iloc[idx][TEXT_COLUMN]} for idx in indices[i]]
-            cross_inp = [[query_sentence, hit['sentence']] for hit in retrieved_hits]
-            
-            # Prédiction avec le Cross-Encoder
-            cross_scores = cross_encoder.predict(cross_inp, show_progress_bar=False)
-            
-            # Trouver le meilleur score
-            best_hit_idx = np.argmax(cross_scores)
-            best_hit = retrieved_hits[best_hit_idx]
-            best_hit['cross_score'] = cross_scores[best_hit_idx]
-
-            # Calcul des métriques additionnelles
-            lexical_metrics = calculate_lexical_metrics(query_sentence, best_hit['sentence'])
-            ngram_score = calculate_ngram_jaccard(query_sentence, best_hit['sentence'], n=3)
-            
-            # Verdict final
-            verdict, composite_score = get_final_verdict(best_hit['cross_score'], lexical_metrics, ngram_score)
-            
-            # On ne garde que les résultats dépassant un certain seuil de suspicion
-            if composite_score >= min_verdict_score:
-                html_diff = get_highlighted_diff_html(query_sentence, best_hit['sentence'])
-                source_document = df_corpus.iloc[best_hit['corpus_id']][SOURCE_COLUMN]
-
-                finding = {
-                    "phrase_suspecte": query_sentence,
-                    "score_composite": round(float(composite_score), 3),
-                    "verdict": verdict,
-                    "details": {
-                        "score_cross_encoder": round(float(best_hit['cross_score']), 3),
-                        **lexical_metrics,
-                        "score_ngram_jaccard": round(float(ngram_score), 3)
-                    },
-                    "source_trouvee": best_hit['sentence'],
-                    "document_source": source_document,
-                    "html_diff_suspecte": html_diff[0],
-                    "html_diff_source": html_diff[1]
+        for event in iter_pdf_analysis(
+            file_path, bi_encoder, cross_encoder, index, df_corpus,
+            top_k_retrieve=top_k_retrieve, min_verdict_score=min_verdict_score, rerank_batch_size=rerank_batch_size,
+            sentence_cache=sentence_cache, bi_score_floor=bi_score_floor, bi_score_margin=bi_score_margin,
+            min_rerank_k=min_rerank_k, stats=stats, timings=timings, score_all_hits=score_all_hits,
+            shingle_index=shingle_index, fast_path_min_overlap=fast_path_min_overlap, embedding_cache=embedding_cache,
+            sentences=sentences
+        ):
+            if event["type"] == "progress":
+                if progress_callback is not None:
+                    progress_callback(event["etape"], event["phrases_traitees"], event["phrases_totales"])
+            elif event["type"] == "finding":
+                all_findings.append(event["finding"])
+            elif event["type"] == "message":
+                return {"message": event["message"]}
+            elif event["type"] == "summary":
+                # --- RAPPORT FINAL ---
+                return {
+                    "summary": event["summary"],
+                    "findings": sorted(all_findings, key=lambda x: x['score_composite'], reverse=True)
                 }
-                all_findings.append(finding)
-        
-        # --- 4. RAPPORT FINAL ---
-        total_analyzed = len(sentences_to_analyze)
-        total_suspect = len(all_findings)
-        suspicion_ratio = total_suspect / total_analyzed if total_analyzed > 0 else 0
-
-        final_report = {
-            "summary": {
-                "phrases_analysees": total_analyzed,
-                "phrases_suspectes": total_suspect,
-                "ratio_suspicion": f"{suspicion_ratio:.1%}"
-            },
-            "findings": sorted(all_findings, key=lambda x: x['score_composite'], reverse=True)
-        }
-        
-        return final_report
 
     except Exception as e:
         # Remonter l'erreur pour que FastAPI la gère
-        raise e
\ No newline at end of file
+        raise e
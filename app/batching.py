@@ -0,0 +1,158 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# ==============================================================================
+# CONFIGURATION DU MICRO-BATCHING
+#   Les appels concurrents aux modèles partagés (mode "thread") sont regroupés
+#   en un seul appel, dans la limite de MAX_BATCH_SIZE éléments et MAX_WAIT_MS d'attente.
+# ==============================================================================
+MICROBATCH_ENABLED = os.environ.get('APLAG_MICROBATCH', '1') == '1'
+MICROBATCH_MAX_BATCH_SIZE = int(os.environ.get('APLAG_MICROBATCH_MAX_BATCH_SIZE', 1024))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get('APLAG_MICROBATCH_MAX_WAIT_MS', 5))
+
+
+class _Request:
+    __slots__ = ('items', 'options', 'future')
+
+    def __init__(self, items, options):
+        self.items = items
+        self.options = options
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Collecte les demandes de plusieurs threads et les exécute ensemble.
+
+    `process_batch(items, options)` reçoit la concaténation des éléments des demandes
+    qui partagent les mêmes options et doit retourner un résultat par élément.
+    Une demande seule est exécutée telle quelle : les résultats d'une requête isolée ne changent pas.
+    """
+
+    def __init__(self, process_batch, max_batch_size=MICROBATCH_MAX_BATCH_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS, name='batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=f"aplag-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, items, options):
+        """Soumet une demande et attend son résultat (liste alignée sur `items`)."""
+        if self._closed:
+            raise RuntimeError("Le micro-batcher est arrêté.")
+        request = _Request(items, options)
+        self._queue.put(request)
+        return request.future.result()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        """Regroupe les demandes arrivées pendant la fenêtre d'attente."""
+        batch, size = [first], len(first.items)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Arrêt demandé : on traite le lot en cours puis on sort de la boucle
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request.items)
+        return batch
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            groups = {}
+            for request in self._collect(first):
+                key = tuple(sorted(request.options.items()))
+                groups.setdefault(key, []).append(request)
+
+            for requests in groups.values():
+                items = [item for request in requests for item in request.items]
+                try:
+                    results = self.process_batch(items, requests[0].options)
+                except Exception as e:
+                    for request in requests:
+                        request.future.set_exception(e)
+                    continue
+
+                start = 0
+                for request in requests:
+                    end = start + len(request.items)
+                    request.future.set_result(results[start:end])
+                    start = end
+
+
+class BatchedBiEncoder:
+    """Enveloppe d'un SentenceTransformer dont `encode` passe par un `MicroBatcher`."""
+
+    def __init__(self, model, max_batch_size=MICROBATCH_MAX_BATCH_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS):
+        self.model = model
+        self.batcher = MicroBatcher(self._encode_batch, max_batch_size, max_wait_ms, name='bi-encoder')
+
+    def _encode_batch(self, sentences, options):
+        return self.model.encode(sentences, **options)
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        if not sentences or not kwargs.get('convert_to_numpy', True) or kwargs.get('convert_to_tensor'):
+            return self.model.encode(sentences[0] if single else sentences, **kwargs)
+
+        kwargs['convert_to_numpy'] = True
+        embeddings = np.asarray(self.batcher.submit(sentences, kwargs))
+        return embeddings[0] if single else embeddings
+
+    def __getattr__(self, name):
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+class BatchedCrossEncoder:
+    """
+    Enveloppe d'un CrossEncoder dont `predict` passe par un `MicroBatcher`.
+    Les paires d'un lot regroupé sont retriées par longueur pour limiter le padding.
+    """
+
+    def __init__(self, model, max_batch_size=MICROBATCH_MAX_BATCH_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS):
+        self.model = model
+        self.batcher = MicroBatcher(self._predict_batch, max_batch_size, max_wait_ms, name='cross-encoder')
+
+    def _predict_batch(self, pairs, options):
+        order = sorted(range(len(pairs)), key=lambda p: len(pairs[p][0]) + len(pairs[p][1]))
+        sorted_scores = np.asarray(self.model.predict([pairs[p] for p in order], **options))
+        scores = np.empty_like(sorted_scores)
+        scores[order] = sorted_scores
+        return scores
+
+    def predict(self, sentences, **kwargs):
+        single = len(sentences) > 0 and isinstance(sentences[0], str)
+        if single or len(sentences) == 0 or not kwargs.get('convert_to_numpy', True) or kwargs.get('convert_to_tensor'):
+            return self.model.predict(sentences, **kwargs)
+        return np.asarray(self.batcher.submit([list(pair) for pair in sentences], kwargs))
+
+    def __getattr__(self, name):
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
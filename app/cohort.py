@@ -0,0 +1,286 @@
+import csv
+import io
+import json
+import os
+import zipfile
+
+import faiss
+import numpy as np
+
+from .analysis_logic import (
+    BI_SCORE_FLOOR, BI_SCORE_MARGIN, MIN_RERANK_K, RERANK_BATCH_SIZE, _score_hits, rerank_hits, select_candidates
+)
+from .corpus_store import CorpusStore
+from .embedding_cache import encode_texts
+from .functions.is_citation import is_citation_or_reference
+from .functions.lexical_batch import score_pairs
+from .pdf_extraction import iter_pdf_sentences
+
+# ==============================================================================
+# CONFIGURATION DE L'ANALYSE DE COHORTE
+#   Une cohorte est un lot de documents rendus ensemble (les mémoires d'une promotion) : on cherche
+#   les phrases communes à deux documents, qui ne sont pas encore dans le corpus.
+#   Toutes les phrases de la cohorte sont encodées une seule fois et placées dans un index exact temporaire ;
+#   chaque bloc de phrases y cherche ses plus proches voisins (les phrases du même document sont exclues),
+#   puis les top-k sont re-classés et notés comme pour le corpus (rerank_hits, score composite).
+# ==============================================================================
+# Phrases des autres documents re-classées pour chaque phrase
+COHORT_TOP_K = int(os.environ.get('APLAG_COHORT_TOP_K', 5))
+# Phrases cherchées dans l'index de la cohorte à la fois
+COHORT_BLOCK_SIZE = int(os.environ.get('APLAG_COHORT_BLOCK_SIZE', 1024))
+# Nombre maximal de documents d'une cohorte envoyée à l'API
+COHORT_MAX_DOCUMENTS = int(os.environ.get('APLAG_COHORT_MAX_DOCUMENTS', 500))
+# Marque les sources trouvées dans la cohorte (et non dans le corpus) dans les rapports
+COHORT_SOURCE_SUFFIX = " (cohorte)"
+
+
+class PrecomputedEmbeddings:
+    """
+    Embeddings des phrases d'une cohorte, calculés en une fois pour tous ses documents.
+    Même méthode `encode` qu'EmbeddingCache : l'analyse de chaque document sur le corpus les relit
+    au lieu de réencoder ses phrases. Une phrase inconnue est encodée par le modèle (via `fallback`
+    s'il s'agit d'un EmbeddingCache).
+    """
+
+    def __init__(self, texts, embeddings, fallback=None):
+        self.rows = {text: row for row, text in enumerate(texts)}
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.fallback = fallback
+
+    def encode(self, encoder, texts, **encode_kwargs):
+        rows = [self.rows.get(text) for text in texts]
+        missing = [p for p, row in enumerate(rows) if row is None]
+        known = [p for p, row in enumerate(rows) if row is not None]
+        computed = None
+        if missing:
+            encode_kwargs = {'show_progress_bar': False, **encode_kwargs}
+            computed = np.asarray(encode_texts(encoder, [texts[p] for p in missing], cache=self.fallback, **encode_kwargs), dtype=np.float32)
+        dim = self.embeddings.shape[1] if self.embeddings.ndim == 2 and len(self.embeddings) else computed.shape[1] if computed is not None else 0
+        result = np.empty((len(texts), dim), dtype=np.float32)
+        if known:
+            result[known] = self.embeddings[[rows[p] for p in known]]
+        if missing:
+            result[missing] = computed
+        return result
+
+
+def unique_names(names):
+    """Noms des documents, rendus uniques (« memoire.pdf », « memoire (2).pdf ») : ils désignent les sources."""
+    taken, unique = set(), []
+    for name in names:
+        root, extension = os.path.splitext(name)
+        candidate, number = name, 1
+        # Un nom déjà pris, y compris par un numéro généré (« a (2).pdf » envoyé après deux « a.pdf »)
+        while candidate in taken:
+            number += 1
+            candidate = f"{root} ({number}){extension}"
+        taken.add(candidate)
+        unique.append(candidate)
+    return unique
+
+
+def extract_cohort(documents):
+    """
+    Extrait une seule fois les phrases de chaque document (chemin ou contenu en bytes).
+    Retourne (phrases extraites, phrases retenues hors citations et références) par document.
+    """
+    extracted = [list(iter_pdf_sentences(document)) for document in documents]
+    relevant = [[s for s in sentences if not is_citation_or_reference(s)] for sentences in extracted]
+    return extracted, relevant
+
+
+def encode_cohort(bi_encoder, relevant, embedding_cache=None):
+    """Encode en un seul appel les phrases distinctes de toute la cohorte (`PrecomputedEmbeddings`)."""
+    texts = list(dict.fromkeys(s for sentences in relevant for s in sentences))
+    if not texts:
+        return PrecomputedEmbeddings([], np.zeros((0, 0), dtype=np.float32), fallback=embedding_cache)
+    embeddings = encode_texts(bi_encoder, texts, cache=embedding_cache, show_progress_bar=False)
+    return PrecomputedEmbeddings(texts, embeddings, fallback=embedding_cache)
+
+
+def cohort_neighbours(index, vectors, owners, rows, top_k=COHORT_TOP_K):
+    """
+    Top-k des phrases des autres documents pour les phrases `rows`, par similarité cosinus
+    (recherche dans `index`, IndexFlatIP des embeddings normalisés de toute la cohorte).
+    Les phrases d'un document étant contiguës, chaque document du bloc est cherché avec
+    `top_k` + (ses propres phrases) voisins, dont on retire les siennes : la mémoire dépend
+    de la taille du bloc et des documents, pas de celle de la cohorte.
+    Retourne (similarités, positions) triées par similarité décroissante ; position -1 quand
+    les autres documents ont moins de `top_k` phrases.
+    """
+    similarities = np.full((len(rows), top_k), -np.inf, dtype=np.float32)
+    positions = np.full((len(rows), top_k), -1, dtype=np.int64)
+    if top_k == 0 or not len(rows):
+        return similarities, positions
+    block_owners = owners[rows]
+    segment_starts = np.flatnonzero(np.r_[True, block_owners[1:] != block_owners[:-1]])
+    for first, last in zip(segment_starts.tolist(), [*segment_starts[1:].tolist(), len(rows)]):
+        owner = block_owners[first]
+        n_own = int(np.searchsorted(owners, owner, side='right') - np.searchsorted(owners, owner, side='left'))
+        found_similarities, found = index.search(vectors[rows[first:last]], min(top_k + n_own, index.ntotal))
+        keep = (found >= 0) & (owners[np.maximum(found, 0)] != owner)
+        # Voisins des autres documents en tête, dans l'ordre de similarité décroissante (égalités : position croissante)
+        order = np.lexsort((found, -found_similarities, ~keep), axis=-1)[:, :top_k]
+        found_similarities = np.take_along_axis(found_similarities, order, axis=1)
+        found, keep = np.take_along_axis(found, order, axis=1), np.take_along_axis(keep, order, axis=1)
+        width = found.shape[1]
+        similarities[first:last, :width] = np.where(keep, found_similarities, -np.inf)
+        positions[first:last, :width] = np.where(keep, found, -1)
+    return similarities, positions
+
+
+def compare_cohort(relevant, names, bi_encoder, embeddings, cross_encoder, min_verdict_score, top_k=COHORT_TOP_K,
+                   block_size=COHORT_BLOCK_SIZE, bi_score_floor=BI_SCORE_FLOOR, bi_score_margin=BI_SCORE_MARGIN,
+                   min_rerank_k=MIN_RERANK_K, rerank_batch_size=RERANK_BATCH_SIZE, stats=None, progress_callback=None):
+    """
+    Compare les phrases retenues de chaque document (`relevant`) à celles des autres documents de la cohorte.
+    La cascade (`bi_score_floor`, `bi_score_margin`, `min_rerank_k`) et le re-ranking sont ceux de l'analyse sur le corpus.
+    Retourne (constats par document, matrice) : les constats sont au format de l'analyse, leur source est
+    le document de la cohorte ; matrice[a][b] compte les phrases de `a` dont au moins un hit re-classé
+    dans `b` atteint `min_verdict_score`. Si `stats` est un dictionnaire, il reçoit le nombre de paires re-classées.
+    `progress_callback("cohorte", phrases traitées, phrases totales)` est appelé après chaque bloc.
+    """
+    sentences = [s for document_sentences in relevant for s in document_sentences]
+    owners = np.repeat(np.arange(len(relevant)), [len(document_sentences) for document_sentences in relevant])
+    findings = [[] for _ in relevant]
+    matrix = np.zeros((len(relevant), len(relevant)), dtype=np.int64)
+    reranked_pairs = 0
+    if sentences:
+        vectors = np.ascontiguousarray(embeddings.encode(bi_encoder, sentences), dtype=np.float32)
+        # Index temporaire de la cohorte (recherche exacte, par blocs de phrases)
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        # Store temporaire de la cohorte : une phrase par passage, le document pour source
+        store = CorpusStore.from_records(sentences, [names[owner] + COHORT_SOURCE_SUFFIX for owner in owners.tolist()])
+
+        for start in range(0, len(sentences), block_size):
+            rows = np.arange(start, min(start + block_size, len(sentences)))
+            similarities, positions = cohort_neighbours(index, vectors, owners, rows, top_k)
+            candidates = select_candidates(positions, similarities, score_floor=bi_score_floor,
+                                           score_margin=bi_score_margin, min_k=min_rerank_k)
+            block_sentences = [sentences[row] for row in rows.tolist()]
+            hits = [h or [] for h in rerank_hits(block_sentences, candidates, store, cross_encoder,
+                                                  batch_size=rerank_batch_size, all_hits=True)]
+            flat_hits = [hit for sentence_hits in hits for hit in sentence_hits]
+            reranked_pairs += len(flat_hits)
+            if progress_callback is not None:
+                progress_callback("cohorte", int(rows[-1]) + 1, len(sentences))
+            if not flat_hits:
+                continue
+
+            # Score composite de toutes les paires re-classées du bloc, en une passe
+            query_rows = np.repeat(rows, [len(sentence_hits) for sentence_hits in hits])
+            composite = score_pairs([sentences[row] for row in query_rows.tolist()], [hit['sentence'] for hit in flat_hits],
+                                    np.asarray([hit['cross_score'] for hit in flat_hits]), n=3)['composite']
+            hit_owners = owners[np.asarray([hit['corpus_id'] for hit in flat_hits], dtype=np.int64)]
+            suspect = np.flatnonzero(composite >= min_verdict_score)
+            if not len(suspect):
+                continue
+
+            # Une phrase compte une fois par document où elle a un hit suspect
+            pairs = np.unique(np.stack([query_rows[suspect], hit_owners[suspect]]), axis=1)
+            np.add.at(matrix, (owners[pairs[0]], pairs[1]), 1)
+
+            # Constat de chaque phrase suspecte : son hit de meilleur score composite
+            order = suspect[np.lexsort((-composite[suspect], query_rows[suspect]))]
+            best = order[np.r_[True, query_rows[order][1:] != query_rows[order][:-1]]]
+            best_rows = query_rows[best].tolist()
+            block_findings = _score_hits([sentences[row] for row in best_rows], [flat_hits[p] for p in best.tolist()],
+                                         store, min_verdict_score)
+            for row, finding in zip(best_rows, block_findings):
+                findings[owners[row]].append(finding)
+
+    if stats is not None:
+        stats["paires_cohorte_reclassees"] = stats.get("paires_cohorte_reclassees", 0) + reranked_pairs
+    for document_findings in findings:
+        document_findings.sort(key=lambda f: f['score_composite'], reverse=True)
+    return findings, matrix
+
+
+def cohort_report(names, relevant, matrix, cohort_findings, corpus_results=None, version_corpus=None):
+    """
+    Résultats d'une cohorte :
+      - "matrice" : documents, nombre de phrases de chaque document (ligne) retrouvées dans chaque autre (colonne)
+        et part de ses phrases ;
+      - "paires" : paires de documents qui partagent des phrases, de la plus forte part à la plus faible ;
+      - "documents" : pour chaque document, ses constats dans la cohorte et ses résultats sur le corpus
+        (`corpus_results`, ceux de `analyze_document`) quand ils ont été demandés.
+    """
+    sentence_counts = np.asarray([len(sentences) for sentences in relevant], dtype=np.int64)
+    shares = matrix / np.maximum(sentence_counts, 1)[:, None]
+    pairs = []
+    for a in range(len(names)):
+        for b in range(a + 1, len(names)):
+            if matrix[a, b] or matrix[b, a]:
+                pairs.append({
+                    "document_a": names[a], "document_b": names[b],
+                    "phrases_a_dans_b": int(matrix[a, b]), "phrases_b_dans_a": int(matrix[b, a]),
+                    "part_a": round(float(shares[a, b]), 4), "part_b": round(float(shares[b, a]), 4),
+                })
+    pairs.sort(key=lambda pair: max(pair["part_a"], pair["part_b"]), reverse=True)
+
+    documents = []
+    for a, name in enumerate(names):
+        n_suspect = len(cohort_findings[a])
+        close = [b for b in np.argsort(-matrix[a], kind='stable').tolist() if matrix[a, b] > 0]
+        documents.append({
+            "document": name,
+            "phrases_analysees": int(sentence_counts[a]),
+            "cohorte": {
+                "phrases_suspectes": n_suspect,
+                "ratio_suspicion": f"{n_suspect / sentence_counts[a]:.1%}" if sentence_counts[a] else "0.0%",
+                "documents_proches": [{"document": names[b], "phrases": int(matrix[a, b]), "part": round(float(shares[a, b]), 4)} for b in close],
+                "findings": cohort_findings[a],
+            },
+            "corpus": corpus_results[a] if corpus_results is not None else None,
+        })
+    return {
+        "summary": {
+            "documents": len(names),
+            "phrases_analysees": int(sentence_counts.sum()),
+            "paires_suspectes": len(pairs),
+        },
+        "matrice": {"documents": list(names), "phrases": matrix.tolist(), "part": np.round(shares, 4).tolist()},
+        "paires": pairs,
+        "documents": documents,
+        "version_corpus": version_corpus,
+    }
+
+
+def document_report_data(document, version_corpus=None):
+    """
+    Données du rapport (PDF ou HTML, voir report_generator.py) d'un document de la cohorte :
+    ses constats sur le corpus et dans la cohorte, réunis et triés par score composite.
+    """
+    corpus = document.get("corpus") or {}
+    findings = sorted(corpus.get("findings", []) + document["cohorte"]["findings"], key=lambda f: f['score_composite'], reverse=True)
+    n_sentences = document["phrases_analysees"]
+    n_suspect = len({finding["phrase_suspecte"] for finding in findings})
+    summary = {
+        "phrases_analysees": n_sentences,
+        "phrases_suspectes": n_suspect,
+        "ratio_suspicion": f"{n_suspect / n_sentences:.1%}" if n_sentences else "0.0%",
+    }
+    return {"summary": summary, "findings": findings, "version_corpus": version_corpus}
+
+
+def matrix_csv(report):
+    """Matrice des parts de phrases partagées au format CSV (ligne : document analysé, colonne : source)."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    names = report["matrice"]["documents"]
+    writer.writerow(["document", *names])
+    for name, row in zip(names, report["matrice"]["part"]):
+        writer.writerow([name, *row])
+    return output.getvalue()
+
+
+def cohort_archive(results, reports):
+    """Archive zip d'une cohorte : cohorte.json, matrice.csv et le rapport PDF de chaque document."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("cohorte.json", json.dumps(results, ensure_ascii=False, indent=2))
+        archive.writestr("matrice.csv", matrix_csv(results))
+        for document, report in zip(results["documents"], reports):
+            archive.writestr(f"rapports/Rapport_{document['document']}", report)
+    return buffer.getvalue()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+TEXTS_FILE = 'texts.bin'
+OFFSETS_FILE = 'offsets.npy'
+SOURCE_CODES_FILE = 'source_codes.npy'
+SOURCES_FILE = 'sources.json'
+IDS_FILE = 'ids.npy'
+
+
+def paragraph_id(text):
+    """
+    Identifiant stable d'un passage : 63 bits de l'empreinte SHA-256 de son texte.
+    Un même texte a toujours le même identifiant, quelle que soit sa position dans le corpus.
+    """
+    digest = hashlib.sha256(str(text).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') & 0x7FFF_FFFF_FFFF_FFFF
+
+
+def paragraph_ids(texts):
+    return np.fromiter((paragraph_id(text) for text in texts), dtype=np.int64, count=len(texts))
+
+
+class CorpusStore:
+    """
+    Stockage en colonnes du corpus de référence.
+
+    - texts.bin        : tous les passages encodés en UTF-8, bout à bout
+    - offsets.npy      : position de début de chaque passage dans texts.bin (n + 1 valeurs)
+    - source_codes.npy : code entier du document source de chaque passage
+    - sources.json     : titres des documents sources, indexés par code
+    - ids.npy          : identifiant stable de chaque passage (`paragraph_id`), si l'index FAISS
+                         est un IndexIDMap2 ; sans ce fichier, l'identifiant d'un passage est sa position
+
+    Au chargement, texts.bin et les tableaux sont projetés en mémoire (mmap) :
+    rien n'est copié en RAM et les pages sont partagées entre processus.
+    Les méthodes de lecture prennent des positions (celles de l'ancien `df_corpus.iloc`) ;
+    `positions_of` convertit les identifiants renvoyés par FAISS en positions.
+    """
+
+    def __init__(self, texts_blob, offsets, source_codes, sources, ids=None):
+        self.texts_blob = texts_blob
+        self.offsets = offsets
+        self.source_codes = source_codes
+        self.sources = sources
+        self.ids = ids
+        self._id_lookup = None
+
+    @classmethod
+    def from_records(cls, texts, sources, with_ids=False):
+        """
+        Construit un store en mémoire à partir de deux listes alignées (textes, titres sources).
+        `with_ids=True` calcule l'identifiant stable de chaque passage (index FAISS à identifiants).
+        """
+        encoded = [str(text).encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        texts_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        titles, source_codes = np.unique(np.asarray(sources, dtype=object).astype(str), return_inverse=True)
+        ids = paragraph_ids(texts) if with_ids else None
+        return cls(texts_blob, offsets, source_codes.astype(np.int32), titles.tolist(), ids)
+
+    @classmethod
+    def from_dataframe(cls, df, text_column, source_column, with_ids=False):
+        return cls.from_records(df[text_column].tolist(), df[source_column].tolist(), with_ids)
+
+    @classmethod
+    def load(cls, directory):
+        """Ouvre un store écrit par `save` en le projetant en mémoire."""
+        offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode='r')
+        source_codes = np.load(os.path.join(directory, SOURCE_CODES_FILE), mmap_mode='r')
+        with open(os.path.join(directory, SOURCES_FILE), encoding='utf-8') as f:
+            sources = json.load(f)
+
+        if offsets[-1] > 0:
+            texts_blob = np.memmap(os.path.join(directory, TEXTS_FILE), dtype=np.uint8, mode='r')
+        else:
+            # np.memmap refuse les fichiers vides
+            texts_blob = np.zeros(0, dtype=np.uint8)
+        ids_path = os.path.join(directory, IDS_FILE)
+        ids = np.load(ids_path, mmap_mode='r') if os.path.exists(ids_path) else None
+        return cls(texts_blob, offsets, source_codes, sources, ids)
+
+    def save(self, directory):
+        """Écrit le store dans `directory` ; chaque fichier est remplacé atomiquement."""
+        os.makedirs(directory, exist_ok=True)
+
+        def write(name, writer):
+            path = os.path.join(directory, name)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                writer(f)
+            os.replace(tmp_path, path)
+
+        write(TEXTS_FILE, lambda f: f.write(np.asarray(self.texts_blob).tobytes()))
+        write(OFFSETS_FILE, lambda f: np.save(f, np.asarray(self.offsets, dtype=np.int64)))
+        write(SOURCE_CODES_FILE, lambda f: np.save(f, np.asarray(self.source_codes, dtype=np.int32)))
+        write(SOURCES_FILE, lambda f: f.write(json.dumps(self.sources, ensure_ascii=False).encode('utf-8')))
+        if self.ids is not None:
+            write(IDS_FILE, lambda f: np.save(f, np.asarray(self.ids, dtype=np.int64)))
+        elif os.path.exists(os.path.join(directory, IDS_FILE)):
+            os.remove(os.path.join(directory, IDS_FILE))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _positions(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        # Même convention que df.iloc : un identifiant négatif compte depuis la fin
+        return np.where(ids < 0, ids + len(self), ids)
+
+    def get_texts(self, ids):
+        """Textes des passages `ids`, dans l'ordre demandé."""
+        positions = self._positions(ids)
+        starts = self.offsets[positions]
+        ends = self.offsets[positions + 1]
+        blob = self.texts_blob
+        return [bytes(blob[start:end]).decode('utf-8') for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def positions_of(self, ids):
+        """
+        Positions des passages d'identifiants `ids` (tableau de forme quelconque, par exemple
+        le résultat de `index.search`). Un identifiant inconnu ou -1 (résultat manquant) donne -1.
+        Sans identifiants stables, les identifiants FAISS sont déjà des positions.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.ids is None:
+            return ids
+        if self._id_lookup is None:
+            order = np.argsort(self.ids, kind='stable')
+            self._id_lookup = (np.asarray(self.ids)[order], order)
+        sorted_ids, order = self._id_lookup
+        if len(sorted_ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        slots = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[slots] == ids, order[slots], -1).astype(np.int64)
+
+    def positions_of_source(self, title):
+        """Positions des passages d'un document source (tableau vide si le titre est inconnu)."""
+        if title not in self.sources:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.asarray(self.source_codes) == self.sources.index(title))
+
+    def select(self, positions):
+        """Nouveau store en mémoire réduit aux passages `positions` (dans cet ordre), identifiants compris."""
+        positions = self._positions(positions)
+        ids = None if self.ids is None else np.asarray(self.ids)[positions]
+        store = CorpusStore.from_records(self.get_texts(positions), self.get_sources(positions))
+        store.ids = ids
+        return store
+
+    def get_text(self, corpus_id):
+        return self.get_texts([corpus_id])[0]
+
+    def get_sources(self, ids):
+        """Titres des documents sources des passages `ids`."""
+        codes = self.source_codes[self._positions(ids)]
+        return [self.sources[code] for code in codes.tolist()]
+
+    def get_source(self, corpus_id):
+        return self.get_sources([corpus_id])[0]
+
+    def all_texts(self):
+        return self.get_texts(np.arange(len(self)))
+
+    def to_dataframe(self, text_column, source_column):
+        """Reconstruit un DataFrame (texte, source), par exemple pour des traitements pandas hors ligne."""
+        import pandas as pd
+        ids = np.arange(len(self))
+        return pd.DataFrame({text_column: self.get_texts(ids), source_column: self.get_sources(ids)})
@@ -0,0 +1,244 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .analysis_logic import CORPUS_DIR, bi_encoder_signature
+from .sentence_cache import normalize_sentence
+
+# ==============================================================================
+# CONFIGURATION DU CACHE D'EMBEDDINGS
+#   Un répertoire par modèle et type de stockage : vectors.bin (tableau de `capacité` lignes projeté en mémoire)
+#   et index.sqlite3 (empreinte du texte -> ligne, date de dernière utilisation, compteurs).
+# ==============================================================================
+EMBEDDING_CACHE_DIR = os.path.join(CORPUS_DIR, 'cache', 'embeddings')
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get('APLAG_EMBEDDING_CACHE_MAX_MB', 1024)) * 1024 * 1024
+# float32 : vecteurs exacts, résultats identiques avec ou sans cache. float16 divise la taille par deux
+# (écart de cosinus de l'ordre de 1e-3) ; les vecteurs calculés sont alors eux aussi arrondis (voir `encode`)
+EMBEDDING_CACHE_DTYPE = os.environ.get('APLAG_EMBEDDING_CACHE_DTYPE', 'float32')
+EMBEDDING_CACHE_ENABLED = os.environ.get('APLAG_EMBEDDING_CACHE', '1') == '1'
+# Lignes réservées par put_many le temps d'écrire leurs vecteurs (clé préfixée, jamais cherchée)
+RESERVATION_PREFIX = 'reservation:'
+RESERVATION_SECONDS = 3600
+VECTORS_FILE = 'vectors.bin'
+INDEX_FILE = 'index.sqlite3'
+
+
+class EmbeddingCache:
+    """
+    Cache disque des embeddings normalisés d'un modèle (Bi-Encoder), indépendant de la version du corpus.
+
+    La clé est l'empreinte SHA-256 du texte aux espaces normalisés ; les vecteurs sont rangés dans un
+    fichier de taille fixe projeté en mémoire (float32 par défaut), dont les lignes sont attribuées
+    par l'index SQLite. Le fichier est borné par `max_bytes` : les lignes les moins récemment
+    utilisées sont réattribuées en premier. Les processus qui partagent le répertoire partagent le cache.
+    """
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR, max_bytes=EMBEDDING_CACHE_MAX_BYTES, dtype=EMBEDDING_CACHE_DTYPE):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.directory = os.path.join(cache_dir, hashlib.sha256(f"{model_name}|{self.dtype.name}".encode()).hexdigest()[:16])
+        self._lock = threading.Lock()
+        self._vectors = None
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    slot INTEGER NOT NULL UNIQUE,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('model', ?)", (model_name,))
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.directory, INDEX_FILE), timeout=30)
+
+    def make_key(self, text):
+        return hashlib.sha256(normalize_sentence(text).encode()).hexdigest()
+
+    def _open_vectors(self, conn, dim=None):
+        """
+        Projette le fichier des vecteurs ; il est créé (de façon creuse) au premier enregistrement,
+        une fois la dimension connue. Un cache créé avec une autre dimension ou une autre
+        taille maximale est vidé et recréé. Retourne None tant qu'aucun vecteur n'a été enregistré.
+        """
+        meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+        layout = (int(meta['dim']), meta['dtype'], int(meta['capacity'])) if 'dim' in meta else None
+        dim = dim or (layout[0] if layout else None)
+        if dim is None:
+            return None
+        expected = (dim, self.dtype.name, max(1, self.max_bytes // (dim * self.dtype.itemsize)))
+        if layout != expected:
+            conn.execute("DELETE FROM embeddings")
+            with open(os.path.join(self.directory, VECTORS_FILE), 'wb') as f:
+                f.truncate(expected[0] * expected[2] * self.dtype.itemsize)
+            conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                             [('dim', str(dim)), ('dtype', self.dtype.name), ('capacity', str(expected[2]))])
+            self._vectors = None
+        if self._vectors is None:
+            self._vectors = np.memmap(os.path.join(self.directory, VECTORS_FILE), dtype=self.dtype, mode='r+',
+                                      shape=(expected[2], dim))
+        return self._vectors
+
+    @staticmethod
+    def _slots(conn, keys):
+        """{clé: ligne} des clés présentes dans le cache."""
+        slots = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            slots.update(conn.execute(f"SELECT key, slot FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall())
+        return slots
+
+    def get_many(self, keys):
+        """Retourne {clé: embedding float32} pour les clés présentes et met à jour les compteurs."""
+        found = {}
+        unique_keys = list(set(keys))
+        with self._lock, self._connect() as conn:
+            vectors = self._open_vectors(conn)
+            slots = self._slots(conn, unique_keys) if vectors is not None else {}
+            if slots:
+                rows = np.asarray(vectors[list(slots.values())], dtype=np.float32)
+                # Une ligne réattribuée par un autre processus pendant la lecture compte comme un échec
+                current = self._slots(conn, list(slots))
+                found = {key: row for (key, slot), row in zip(slots.items(), rows) if current.get(key) == slot}
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(time.time(), key) for key in found])
+            hits = sum(1 for key in keys if key in found)
+            self._increment(conn, hits=hits, misses=len(keys) - hits)
+        return found
+
+    def put_many(self, keys, embeddings):
+        """
+        Enregistre les embeddings (alignés sur `keys`) des clés absentes du cache. Les lignes libres sont
+        prises en premier, puis celles des entrées les moins récemment utilisées (éviction) :
+        les lignes occupées sont toujours les `n` premières du fichier.
+        Les lignes sont d'abord réservées (clés évincées retirées, transaction validée), puis les vecteurs
+        écrits, puis les clés publiées : un lecteur qui détient encore l'ancienne attribution d'une ligne
+        la voit retirée quand il la revérifie (`get_many`) et ne retient jamais le vecteur d'une autre phrase.
+        """
+        if len(keys) == 0:
+            return
+        embeddings = np.asarray(embeddings)
+        with self._lock:
+            reserved = self._reserve_slots(keys, embeddings.shape[1])
+            if not reserved:
+                return
+            vectors = self._vectors
+            vectors[[slot for _, _, slot in reserved]] = embeddings[[p for _, p, _ in reserved]].astype(self.dtype)
+            vectors.flush()
+            with self._connect() as conn:
+                now = time.time()
+                for key, _, slot in reserved:
+                    try:
+                        conn.execute("UPDATE embeddings SET key = ?, last_used = ? WHERE slot = ?", (key, now, slot))
+                    except sqlite3.IntegrityError:
+                        # Clé enregistrée entre-temps par un autre processus : la ligne réservée sera évincée en premier
+                        conn.execute("UPDATE embeddings SET last_used = 0 WHERE slot = ?", (slot,))
+
+    def _reserve_slots(self, keys, dim):
+        """
+        Réserve une ligne par clé absente du cache, en une transaction : les lignes prises reçoivent une clé
+        de réservation, datée dans le futur pour ne pas être évincée pendant l'écriture (ni indéfiniment
+        si le processus s'arrête avant de publier ses clés). Retourne [(clé, position dans `keys`, ligne)].
+        """
+        with self._connect() as conn:
+            # Verrou d'écriture SQLite : deux processus ne se voient jamais attribuer la même ligne
+            conn.execute("BEGIN IMMEDIATE")
+            vectors = self._open_vectors(conn, dim=dim)
+            first = {}
+            for p, key in enumerate(keys):
+                first.setdefault(key, p)
+            present = self._slots(conn, list(first))
+            new = [(key, p) for key, p in first.items() if key not in present][-len(vectors):]
+            if not new:
+                return []
+
+            (used,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            slots = list(range(used, min(len(vectors), used + len(new))))
+            evicted = []
+            if len(slots) < len(new):
+                evicted = conn.execute(
+                    "SELECT key, slot FROM embeddings ORDER BY last_used LIMIT ?", (len(new) - len(slots),)
+                ).fetchall()
+                conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in evicted])
+                slots += [slot for _, slot in evicted]
+
+            reserved_until = time.time() + RESERVATION_SECONDS
+            conn.executemany("INSERT INTO embeddings (key, slot, last_used) VALUES (?, ?, ?)",
+                             [(f"{RESERVATION_PREFIX}{uuid.uuid4().hex}", slot, reserved_until) for slot in slots])
+            self._increment(conn, evictions=len(evicted))
+        return [(key, p, slot) for (key, p), slot in zip(new, slots)]
+
+    def encode(self, encoder, texts, **encode_kwargs):
+        """
+        Embeddings normalisés (float32) de `texts` : ceux du cache sont relus, les autres sont calculés
+        par `encoder.encode` (une seule fois par texte distinct) puis enregistrés. Les vecteurs calculés
+        sont retournés à la précision du cache, comme ils seront relus : le résultat d'une phrase
+        ne dépend pas de sa présence dans le cache.
+        """
+        keys = [self.make_key(text) for text in texts]
+        found = self.get_many(keys)
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            encode_kwargs = {'show_progress_bar': False, **encode_kwargs}
+            computed = encoder.encode(list(missing.values()), convert_to_numpy=True, normalize_embeddings=True, **encode_kwargs)
+            computed = np.asarray(computed, dtype=np.float32).astype(self.dtype).astype(np.float32)
+            found.update(zip(missing, computed))
+            self.put_many(list(missing), computed)
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+    def _increment(self, conn, **counters):
+        conn.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(counters.items())
+        )
+
+    def stats(self):
+        """Compteurs cumulés, taux de succès et occupation du cache."""
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+            (entries,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            "modele": self.model_name,
+            "entrees": entries,
+            "capacite": int(meta.get('capacity', 0)),
+            "type": meta.get('dtype', self.dtype.name),
+            "succes": hits,
+            "echecs": misses,
+            "evictions": counters.get('evictions', 0),
+            "taux_succes": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def corpus_embedding_cache():
+    """
+    Cache des embeddings des passages pour les scripts hors ligne (ingestion, reconstruction d'index) :
+    modèle PyTorch de ces scripts, stockage float32 pour que l'index reçoive les vecteurs exacts.
+    None si le cache est désactivé (APLAG_EMBEDDING_CACHE=0).
+    """
+    return EmbeddingCache(bi_encoder_signature('torch'), dtype='float32') if EMBEDDING_CACHE_ENABLED else None
+
+
+def encode_texts(encoder, texts, cache=None, **encode_kwargs):
+    """Embeddings normalisés de `texts`, par le cache s'il est fourni."""
+    if cache is not None:
+        return cache.encode(encoder, texts, **encode_kwargs)
+    return encoder.encode(texts, convert_to_numpy=True, normalize_embeddings=True, **encode_kwargs)
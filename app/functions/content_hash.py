@@ -0,0 +1,18 @@
+import hashlib
+def sha256_file(path, chunk_size=1024 * 1024):
+    """Calcule l'empreinte SHA-256 d'un fichier sans le charger entièrement en mémoire."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def sha256_bytes(data):
+    """Calcule l'empreinte SHA-256 d'un contenu en mémoire."""
+    return hashlib.sha256(data).hexdigest()
+
+def sha256_document(document):
+    """Empreinte d'un document fourni par son chemin ou par son contenu (bytes)."""
+    if isinstance(document, (bytes, bytearray, memoryview)):
+        return sha256_bytes(document)
+    return sha256_file(document)
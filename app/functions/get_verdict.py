@@ -1,8 +1,13 @@
 import difflib
+import html
 
 def get_highlighted_diff_html(s1, s2):
-    """Génère un affichage HTML des différences entre deux chaînes."""
-    s1_words, s2_words = s1.split(), s2.split()
+    """
+    Génère un affichage HTML des différences entre deux chaînes.
+    Les mots viennent du PDF envoyé : ils sont échappés avant d'être balisés,
+    le gabarit du rapport insérant ce HTML tel quel (filtre `safe`).
+    """
+    s1_words, s2_words = [html.escape(word) for word in s1.split()], [html.escape(word) for word in s2.split()]
     matcher = difflib.SequenceMatcher(None, s1_words, s2_words)
     output1, output2 = [], []
     
@@ -19,21 +24,26 @@ def get_highlighted_diff_html(s1, s2):
 
     return " ".join(output1), " ".join(output2)
 
+# Poids du score composite et seuils des verdicts (du plus au moins suspect)
+W_CROSS, W_LEV, W_JAC, W_NGRAM = 0.65, 0.15, 0.15, 0.15
+VERDICT_THRESHOLDS = (
+    (0.85, "Texte très similaire / Copié-collé"),
+    (0.7, "Forte suspicion de paraphrase"),
+    (0.6, "Similarité thématique, potentiellement paraphrasé"),
+)
+NOT_SUSPECT = "Non suspect"
+
 def get_final_verdict(cross_score, lexical_metrics, ngram_score):
     """Calcule un score composite et retourne un verdict."""
-    W_CROSS, W_LEV, W_JAC, W_NGRAM = 0.65, 0.15, 0.15, 0.15
-    
     composite_score = (W_CROSS * cross_score) + \
                       (W_LEV * lexical_metrics['levenshtein']) + \
                       (W_JAC * lexical_metrics['jaccard']) + \
                       (W_NGRAM * ngram_score)
 
-    verdict = "Non suspect"
-    if composite_score >= 0.85:
-        verdict = "Texte très similaire / Copié-collé"
-    elif 0.7 <= composite_score < 0.85:
-        verdict = "Forte suspicion de paraphrase"
-    elif 0.6 <= composite_score < 0.7:
-        verdict = "Similarité thématique, potentiellement paraphrasé"
+    verdict = NOT_SUSPECT
+    for threshold, label in VERDICT_THRESHOLDS:
+        if composite_score >= threshold:
+            verdict = label
+            break
         
     return verdict, composite_score
\ No newline at end of file
@@ -0,0 +1,95 @@
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.process import cpdist
+
+from .get_verdict import NOT_SUSPECT, VERDICT_THRESHOLDS, W_CROSS, W_JAC, W_LEV, W_NGRAM
+
+
+def _token_sets(sentences, n):
+    """
+    Ensembles de tokens et de n-grammes de tokens de chaque phrase, chaque phrase n'étant découpée qu'une fois.
+    Un n-gramme est le tuple de ses tokens : mêmes ensembles que les chaînes jointes par ' ' des fonctions
+    d'origine (les tokens de split() ne contiennent pas d'espace), sans collision possible.
+    """
+    token_sets, ngram_sets = [], []
+    for sentence in sentences:
+        tokens = sentence.lower().split()
+        token_sets.append(frozenset(tokens))
+        ngram_sets.append(frozenset(zip(*(tokens[i:] for i in range(n)))))
+    return token_sets, ngram_sets
+
+
+def _pair_jaccard(sets, query_ids, candidate_ids, empty_is_zero):
+    """
+    Jaccard des ensembles de chaque paire (sets[query_ids[p]], sets[candidate_ids[p]]) : seules les
+    intersections sont calculées par paire, tailles, unions et divisions le sont sur des tableaux.
+    """
+    n_pairs = len(query_ids)
+    query_sets = [sets[i] for i in query_ids]
+    candidate_sets = [sets[i] for i in candidate_ids]
+    intersection = np.fromiter(map(len, map(frozenset.intersection, query_sets, candidate_sets)),
+                               dtype=np.int64, count=n_pairs)
+    sizes = np.fromiter(map(len, sets), dtype=np.int64, count=len(sets))
+    q_sizes, c_sizes = sizes[query_ids], sizes[candidate_ids]
+    union = q_sizes + c_sizes - intersection
+    empty = (union == 0) | ((q_sizes == 0) | (c_sizes == 0) if empty_is_zero else False)
+    return np.where(empty, 0.0, intersection / np.maximum(union, 1))
+
+
+def composite_scores(cross_scores, levenshtein, jaccard, ngram):
+    """
+    Score composite de `get_final_verdict`, pour des tableaux de scores.
+    Chaque terme est ajouté dans la précision du score du Cross-Encoder (float32 en général),
+    comme le calcul scalaire : les résultats sont identiques.
+    """
+    composite = W_CROSS * np.asarray(cross_scores)
+    for weight, metric in ((W_LEV, levenshtein), (W_JAC, jaccard), (W_NGRAM, ngram)):
+        composite = composite + (weight * np.asarray(metric)).astype(composite.dtype)
+    return composite
+
+
+def verdicts(composite):
+    """Verdict de chaque score composite (mêmes seuils que `get_final_verdict`)."""
+    conditions = [composite >= threshold for threshold, _ in VERDICT_THRESHOLDS]
+    return np.select(conditions, [label for _, label in VERDICT_THRESHOLDS], default=NOT_SUSPECT).tolist()
+
+
+def lexical_scores(queries, candidates, n=3):
+    """
+    Métriques lexicales de toutes les paires (queries[p], candidates[p]) en une passe : chaque phrase
+    distincte est découpée une fois (une phrase revient dans les k hits de ses voisines) et les ratios
+    de Levenshtein sont calculés par rapidfuzz. Retourne des tableaux alignés : levenshtein, jaccard, ngram.
+    Mêmes valeurs que calculate_lexical_metrics et calculate_ngram_jaccard.
+    """
+    if not queries:
+        empty = np.zeros(0)
+        return {"levenshtein": empty, "jaccard": empty, "ngram": empty}
+
+    sentences, sentence_ids = [], {}
+    for sentence in (*queries, *candidates):
+        if sentence not in sentence_ids:
+            sentence_ids[sentence] = len(sentences)
+            sentences.append(sentence)
+    query_ids = np.array([sentence_ids[s] for s in queries], dtype=np.int64)
+    candidate_ids = np.array([sentence_ids[s] for s in candidates], dtype=np.int64)
+
+    token_sets, ngram_sets = _token_sets(sentences, n)
+    return {
+        "levenshtein": cpdist(queries, candidates, scorer=fuzz.ratio, dtype=np.float64) / 100,
+        "jaccard": _pair_jaccard(token_sets, query_ids, candidate_ids, empty_is_zero=False),
+        "ngram": _pair_jaccard(ngram_sets, query_ids, candidate_ids, empty_is_zero=True),
+    }
+
+
+def score_pairs(queries, candidates, cross_scores, n=3):
+    """
+    Métriques lexicales (`lexical_scores`), score composite et verdict de toutes les paires
+    (queries[p], candidates[p]) d'un document, en une seule passe.
+    Retourne des tableaux alignés sur les paires : levenshtein, jaccard, ngram, composite et verdicts.
+    Mêmes valeurs que calculate_lexical_metrics, calculate_ngram_jaccard et get_final_verdict.
+    """
+    scores = lexical_scores(queries, candidates, n)
+    if not queries:
+        return {**scores, "composite": np.zeros(0), "verdicts": []}
+    composite = composite_scores(cross_scores, scores["levenshtein"], scores["jaccard"], scores["ngram"])
+    return {**scores, "composite": composite, "verdicts": verdicts(composite)}
@@ -0,0 +1,208 @@
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'ivf-flat', 'ivf-sq8', 'ivf-pq', 'hnsw')
+
+
+def default_nlist(n_vectors):
+    """Nombre de listes IVF par défaut : ~4·√n, borné pour garder assez de points d'entraînement par liste."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39 or 1))
+
+
+def build_index(embeddings, index_type='flat', metric=faiss.METRIC_INNER_PRODUCT, nlist=None,
+                pq_m=48, hnsw_m=32, ef_construction=200, train_size=200_000, seed=0, ids=None):
+    """
+    Construit un index FAISS du type demandé à partir des embeddings du corpus.
+    Les vecteurs sont ajoutés dans l'ordre : sans `ids`, la position d'un passage dans le corpus
+    reste son identifiant dans l'index ; avec `ids` (identifiants stables du CorpusStore),
+    l'index est enveloppé dans un IndexIDMap2.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_vectors, dim = embeddings.shape
+
+    if index_type == 'flat':
+        index = faiss.IndexFlat(dim, metric)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ('ivf-flat', 'ivf-sq8', 'ivf-pq'):
+        nlist = nlist or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlat(dim, metric)
+        if index_type == 'ivf-flat':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        elif index_type == 'ivf-sq8':
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit, metric)
+        else:
+            if dim % pq_m != 0:
+                raise ValueError(f"La dimension {dim} doit être divisible par pq_m={pq_m}.")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8, metric)
+    else:
+        raise ValueError(f"Type d'index inconnu : {index_type} (attendu : {', '.join(INDEX_TYPES)})")
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = embeddings if n_vectors <= train_size else embeddings[rng.choice(n_vectors, train_size, replace=False)]
+        index.train(sample)
+
+    if ids is not None:
+        return with_id_map(index, embeddings, ids)
+    index.add(embeddings)
+    return index
+
+
+def is_id_mapped(index):
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def base_index(index):
+    """Index effectif (IVF, HNSW, flat...), sous l'éventuelle enveloppe à identifiants."""
+    inner = faiss.downcast_index(index)
+    return faiss.downcast_index(inner.index) if is_id_mapped(inner) else inner
+
+
+def index_ids(index):
+    """Identifiants des vecteurs d'un index, dans leur ordre d'ajout (positions pour un index simple)."""
+    if is_id_mapped(index):
+        return faiss.vector_to_array(faiss.downcast_index(index).id_map).astype(np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def with_id_map(index, embeddings, ids):
+    """
+    IndexIDMap2 contenant `embeddings` sous les identifiants `ids`, construit sur une copie vide
+    de `index` : un index IVF déjà entraîné conserve son entraînement.
+    """
+    base = faiss.clone_index(faiss.downcast_index(index))
+    base.reset()
+    id_map = faiss.IndexIDMap2(base)
+    id_map.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    return id_map
+
+
+def remove_from_index(index, ids):
+    """Retire des vecteurs par identifiant ; retourne le nombre de vecteurs retirés."""
+    if not is_id_mapped(index):
+        raise ValueError("Seul un index à identifiants (IndexIDMap2) permet de retirer des passages : lancez d'abord `manage_corpus.py migrate-ids`.")
+    if isinstance(base_index(index), faiss.IndexHNSW):
+        raise ValueError("Un index HNSW ne permet pas de retirer des vecteurs : reconstruisez-le avec build_index.py.")
+    return index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """
+    Règle les paramètres de recherche (nprobe pour IVF, efSearch pour HNSW).
+    Les paramètres qui ne s'appliquent pas au type d'index sont ignorés.
+    """
+    params = faiss.ParameterSpace()
+    for name, value in (('nprobe', nprobe), ('efSearch', ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+    return index
+
+
+def reconstruct_embeddings(index):
+    """
+    Relit les vecteurs stockés dans un index exact (flat, éventuellement à identifiants)
+    pour reconstruire un autre type d'index. Les vecteurs sont dans l'ordre d'ajout, celui du corpus.
+    """
+    flat = base_index(index)
+    if not isinstance(flat, faiss.IndexFlat):
+        raise ValueError("Seul un index exact (flat) permet de relire les embeddings ; réencodez le corpus.")
+    return flat.reconstruct_n(0, flat.ntotal)
+
+
+def read_index_mmap(path):
+    """
+    Ouvre un index en lecture seule en projetant ses vecteurs en mémoire (mmap) : les processus
+    qui servent le même fichier partagent ses pages au lieu d'en garder chacun une copie.
+    Un tel index ne peut pas être modifié (ajout, retrait).
+    """
+    # Vecteurs des index flat, HNSW et des enveloppes à identifiants
+    index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    if isinstance(base_index(index), faiss.IndexIVF):
+        # Les listes inversées d'un IVF se projettent avec IO_FLAG_MMAP (OnDiskInvertedLists) ;
+        # les deux options ne se combinent pas, d'où la seconde lecture
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return index
+
+
+def describe_index(index):
+    """Résumé lisible du type et de la taille d'un index."""
+    inner = faiss.downcast_index(index)
+    name = type(inner).__name__
+    if is_id_mapped(inner):
+        name = f"{name}[{type(base_index(inner)).__name__}]"
+    return f"{name} (d={index.d}, n={index.ntotal}, métrique={'IP' if index.metric_type == faiss.METRIC_INNER_PRODUCT else 'L2'})"
+
+
+def check_consistency(index, store, bi_encoder=None, sample=0, seed=0):
+    """
+    Vérifie que l'index FAISS et le CorpusStore décrivent les mêmes passages.
+    Retourne la liste des problèmes détectés (vide si tout est cohérent).
+
+    - même nombre de vecteurs et de passages ;
+    - index à identifiants : identifiants uniques, égaux à `paragraph_id(texte)`,
+      et mêmes identifiants dans l'index et dans le store ;
+    - aucun texte en double dans le corpus ;
+    - avec `bi_encoder` et `sample > 0` : les vecteurs stockés d'un échantillon de passages
+      correspondent au réencodage de leur texte (index exact uniquement).
+    """
+    from .corpus_store import paragraph_ids
+
+    problems = []
+    if index.ntotal != len(store):
+        problems.append(f"L'index contient {index.ntotal} vecteurs pour {len(store)} passages.")
+
+    texts = store.all_texts()
+    expected_ids = paragraph_ids(texts)
+    duplicates = len(expected_ids) - len(np.unique(expected_ids))
+    if duplicates:
+        problems.append(f"{duplicates} passage(s) en double dans le corpus.")
+
+    if is_id_mapped(index):
+        if store.ids is None:
+            problems.append("L'index est à identifiants mais le store n'a pas de fichier ids.npy.")
+            return problems
+        store_ids = np.asarray(store.ids)
+        if not np.array_equal(store_ids, expected_ids):
+            problems.append(f"{int(np.sum(store_ids != expected_ids))} identifiant(s) du store ne correspondent pas au texte de leur passage.")
+        ids = index_ids(index)
+        if len(np.unique(ids)) != len(ids):
+            problems.append(f"{len(ids) - len(np.unique(ids))} identifiant(s) en double dans l'index.")
+        missing = np.setdiff1d(store_ids, ids)
+        orphans = np.setdiff1d(ids, store_ids)
+        if len(missing):
+            problems.append(f"{len(missing)} passage(s) du store absents de l'index.")
+        if len(orphans):
+            problems.append(f"{len(orphans)} vecteur(s) de l'index sans passage dans le store.")
+    elif store.ids is not None:
+        problems.append("Le store a des identifiants stables mais l'index est positionnel.")
+
+    if bi_encoder is not None and sample > 0 and not problems:
+        try:
+            embeddings = reconstruct_embeddings(index)
+        except ValueError as e:
+            problems.append(f"Vérification des vecteurs impossible : {e}")
+            return problems
+        rng = np.random.default_rng(seed)
+        positions = rng.choice(len(store), min(sample, len(store)), replace=False)
+        if is_id_mapped(index):
+            # Ordre d'ajout dans l'index -> position dans le store
+            vector_positions = store.positions_of(index_ids(index))
+            rows = np.empty(len(store), dtype=np.int64)
+            rows[vector_positions] = np.arange(len(vector_positions))
+        else:
+            rows = np.arange(len(store))
+        encoded = bi_encoder.encode(store.get_texts(positions), convert_to_numpy=True,
+                                    show_progress_bar=False, normalize_embeddings=True)
+        similarities = np.sum(encoded * embeddings[rows[positions]], axis=1)
+        mismatched = int(np.sum(similarities < 0.99))
+        if mismatched:
+            problems.append(f"{mismatched} vecteur(s) sur {len(positions)} ne correspondent pas au texte de leur passage.")
+    return problems
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+from .analysis_logic import CORPUS_DIR
+from .workers import PoolSaturatedError, _process_models, analyze_and_render, analyze_and_render_cohort
+
+# ==============================================================================
+# CONFIGURATION DES TÂCHES ASYNCHRONES
+# ==============================================================================
+JOBS_DIR = os.path.join(CORPUS_DIR, 'jobs')
+JOBS_DB_PATH = os.path.join(JOBS_DIR, 'jobs.sqlite3')
+# Nombre de tâches exécutées en parallèle dans le pool d'analyse
+JOBS_CONCURRENCY = int(os.environ.get('APLAG_JOBS_CONCURRENCY', 1))
+# Délai avant de retenter une tâche quand le pool d'analyse est saturé
+JOBS_RETRY_DELAY = float(os.environ.get('APLAG_JOBS_RETRY_DELAY', 5))
+
+STATUS_PENDING = 'en_attente'
+STATUS_RUNNING = 'en_cours'
+STATUS_DONE = 'termine'
+STATUS_FAILED = 'erreur'
+
+# Une tâche analyse un document (upload_path : le PDF) ou une cohorte
+# (upload_path : un dossier avec les PDF et COHORT_MANIFEST, voir `write_cohort_job`)
+KIND_DOCUMENT = 'document'
+KIND_COHORT = 'cohorte'
+COHORT_MANIFEST = 'cohorte.json'
+
+
+class JobStore:
+    """
+    Stockage SQLite des tâches d'analyse.
+    Chaque méthode ouvre sa propre connexion : le store peut être utilisé
+    depuis la boucle d'événements comme depuis un thread ou un processus du pool.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    kind TEXT NOT NULL DEFAULT 'document',
+                    upload_path TEXT NOT NULL,
+                    min_verdict_score REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress_done INTEGER NOT NULL DEFAULT 0,
+                    progress_total INTEGER NOT NULL DEFAULT 0,
+                    stage_timings TEXT NOT NULL DEFAULT '{}',
+                    result_json TEXT,
+                    report_path TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    owner_pid INTEGER
+                )
+            """)
+            # Stores créés avant les tâches de cohorte et le suivi du processus qui exécute chaque tâche
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'kind' not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT '{KIND_DOCUMENT}'")
+            if 'owner_pid' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, filename, upload_path, min_verdict_score, job_id=None, kind=KIND_DOCUMENT):
+        """Enregistre une nouvelle tâche en attente et retourne son identifiant."""
+        job_id = job_id or uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, kind, upload_path, min_verdict_score, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, kind, upload_path, min_verdict_score, STATUS_PENDING, time.time())
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Retourne la tâche sous forme de dictionnaire, ou None si elle n'existe pas."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['stage_timings'] = json.loads(job['stage_timings'])
+        return job
+
+    def update(self, job_id, **fields):
+        if 'stage_timings' in fields:
+            fields['stage_timings'] = json.dumps(fields['stage_timings'])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim_next(self):
+        """
+        Passe atomiquement la plus ancienne tâche en attente au statut "en cours" et retourne son id.
+        La tâche est attribuée au processus appelant (le worker de l'API dont le JobRunner l'exécute).
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (STATUS_PENDING,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, owner_pid = ? WHERE id = ?",
+                    (STATUS_RUNNING, time.time(), os.getpid(), row['id'])
+                )
+            conn.execute("COMMIT")
+            return row['id'] if row is not None else None
+        finally:
+            conn.close()
+
+    def count_by_status(self):
+        """Nombre de tâches par statut."""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def requeue_interrupted(self):
+        """
+        Remet en attente les tâches interrompues par un arrêt du serveur ou d'un worker : celles dont
+        le processus n'existe plus. Les tâches des autres workers en vie (gunicorn) continuent.
+        """
+        with self._connect() as conn:
+            running = conn.execute("SELECT id, owner_pid FROM jobs WHERE status = ?", (STATUS_RUNNING,)).fetchall()
+            interrupted = [(STATUS_PENDING, row['id'], STATUS_RUNNING, row['owner_pid'])
+                           for row in running if not _process_alive(row['owner_pid'])]
+            # Sauf si la tâche a été terminée ou reprise entre-temps
+            conn.executemany(
+                "UPDATE jobs SET status = ?, stage = NULL, progress_done = 0, owner_pid = NULL WHERE id = ? AND status = ? AND owner_pid IS ?",
+                interrupted
+            )
+        return len(interrupted)
+
+
+def _process_alive(pid):
+    """Vrai si le processus `pid` existe encore (None : tâche d'un store antérieur au suivi des processus)."""
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobProgress:
+    """
+    Callback de progression : enregistre l'avancement et la durée de chaque étape de l'analyse.
+    Les étapes se répètent pour chaque paquet de phrases : leurs durées sont cumulées.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.stage = None
+        self.stage_start = None
+        self.timings = {}
+
+    def __call__(self, stage, done=0, total=0):
+        now = time.perf_counter()
+        if stage != self.stage:
+            self._close_stage(now)
+            self.stage, self.stage_start = stage, now
+        self.store.update(self.job_id, stage=stage, progress_done=done, progress_total=total, stage_timings=self.timings)
+
+    def _close_stage(self, now):
+        if self.stage is not None:
+            self.timings[self.stage] = round(self.timings.get(self.stage, 0) + now - self.stage_start, 3)
+
+    def finish(self):
+        self._close_stage(time.perf_counter())
+        self.stage = None
+        return self.timings
+
+
+def write_cohort_job(directory, uploads, names, with_corpus=True, archive=True):
+    """
+    Enregistre les documents d'une tâche de cohorte dans `directory` : un PDF par document
+    (`uploads` : fichiers ouverts, copiés sous un nom numéroté) et COHORT_MANIFEST (noms des documents, options).
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for position, upload in enumerate(uploads):
+        paths.append(f"{position:04d}.pdf")
+        with open(os.path.join(directory, paths[-1]), "wb") as buffer:
+            shutil.copyfileobj(upload, buffer)
+    manifest = {"documents": paths, "noms": list(names), "corpus": with_corpus, "archive": archive}
+    with open(os.path.join(directory, COHORT_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+
+def _run_cohort(job, output_path, models, progress):
+    """Analyse de la cohorte enregistrée par `write_cohort_job` (voir `analyze_and_render_cohort`)."""
+    with open(os.path.join(job['upload_path'], COHORT_MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    return analyze_and_render_cohort(
+        [os.path.join(job['upload_path'], path) for path in manifest['documents']],
+        manifest['noms'],
+        job['min_verdict_score'],
+        models=models,
+        with_corpus=manifest['corpus'],
+        output_path=os.path.splitext(output_path)[0] + ".zip" if manifest['archive'] else None,
+        progress_callback=progress
+    )
+
+
+def run_job(job_id, db_path=JOBS_DB_PATH, models=None):
+    """
+    Exécute une tâche dans le pool d'analyse : analyse (ou cache), rendu du rapport
+    (l'archive zip des rapports pour une cohorte) puis enregistrement du résultat dans le store.
+    """
+    models = models if models is not None else _process_models
+    store = JobStore(db_path)
+    job = store.get(job_id)
+    progress = JobProgress(store, job_id)
+    output_path = os.path.join(os.path.dirname(db_path), f"{job_id}_rapport.pdf")
+
+    try:
+        if job['kind'] == KIND_COHORT:
+            analysis_results, report_path = _run_cohort(job, output_path, models, progress)
+        else:
+            analysis_results, report_path = analyze_and_render(
+                job['upload_path'],
+                job['filename'],
+                job['min_verdict_score'],
+                models=models,
+                output_path=output_path,
+                progress_callback=progress
+            )
+
+        store.update(
+            job_id,
+            status=STATUS_DONE,
+            stage=None,
+            stage_timings=progress.finish(),
+            result_json=json.dumps(analysis_results, ensure_ascii=False),
+            report_path=report_path,
+            finished_at=time.time()
+        )
+    except Exception as e:
+        store.update(job_id, status=STATUS_FAILED, stage_timings=progress.finish(), error=str(e), finished_at=time.time())
+
+
+class JobRunner:
+    """
+    Distribue les tâches en attente du store vers le pool d'analyse.
+    La file d'attente est le store lui-même : elle n'est pas bornée
+    et survit aux redémarrages de l'API.
+    """
+
+    def __init__(self, store, worker_pool, concurrency=JOBS_CONCURRENCY):
+        self.store = store
+        self.worker_pool = worker_pool
+        self.concurrency = concurrency
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            print(f"{requeued} tâche(s) interrompue(s) remise(s) en attente.")
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.concurrency)]
+
+    def notify(self):
+        """Signale qu'une nouvelle tâche vient d'être soumise."""
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                # BEGIN IMMEDIATE peut attendre le verrou d'écriture : hors de la boucle d'événements
+                job_id = await asyncio.to_thread(self.store.claim_next)
+            except Exception as e:
+                print(f"Échec de la lecture des tâches en attente : {e}")
+                await asyncio.sleep(JOBS_RETRY_DELAY)
+                continue
+            if job_id is None:
+                await self._wakeup.wait()
+                continue
+
+            while True:
+                try:
+                    await self.worker_pool.run(run_job, job_id, self.store.db_path)
+                    break
+                except PoolSaturatedError:
+                    await asyncio.sleep(JOBS_RETRY_DELAY)
+                except Exception as e:
+                    # Pool arrêté ou cassé (rechargement du corpus, processus tué) : run_job n'a pas pu
+                    # enregistrer l'échec, la tâche ne doit pas rester "en cours" ; le distributeur continue
+                    print(f"Échec de la tâche {job_id} : {e}")
+                    try:
+                        await asyncio.to_thread(self.store.update, job_id, status=STATUS_FAILED, stage=None,
+                                                error=f"{type(e).__name__}: {e}", finished_at=time.time())
+                    except Exception as update_error:
+                        print(f"Échec de l'enregistrement de l'erreur de la tâche {job_id} : {update_error}")
+                    break
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,15 +1,98 @@
+import asyncio
+import io
+import json
 import os
 import shutil
+import time
 import uuid
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from urllib.parse import quote
+from fastapi import BackgroundTasks, FastAPI, UploadFile, File, HTTPException, Header, Request
 from contextlib import asynccontextmanager
-from fastapi.responses import FileResponse
+from functools import partial
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 
-# Importer la logique depuis le fichier analysis_logic.py
-from  .analysis_logic import load_bi_encoder,load_corpus_dataframe, load_cross_encoder, load_faiss_index, analyze_pdf_for_plagiarism
-from .report_generator import create_html_report, generate_pdf_report
+# Le travail CPU (analyse, rendu) est délégué au pool défini dans workers.py
+from .workers import WorkerPool, RenderPool, PoolSaturatedError, EXECUTOR_KIND, PRELOAD, RETRY_AFTER_SECONDS, analyze_document, stream_analysis, load_models, load_corpus_resources, preload_resources
+from .report_generator import render_report
+from .jobs import JobStore, JobRunner, JOBS_DIR, KIND_COHORT, STATUS_DONE, write_cohort_job
+from .snapshots import read_manifest, resolve_snapshot
+from .functions.content_hash import sha256_bytes
+from .staging import stage_upload
+from .cohort import COHORT_MAX_DOCUMENTS, unique_names
+from .result_cache import ResultCache
+from .sentence_cache import SentenceCache
+from .embedding_cache import EMBEDDING_CACHE_ENABLED, EmbeddingCache
+from .analysis_logic import CORPUS_DIR, bi_encoder_signature
+from .metrics import derived_rates, memory_gauges, metric_values, record_event, record_stage_timings, render_metrics
+from .profiling import profile_path
 # Dictionnaire pour garder les modèles en mémoire pendant que l'API tourne
 models = {}
+# Pool d'exécution de l'analyse et du rendu (créé au démarrage, remplacé à chaque nouvelle version du corpus)
+worker_pool = None
+# Processus de rendu des rapports PDF (indépendants de la version du corpus)
+render_pool = None
+# Tâches asynchrones : store persistant et distributeur vers le pool
+job_store = None
+job_runner = None
+# Cache de résultats consulté avant de solliciter le pool
+result_cache = None
+# Caches dont les statistiques sont exposées (voir shared_caches)
+_shared_caches = {}
+# Un seul rechargement du corpus à la fois
+reload_lock = asyncio.Lock()
+# Administration : jeton exigé par les routes /admin (désactivé si vide)
+ADMIN_TOKEN = os.environ.get('APLAG_ADMIN_TOKEN', '')
+# Intervalle de surveillance de snapshots/CURRENT (0 = rechargement uniquement via /admin/reload-corpus)
+SNAPSHOT_POLL_SECONDS = float(os.environ.get('APLAG_SNAPSHOT_POLL_SECONDS', 0))
+# Traces de profilage des requêtes demandées avec ?profile=true (voir profiling.py)
+PROFILES_DIR = os.path.join(CORPUS_DIR, 'profiles')
+# Routes de sonde (disponibilité, collecte Prometheus), exclues de l'histogramme des requêtes
+UNTIMED_ROUTES = ("/", "/metrics")
+
+if PRELOAD:
+    # Import par le processus parent de gunicorn (--preload) : les workers héritent des ressources
+    preload_resources()
+
+async def reload_corpus():
+    """
+    Charge la version courante du corpus en arrière-plan puis bascule vers un nouveau pool.
+    Les requêtes déjà acceptées se terminent sur l'ancien pool (et l'ancienne version),
+    qui est arrêté une fois vide. Retourne (version précédente, nouvelle version) ou None si rien n'a changé.
+    """
+    global models, worker_pool, result_cache
+    async with reload_lock:
+        snapshot = resolve_snapshot()
+        previous_version = result_cache.corpus_version
+        if snapshot['version'] == previous_version:
+            return None
+
+        print(f"Chargement de la version {snapshot['version']} du corpus...")
+        if EXECUTOR_KIND == 'thread':
+            # Les modèles sont conservés, seuls l'index, le corpus et les caches sont rechargés
+            new_models = {**models, **await asyncio.to_thread(load_corpus_resources, snapshot)}
+            new_cache = new_models['result_cache']
+        else:
+            new_models = models
+            new_cache = ResultCache(snapshot['version'])
+        new_pool = WorkerPool(models=new_models, snapshot=snapshot)
+        await asyncio.to_thread(new_pool.start)
+
+        old_pool = worker_pool
+        models, worker_pool, result_cache = new_models, new_pool, new_cache
+        job_runner.worker_pool = new_pool
+        asyncio.get_running_loop().run_in_executor(None, partial(old_pool.shutdown, wait=True))
+        print(f"✅ Version {snapshot['version']} du corpus en service (précédente : {previous_version}).")
+        return previous_version, snapshot['version']
+
+async def watch_snapshots():
+    """Recharge le corpus dès que snapshots/CURRENT désigne une nouvelle version."""
+    while True:
+        await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+        try:
+            if resolve_snapshot()['version'] != result_cache.corpus_version:
+                await reload_corpus()
+        except Exception as e:
+            print(f"Échec du rechargement du corpus : {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -17,84 +100,416 @@ async def lifespan(app: FastAPI):
     Fonction pour charger les modèles au démarrage de l'API 
     et les garder disponibles durant toute sa vie.
     """
+    global worker_pool, render_pool, job_store, job_runner, result_cache
     print("Chargement des ressources (modèles, index, corpus)...")
-    models['bi_encoder'] = load_bi_encoder()
-    models['cross_encoder'] = load_cross_encoder()
-    models['faiss_index'] = load_faiss_index()
-    models['df_corpus'] = load_corpus_dataframe()
-    print("✅ Ressources chargées avec succès.")
+    snapshot = resolve_snapshot()
+    if EXECUTOR_KIND == 'thread':
+        # En mode "process", chaque processus du pool charge ses propres modèles
+        models.update(load_models(snapshot))
+        result_cache = models['result_cache']
+    else:
+        result_cache = ResultCache(snapshot['version'])
+    worker_pool = WorkerPool(models=models, snapshot=snapshot)
+    worker_pool.start()
+    render_pool = RenderPool()
+    render_pool.start()
+    job_store = JobStore()
+    job_runner = JobRunner(job_store, worker_pool)
+    job_runner.start()
+    watcher = asyncio.create_task(watch_snapshots()) if SNAPSHOT_POLL_SECONDS > 0 else None
+    print(f"✅ Ressources chargées avec succès (corpus : {snapshot['version']}).")
     yield
     # Code à exécuter à l'arrêt de l'application (libérer la mémoire)
+    if watcher is not None:
+        watcher.cancel()
+    await job_runner.stop()
+    worker_pool.shutdown()
+    render_pool.shutdown()
     models.clear()
     print("Ressources libérées.")
 
 app = FastAPI(title="A-Plag API", version="1.0", lifespan=lifespan)
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    """
+    Durée de chaque requête par route, méthode et statut (histogramme aplag_requete_duree_secondes).
+    Pour une réponse en flux, la durée s'arrête à l'envoi des en-têtes. Les sondes (/, /metrics) ne sont pas comptées.
+    """
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get('route'), 'path', 'inconnue')
+    if route not in UNTIMED_ROUTES:
+        # Cumul en mémoire (metrics.py) : pas d'écriture sur le chemin de la requête
+        record_event('aplag_requete_duree_secondes', time.perf_counter() - start,
+                     route=route, methode=request.method, statut=response.status_code)
+    return response
+
+def content_disposition(filename):
+    """En-tête Content-Disposition d'un téléchargement (comme FileResponse : noms non ASCII encodés selon la RFC 5987)."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
 @app.get("/", tags=["Status"])
 def read_root():
     """Point d'entrée pour vérifier que l'API est en ligne."""
     return {"status": "ok", "message": "Bienvenue sur l'API de A-PLAG"}
 
+def shared_caches():
+    """
+    Caches de phrases et d'embeddings dont /cache/stats et /metrics lisent les compteurs : ceux des modèles
+    en mode "thread", sinon des instances créées une fois par version du corpus (le constructeur de
+    SentenceCache purge les autres versions).
+    """
+    version = result_cache.corpus_version
+    if _shared_caches.get('version') != version:
+        caches = {'version': version, 'phrases': models.get('sentence_cache') or SentenceCache(version)}
+        if EMBEDDING_CACHE_ENABLED:
+            caches['embeddings'] = models.get('embedding_cache') or _shared_caches.get('embeddings') or EmbeddingCache(bi_encoder_signature())
+        _shared_caches.clear()
+        _shared_caches.update(caches)
+    return {name: cache for name, cache in _shared_caches.items() if name != 'version'}
+
+@app.get("/cache/stats", tags=["Status"])
+def get_cache_stats():
+    """Taux de réutilisation des caches de phrases et d'embeddings (cumulés sur tous les workers)."""
+    return {f"cache_{name}": cache.stats() for name, cache in shared_caches().items()}
+
+@app.get("/metrics", tags=["Status"], response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Métriques au format Prometheus : durée des requêtes, des analyses et de chacune de leurs étapes
+    (histogrammes), compteurs de phrases et de paires, débits, file d'attente, taux de succès des caches
+    et mémoire. Compteurs et histogrammes sont cumulés sur tous les processus (metrics.py).
+    """
+    values = metric_values()
+    rates = derived_rates(values)
+    analyses = values.get('aplag_analyses_total', {})
+    result_hits, result_lookups = analyses.get('origine="cache"', 0), sum(analyses.values())
+    gauges = [
+        ('aplag_phrases_par_seconde', "Phrases analysées par seconde d'analyse (cumul)", {}, rates['phrases_par_seconde']),
+        ('aplag_paires_par_seconde', "Paires re-classées par seconde de re-ranking (cumul)", {}, rates['paires_par_seconde']),
+        ('aplag_pool_analyse_en_cours', "Analyses en cours ou en attente d'un worker", {}, worker_pool.pending),
+        ('aplag_pool_analyse_capacite', "Analyses acceptées avant de refuser (503)", {}, worker_pool.capacity),
+        ('aplag_pool_rendu_en_cours', "Rendus en cours ou en attente d'un processus de rendu", {}, render_pool.pending),
+    ]
+    gauges += [('aplag_taches', "Tâches asynchrones par statut", {'statut': status}, count)
+               for status, count in job_store.count_by_status().items()]
+    cache_stats = {name: cache.stats() for name, cache in shared_caches().items()}
+    gauges += [('aplag_cache_taux_succes', "Taux de succès des caches (cumul)", {'cache': name}, stats['taux_succes'])
+               for name, stats in cache_stats.items()]
+    gauges.append(('aplag_cache_taux_succes', "Taux de succès des caches (cumul)", {'cache': 'resultats'},
+                   result_hits / result_lookups if result_lookups else None))
+    gauges += [('aplag_cache_entrees', "Entrées des caches", {'cache': name}, stats['entrees']) for name, stats in cache_stats.items()]
+    gauges += memory_gauges(models)
+    return PlainTextResponse(render_metrics(values, gauges), media_type="text/plain; version=0.0.4")
+
+def check_admin_token(token):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Jeton d'administration invalide.")
+
+@app.get("/admin/corpus", tags=["Administration"])
+def get_corpus_version_info(x_admin_token: str = Header(default="")):
+    """Version du corpus en service et version courante sur disque (avec son manifeste)."""
+    check_admin_token(x_admin_token)
+    available = resolve_snapshot()['version']
+    return {
+        "version_en_service": result_cache.corpus_version,
+        "version_disponible": available,
+        "manifeste": read_manifest(available)
+    }
+
+@app.post("/admin/reload-corpus", tags=["Administration"])
+async def reload_corpus_endpoint(x_admin_token: str = Header(default="")):
+    """
+    Charge la version courante du corpus (snapshots/CURRENT) sans interrompre le service.
+    Les analyses en cours se terminent sur l'ancienne version.
+    Seul le worker qui reçoit la requête est rechargé : sous gunicorn, les autres suivent par la
+    surveillance de snapshots/CURRENT (APLAG_SNAPSHOT_POLL_SECONDS, activée par gunicorn.conf.py).
+    """
+    check_admin_token(x_admin_token)
+    try:
+        swapped = await reload_corpus()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Échec du rechargement du corpus : {str(e)}")
+    if swapped is None:
+        return {"statut": "inchange", "version": result_cache.corpus_version}
+    previous_version, version = swapped
+    return {"statut": "recharge", "version": version, "version_precedente": previous_version}
+
 @app.post("/generate-report", tags=["Analyse"])
-async def generate_plagiarism_report(file: UploadFile=File(..., description="Le fichier PDF à analyser.")):
+async def generate_plagiarism_report(background_tasks: BackgroundTasks, file: UploadFile=File(..., description="Le fichier PDF à analyser."), format: str = "pdf",
+                                     profile: bool = False, x_admin_token: str = Header(default="")):
     """
     Analyse un PDF.
-    - Retourne un fichier à télécharger
-
+    - format=pdf : le rapport PDF à télécharger (au-delà de APLAG_PDF_MAX_FINDINGS constats,
+      les moins bien notés sont regroupés par source)
+    - format=html : le rapport HTML, avec le détail de tous les constats
+    - format=json : les résultats bruts de l'analyse, sans rendu
+    Avec profile=true (jeton d'administration requis), l'analyse est refaite sans les caches de résultats
+    et de rapports, et ses traces (analyse, rendu) sont écrites dans PROFILES_DIR ; l'en-tête
+    X-Profil donne leur préfixe.
     """
 
     if file.content_type !="application/pdf":
         raise HTTPException(status_code=400, detail="Type de fichier invalide. Veuillez envoyer un PDF. ")
-    temp_dir="app/corpus/temp_files"
-    staging_dir="app/corpus/staging_files"
-    os.makedirs(temp_dir, exist_ok=True)
-    os.makedirs(staging_dir, exist_ok=True)
-    upload_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.pdf")
-    report_path = None # Pour stocker le chemin du rapport généré
+    if format not in ("pdf", "html", "json"):
+        raise HTTPException(status_code=400, detail="Format invalide. Valeurs acceptées : pdf, html, json.")
+    profile_id = None
+    if profile:
+        check_admin_token(x_admin_token)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
 
     try:
-        with open(upload_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        # Étape 2: Obtenir les résultats de l'analyse (le JSON)
-        print(f"Lancement de l'analyse pour : {file.filename}")
-        analysis_results = analyze_pdf_for_plagiarism(
-            file_path=upload_path,
-            bi_encoder=models['bi_encoder'],
-            cross_encoder=models['cross_encoder'],
-            index=models['faiss_index'],
-            df_corpus=models['df_corpus'],
-            min_verdict_score=0.5
-        )
-        print("Analyse terminée. Génération du rapport PDF...")
-        shutil.move(upload_path, os.path.join(staging_dir, file.filename))
+        # Étape 1: Le document et le rapport restent en mémoire : aucun fichier temporaire
+        document = await file.read()
 
-        report_path = generate_pdf_report(
-            analysis_data=analysis_results,
-            document_name=file.filename
-        )
-        print(f"Rapport généré : {report_path}")
-
-        # Étape 4: Renvoyer le fichier PDF
-        # FileResponse s'occupe de lire le fichier et de le streamer.
-        # Il gère aussi les en-têtes HTTP (Content-Type, Content-Disposition).
-        return FileResponse(
-            path=report_path,
-            media_type='application/pdf',
-            filename=f"Rapport_{file.filename}"
+        # Étape 2: Document déjà analysé et rendu sur ce corpus → réponse immédiate depuis le cache
+        min_verdict_score = 0.5
+        cache_key = result_cache.make_key(sha256_bytes(document), min_verdict_score)
+        report_data = None
+        if format == "pdf" and profile_id is None:
+            # Lecture disque du cache : hors de la boucle d'événements, comme l'analyse
+            report_data = await asyncio.to_thread(result_cache.get_report, cache_key, file.filename)
+
+        if report_data is not None:
+            print(f"Rapport trouvé dans le cache pour : {file.filename}")
+            await asyncio.to_thread(record_event, 'aplag_rapports_total', origine='cache')
+        else:
+            # Étape 3: Analyse dans le pool (ou cache de résultats), hors de la boucle d'événements
+            print(f"Lancement de l'analyse pour : {file.filename}")
+            analysis_results = await worker_pool.run(
+                analyze_document, document, min_verdict_score=min_verdict_score,
+                profile_path=profile_path(PROFILES_DIR, f"{profile_id}-analyse") if profile_id else None
+            )
+            if 'summary' not in analysis_results:
+                raise HTTPException(status_code=422, detail=analysis_results.get("message", "Aucun rapport n'a pu être généré."))
+
+            # Étape 4: Rendu dans le pool de rendu : le worker d'analyse est déjà libre pour la demande suivante
+            if format == "json":
+                response = JSONResponse(content=analysis_results)
+            else:
+                report, render_timings = await render_pool.run(
+                    render_report, analysis_results, file.filename, format,
+                    profile_path=profile_path(PROFILES_DIR, f"{profile_id}-rendu") if profile_id else None
+                )
+                await asyncio.to_thread(record_stage_timings, render_timings)
+                if format == "html":
+                    response = HTMLResponse(content=report)
+                else:
+                    report_data = report
+                    await asyncio.to_thread(result_cache.put_report, cache_key, file.filename, report_data)
+                    await asyncio.to_thread(record_event, 'aplag_rapports_total', origine='rendu')
+                    print(f"Rapport généré pour : {file.filename}")
+
+        # Étape 5: Mise en attente du document pour le corpus, après l'envoi de la réponse
+        background_tasks.add_task(stage_upload, document, file.filename)
+
+        # Étape 6: Renvoyer le rapport PDF depuis la mémoire
+        if format == "pdf":
+            response = StreamingResponse(
+                io.BytesIO(report_data),
+                media_type='application/pdf',
+                headers={"Content-Disposition": content_disposition(f"Rapport_{file.filename}")}
+            )
+        if profile_id is not None:
+            response.headers["X-Profil"] = profile_id
+        return response
+
+    except HTTPException:
+        raise
+
+    except PoolSaturatedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Le service est saturé, veuillez réessayer plus tard. {e}",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
         )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Une erreur interne est survenue : {str(e)}")
         
     finally:
-        # Étape 5: Nettoyage des fichiers temporaires
-        if os.path.exists(upload_path):
-            os.remove(upload_path)
-        # Le rapport généré sera supprimé par le système d'exploitation plus tard
-        # ou vous pouvez ajouter un mécanisme de nettoyage périodique.
         await file.close()
 
-    
+
+def spool_cohort_job(uploads, names, directory, job_id, with_corpus, archive):
+    """Copie les PDF reçus dans le dossier de la tâche puis enregistre la tâche de cohorte (exécutée dans un thread)."""
+    write_cohort_job(directory, uploads, names, with_corpus=with_corpus, archive=archive)
+    job_store.create(f"cohorte ({len(names)} documents)", directory, min_verdict_score=0.5, job_id=job_id, kind=KIND_COHORT)
+
+def stage_spooled_upload(path, filename):
+    """Met en attente pour le corpus un document déjà copié sur disque (tâche de fond)."""
+    with open(path, "rb") as f:
+        stage_upload(f.read(), filename)
+
+@app.post("/analyze/cohort", tags=["Analyse"], status_code=202)
+async def analyze_cohort(background_tasks: BackgroundTasks, files: list[UploadFile]=File(..., description="Les PDF de la cohorte."),
+                         format: str = "json", corpus: bool = True):
+    """
+    Analyse de cohorte : compare entre eux les documents d'un même lot (les mémoires d'une promotion)
+    et, avec corpus=true, chacun au corpus, en une seule tâche asynchrone (voir /jobs).
+    - Retourne immédiatement l'identifiant de la tâche ; /jobs/{job_id} suit sa progression
+    - /jobs/{job_id}/report?format=json : matrice des phrases partagées entre documents, paires suspectes
+      et résultats par document
+    - format=zip : /jobs/{job_id}/report fournit aussi l'archive avec cohorte.json, matrice.csv et
+      le rapport PDF de chaque document (constats du corpus et de la cohorte)
+    """
+    if not 2 <= len(files) <= COHORT_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"Une cohorte compte de 2 à {COHORT_MAX_DOCUMENTS} documents.")
+    if any(file.content_type != "application/pdf" for file in files):
+        raise HTTPException(status_code=400, detail="Type de fichier invalide. Veuillez n'envoyer que des PDF. ")
+    if format not in ("json", "zip"):
+        raise HTTPException(status_code=400, detail="Format invalide. Valeurs acceptées : json, zip.")
+
+    job_id = uuid.uuid4().hex
+    directory = os.path.join(JOBS_DIR, job_id)
+    names = unique_names([os.path.basename(file.filename or "document.pdf") for file in files])
+    try:
+        # Copie sur disque et insertion SQLite hors de la boucle d'événements
+        await asyncio.to_thread(spool_cohort_job, [file.file for file in files], names, directory, job_id, corpus, format == "zip")
+    finally:
+        for file in files:
+            await file.close()
+    job_runner.notify()
+
+    # Mise en attente des documents pour le corpus, après l'envoi de la réponse
+    for position, file in enumerate(files):
+        background_tasks.add_task(stage_spooled_upload, os.path.join(directory, f"{position:04d}.pdf"), file.filename)
+
+    print(f"Analyse de cohorte de {len(files)} documents soumise (tâche {job_id})")
+    return {
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "report_url": f"/jobs/{job_id}/report"
+    }
+
+
+@app.post("/analyze/stream", tags=["Analyse"])
+async def stream_plagiarism_analysis(file: UploadFile=File(..., description="Le fichier PDF à analyser."), format: str = "ndjson"):
+    """
+    Analyse un PDF et renvoie les résultats au fur et à mesure.
+    - format=ndjson : un objet JSON par ligne
+    - format=sse : Server-Sent Events (`event: <type>`)
+    Événements : "progress", "finding" (un constat, même forme que dans le rapport),
+    puis "summary" (ou "message" si le document est vide, "erreur" en cas d'échec).
+    """
+    if file.content_type !="application/pdf":
+        raise HTTPException(status_code=400, detail="Type de fichier invalide. Veuillez envoyer un PDF. ")
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="Format invalide. Valeurs acceptées : ndjson, sse.")
+
+    try:
+        document = await file.read()
+        events = worker_pool.stream(stream_analysis, document, min_verdict_score=0.5)
+    except PoolSaturatedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Le service est saturé, veuillez réessayer plus tard. {e}",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    finally:
+        await file.close()
+
+    async def body():
+        async for event in events:
+            data = json.dumps(event, ensure_ascii=False)
+            if format == "sse":
+                yield f"event: {event['type']}\ndata: {data}\n\n"
+            else:
+                yield data + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+def spool_job(upload, filename, upload_path, job_id):
+    """Copie le PDF reçu dans JOBS_DIR puis enregistre la tâche (exécutée dans un thread)."""
+    with open(upload_path, "wb") as buffer:
+        shutil.copyfileobj(upload, buffer)
+    job_store.create(filename, upload_path, min_verdict_score=0.5, job_id=job_id)
+
+@app.post("/jobs", tags=["Tâches"], status_code=202)
+async def submit_job(file: UploadFile=File(..., description="Le fichier PDF à analyser.")):
+    """
+    Soumet un PDF pour une analyse en arrière-plan.
+    - Retourne immédiatement l'identifiant de la tâche
+    """
+    if file.content_type !="application/pdf":
+        raise HTTPException(status_code=400, detail="Type de fichier invalide. Veuillez envoyer un PDF. ")
+
+    job_id = uuid.uuid4().hex
+    upload_path = os.path.join(JOBS_DIR, f"{job_id}.pdf")
+    try:
+        # Copie sur disque et insertion SQLite hors de la boucle d'événements : un gros envoi ne bloque pas les autres requêtes
+        await asyncio.to_thread(spool_job, file.file, file.filename, upload_path, job_id)
+    finally:
+        await file.close()
+    job_runner.notify()
+    return {
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "report_url": f"/jobs/{job_id}/report"
+    }
+
+@app.get("/jobs/{job_id}", tags=["Tâches"])
+def get_job_status(job_id: str):
+    """Retourne le statut, la progression et la durée des étapes d'une tâche."""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tâche introuvable.")
+
+    return {
+        "job_id": job['id'],
+        "type": job['kind'],
+        "document": job['filename'],
+        "status": job['status'],
+        "progress": {
+            "etape": job['stage'],
+            "phrases_traitees": job['progress_done'],
+            "phrases_totales": job['progress_total']
+        },
+        "durees_etapes": job['stage_timings'],
+        "erreur": job['error'],
+        "cree_le": job['created_at'],
+        "demarre_le": job['started_at'],
+        "termine_le": job['finished_at']
+    }
+
+@app.get("/jobs/{job_id}/report", tags=["Tâches"])
+def get_job_report(job_id: str, format: str = "pdf"):
+    """
+    Retourne le résultat d'une tâche terminée.
+    - format=pdf : le rapport PDF à télécharger
+    - format=zip : pour une cohorte soumise avec format=zip, l'archive de ses rapports
+    - format=json : les résultats bruts de l'analyse
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tâche introuvable.")
+    if job['status'] != STATUS_DONE:
+        raise HTTPException(status_code=409, detail=f"La tâche n'est pas terminée (statut : {job['status']}).")
+
+    if format == "json":
+        return JSONResponse(content=json.loads(job['result_json']))
+    if job['kind'] == KIND_COHORT:
+        if format not in ("zip", "pdf"):
+            raise HTTPException(status_code=400, detail="Format invalide. Valeurs acceptées : zip, json.")
+        if job['report_path'] is None:
+            raise HTTPException(status_code=404, detail="Aucune archive pour cette cohorte (soumise avec format=json).")
+        return FileResponse(path=job['report_path'], media_type='application/zip', filename="Rapport_cohorte.zip")
+    if format != "pdf":
+        raise HTTPException(status_code=400, detail="Format invalide. Valeurs acceptées : pdf, json.")
+    if job['report_path'] is None:
+        raise HTTPException(status_code=404, detail="Aucun rapport PDF pour ce document (voir format=json).")
+
+    return FileResponse(
+        path=job['report_path'],
+        media_type='application/pdf',
+        filename=f"Rapport_{job['filename']}"
+    )
 
 
 # uvicorn app.main:app --reload  
\ No newline at end of file
@@ -0,0 +1,325 @@
+import atexit
+import multiprocessing.util
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .analysis_logic import CORPUS_DIR
+from .corpus_store import CorpusStore
+from .index_builder import base_index
+
+# ==============================================================================
+# CONFIGURATION DES MÉTRIQUES
+#   Compteurs et histogrammes sont cumulés dans une base SQLite partagée : les workers de gunicorn,
+#   les processus du pool d'analyse et le processus de l'API y écrivent tous, et /metrics
+#   expose leur total quel que soit le processus qui répond. Les jauges (file d'attente,
+#   mémoire) sont celles du processus qui répond.
+#   Chaque processus cumule ses métriques en mémoire et ne les écrit dans la base que par lots
+#   (toutes les APLAG_METRICS_FLUSH_SECONDS secondes, et à sa sortie) : aucune écriture SQLite
+#   sur le chemin d'une requête.
+# ==============================================================================
+METRICS_DB_PATH = os.path.join(CORPUS_DIR, 'cache', 'metrics.sqlite3')
+METRICS_ENABLED = os.environ.get('APLAG_METRICS', '1') == '1'
+# Intervalle d'écriture des métriques en attente (0 = écriture immédiate)
+METRICS_FLUSH_SECONDS = float(os.environ.get('APLAG_METRICS_FLUSH_SECONDS', 5))
+# Bornes supérieures (secondes) des histogrammes de durée
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Nom -> (type, description) des métriques cumulées
+METRICS = {
+    'aplag_etape_duree_secondes': ('histogram', "Durée d'une étape de l'analyse ou du rendu, par demande"),
+    'aplag_analyse_duree_secondes': ('histogram', "Durée d'une analyse complète (hors cache de résultats)"),
+    'aplag_requete_duree_secondes': ('histogram', "Durée de traitement d'une requête par l'API"),
+    'aplag_analyses_total': ('counter', "Analyses demandées, par origine du résultat (cache ou analyse)"),
+    'aplag_rapports_total': ('counter', "Rapports PDF servis, par origine (cache ou rendu)"),
+    'aplag_cohortes_total': ('counter', "Analyses de cohorte (lots de documents comparés entre eux)"),
+    'aplag_cohorte_duree_secondes': ('histogram', "Durée d'une analyse de cohorte complète"),
+    'aplag_phrases_analysees_total': ('counter', "Phrases analysées"),
+    'aplag_phrases_voie_rapide_total': ('counter', "Phrases résolues par l'index de shingles"),
+    'aplag_phrases_cache_total': ('counter', "Phrases relues dans le cache de phrases"),
+    'aplag_paires_reclassees_total': ('counter', "Paires évaluées par le Cross-Encoder"),
+    'aplag_paires_elaguees_total': ('counter', "Paires écartées par la cascade avant le Cross-Encoder"),
+    'aplag_analyse_secondes_total': ('counter', "Durée cumulée des analyses"),
+    'aplag_reclassement_secondes_total': ('counter', "Durée cumulée du re-ranking (Cross-Encoder)"),
+}
+
+
+_BOUND = re.compile(r'(?:^|,)le="([^"]*)"')
+
+
+def _labels_text(labels):
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+class MetricsStore:
+    """
+    Compteurs et histogrammes cumulés, une ligne (nom, étiquettes) -> valeur.
+    Un histogramme est rangé comme dans le format Prometheus : compteurs cumulés `_bucket` par borne
+    `le`, `_sum` et `_count`. Chaque méthode ouvre sa propre connexion (threads et processus).
+    Les incréments sont cumulés en mémoire puis écrits par un thread toutes les `flush_seconds` secondes.
+    """
+
+    def __init__(self, db_path=METRICS_DB_PATH, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.db_path = db_path
+        self.flush_seconds = flush_seconds
+        self._pid = None
+        self._reset_pending()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS metrics (
+                    name TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (name, labels)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _reset_pending(self):
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def _start_flusher(self):
+        """
+        Démarre, une fois par processus, le thread d'écriture et l'écriture finale à la sortie.
+        Un processus créé par fork repart sans les incréments en attente de son parent.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._reset_pending()
+        if self.flush_seconds > 0:
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+        # Processus du pool (multiprocessing) : atexit n'y est pas appelé
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def record(self, counters=(), observations=()):
+        """
+        Cumule en mémoire des incréments `counters` [(nom, étiquettes, valeur)]
+        et des observations d'histogrammes `observations` [(nom, étiquettes, valeur)].
+        """
+        rows = [(name, _labels_text(labels), value) for name, labels, value in counters]
+        for name, labels, value in observations:
+            for bound in (*DURATION_BUCKETS, '+Inf'):
+                if bound == '+Inf' or value <= bound:
+                    rows.append((f"{name}_bucket", _labels_text({**labels, 'le': bound}), 1))
+            rows.append((f"{name}_sum", _labels_text(labels), value))
+            rows.append((f"{name}_count", _labels_text(labels), 1))
+        if not rows:
+            return
+        self._start_flusher()
+        with self._pending_lock:
+            for name, labels, value in rows:
+                self._pending[name, labels] = self._pending.get((name, labels), 0) + value
+        if self.flush_seconds <= 0:
+            self.flush()
+
+    def flush(self):
+        """Écrit en une transaction les incréments en attente ; ils sont conservés si la base est indisponible."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in pending.items()]
+                )
+        except sqlite3.Error:
+            with self._pending_lock:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + value
+
+    def values(self):
+        """
+        {nom: {étiquettes: valeur}} de toutes les métriques cumulées : celles du processus sont écrites d'abord,
+        celles des autres processus le sont au plus tard `flush_seconds` secondes après leur enregistrement.
+        """
+        self.flush()
+        values = {}
+        with self._connect() as conn:
+            for name, labels, value in conn.execute("SELECT name, labels, value FROM metrics ORDER BY name, labels"):
+                values.setdefault(name, {})[labels] = value
+        return values
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def metrics_store():
+    """Store de métriques du processus (None si les métriques sont désactivées)."""
+    global _store
+    if not METRICS_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = MetricsStore()
+        return _store
+
+
+def record_stage_timings(timings):
+    """Enregistre la durée de chaque étape d'une demande (dictionnaire `timings` de l'analyse ou du rendu)."""
+    store = metrics_store()
+    if store is not None:
+        store.record(observations=[('aplag_etape_duree_secondes', {'etape': stage}, duration) for stage, duration in timings.items()])
+
+
+def record_analysis(duration, timings, stats, summary):
+    """Enregistre une analyse complète : durée, durée des étapes et compteurs de phrases et de paires."""
+    store = metrics_store()
+    if store is None:
+        return
+    counters = [
+        ('aplag_analyses_total', {'origine': 'analyse'}, 1),
+        ('aplag_analyse_secondes_total', {}, duration),
+        ('aplag_reclassement_secondes_total', {}, timings.get('re-ranking', 0.0)),
+        ('aplag_phrases_analysees_total', {}, (summary or {}).get('phrases_analysees', 0)),
+        ('aplag_phrases_voie_rapide_total', {}, stats.get('phrases_voie_rapide', 0)),
+        ('aplag_phrases_cache_total', {}, stats.get('phrases_cache', 0)),
+        ('aplag_paires_reclassees_total', {}, stats.get('paires_reclassees', 0)),
+        ('aplag_paires_elaguees_total', {}, stats.get('paires_elaguees', 0)),
+    ]
+    observations = [('aplag_analyse_duree_secondes', {}, duration)]
+    observations += [('aplag_etape_duree_secondes', {'etape': stage}, value) for stage, value in timings.items()]
+    store.record(counters, observations)
+
+
+def record_event(name, duration=None, **labels):
+    """Incrémente le compteur `name`, ou, avec `duration`, ajoute une observation à l'histogramme `name`."""
+    store = metrics_store()
+    if store is None:
+        return
+    if duration is None:
+        store.record(counters=[(name, labels, 1)])
+    else:
+        store.record(observations=[(name, labels, duration)])
+
+
+def process_memory_bytes():
+    """Mémoire résidente (RSS) du processus courant, en octets (Linux)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def model_memory_bytes(model):
+    """Taille des paramètres d'un modèle PyTorch (éventuellement enveloppé), None pour un autre moteur."""
+    for candidate in (model, getattr(model, 'model', None), getattr(getattr(model, 'model', None), 'model', None)):
+        parameters = getattr(candidate, 'parameters', None)
+        if callable(parameters):
+            try:
+                return sum(p.numel() * p.element_size() for p in parameters())
+            except (AttributeError, TypeError):
+                return None
+    return None
+
+
+def index_memory_bytes(index):
+    """Taille estimée des vecteurs codés d'un index FAISS (sans la structure de recherche HNSW ou IVF)."""
+    try:
+        return int(index.ntotal) * int(base_index(index).sa_code_size())
+    except (AttributeError, RuntimeError):
+        return None
+
+
+def memory_gauges(models):
+    """
+    Jauges aplag_memoire_octets du processus : mémoire résidente, puis, quand le processus détient
+    les ressources (pool "thread"), modèles, index FAISS, corpus et index de shingles (hors shards).
+    Les tableaux projetés en mémoire (mmap) sont comptés pour leur taille, partagée entre processus.
+    """
+    description = "Mémoire du processus et de ses ressources (octets)"
+    sizes = {'processus': process_memory_bytes()}
+    if models:
+        df_corpus, shingle_index = models.get('df_corpus'), models.get('shingle_index')
+        sizes['bi_encoder'] = model_memory_bytes(models.get('bi_encoder'))
+        sizes['cross_encoder'] = model_memory_bytes(models.get('cross_encoder'))
+        if not isinstance(df_corpus, CorpusStore):
+            # Corpus partitionné (sharding.py) : index et passages sont dans les shards
+            df_corpus = shingle_index = None
+        elif models.get('faiss_index') is not None:
+            sizes['index_faiss'] = index_memory_bytes(models['faiss_index'])
+        if df_corpus is not None:
+            arrays = (df_corpus.texts_blob, df_corpus.offsets, df_corpus.source_codes, df_corpus.ids)
+            sizes['corpus'] = sum(a.nbytes for a in arrays if a is not None)
+        if shingle_index is not None:
+            sizes['index_shingles'] = shingle_index.keys.nbytes + shingle_index.positions.nbytes
+    return [('aplag_memoire_octets', description, {'ressource': name}, value) for name, value in sizes.items()]
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def metric_values():
+    """Métriques cumulées de tous les processus ({} si les métriques sont désactivées)."""
+    store = metrics_store()
+    return store.values() if store is not None else {}
+
+
+def render_metrics(values, gauges=()):
+    """
+    Texte au format d'exposition Prometheus des métriques cumulées `values` (`metric_values`),
+    suivies des jauges `gauges` [(nom, description, étiquettes, valeur)] calculées par l'appelant.
+    """
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        series = [f"{name}{suffix}" for suffix in ('_bucket', '_sum', '_count')] if kind == 'histogram' else [name]
+        if not any(s in values for s in series):
+            continue
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for serie in series:
+            for labels, value in sorted(values.get(serie, {}).items(), key=lambda item: _bucket_order(item[0])):
+                lines.append(f"{serie}{{{labels}}} {_format_value(value)}" if labels else f"{serie} {_format_value(value)}")
+
+    described = set()
+    for name, description, labels, value in gauges:
+        if value is None:
+            continue
+        if name not in described:
+            described.add(name)
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        labels_text = _labels_text(labels)
+        lines.append(f"{name}{{{labels_text}}} {_format_value(value)}" if labels_text else f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _bucket_order(labels):
+    """Ordre d'affichage des séries : étiquettes hors `le`, puis bornes croissantes (+Inf en dernier)."""
+    match = _BOUND.search(labels)
+    if match is None:
+        return labels, 0.0
+    bound = match.group(1)
+    return _BOUND.sub('', labels), float('inf') if bound == '+Inf' else float(bound)
+
+
+def derived_rates(values):
+    """Débits cumulés (phrases analysées par seconde d'analyse, paires re-classées par seconde de re-ranking)."""
+
+    def total(name):
+        return sum(values.get(name, {}).values())
+
+    analysis_seconds, rerank_seconds = total('aplag_analyse_secondes_total'), total('aplag_reclassement_secondes_total')
+    return {
+        'phrases_par_seconde': total('aplag_phrases_analysees_total') / analysis_seconds if analysis_seconds else None,
+        'paires_par_seconde': total('aplag_paires_reclassees_total') / rerank_seconds if rerank_seconds else None,
+    }
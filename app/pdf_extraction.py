@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import nltk
+
+# ==============================================================================
+# CONFIGURATION DE L'EXTRACTION PARALLÈLE
+#   Les pages d'un PDF sont réparties en tranches de PAGES_PER_SHARD pages.
+#   Chaque tranche est extraite et découpée en phrases dans un processus du pool ;
+#   les phrases sont ensuite produites dans l'ordre du document, au fil de l'eau.
+#   Avec EXTRACTION_WORKERS <= 1 (ou un document d'une seule tranche), tout reste dans le processus courant.
+# ==============================================================================
+EXTRACTION_WORKERS = int(os.environ.get('APLAG_EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+PAGES_PER_SHARD = int(os.environ.get('APLAG_PAGES_PER_SHARD', 16))
+# "spawn" évite de dupliquer par fork un processus qui a déjà chargé torch et ses threads
+EXTRACTION_START_METHOD = os.environ.get('APLAG_EXTRACTION_START_METHOD', 'spawn')
+LANGUAGE = 'french'
+# Données NLTK (punkt) de l'application, comme dans analysis_logic.py : ce module segmente sans l'importer
+NLTK_DATA_DIR = os.path.join(os.path.dirname(__file__), 'nltk_data')
+if NLTK_DATA_DIR not in nltk.data.path:
+    nltk.data.path.append(NLTK_DATA_DIR)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_extraction_worker(nltk_paths):
+    """Initialiseur des processus d'extraction : mêmes répertoires de données NLTK que le parent."""
+    for path in nltk_paths:
+        if path not in nltk.data.path:
+            nltk.data.path.append(path)
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(EXTRACTION_START_METHOD),
+                initializer=_init_extraction_worker,
+                initargs=(list(nltk.data.path),)
+            )
+        return _pool
+
+
+def shutdown_extraction_pool():
+    """Arrête le pool d'extraction (il est recréé à la demande)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def open_pdf(document):
+    """Ouvre un PDF fourni par son chemin ou directement par son contenu (bytes)."""
+    if isinstance(document, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(document), filetype="pdf")
+    return fitz.open(document)
+
+
+def _spool_document(document):
+    """Écrit le contenu d'un PDF dans un fichier temporaire et retourne son chemin (à supprimer par l'appelant)."""
+    with tempfile.NamedTemporaryFile(prefix='aplag-extraction-', suffix='.pdf', delete=False) as f:
+        f.write(document)
+    return f.name
+
+
+def _page_shards(document, pages_per_shard):
+    """Nombre de pages du PDF et tranches [début, fin) de `pages_per_shard` pages."""
+    doc = open_pdf(document)
+    page_count = doc.page_count
+    doc.close()
+    return page_count, [(start, min(start + pages_per_shard, page_count)) for start in range(0, page_count, pages_per_shard)]
+
+
+def _extract_text(document, start, stop):
+    """Texte brut des pages [start, stop)."""
+    doc = open_pdf(document)
+    text = "".join(doc[p].get_text() for p in range(start, stop))
+    doc.close()
+    return text
+
+
+def _extract_shard(document, start, stop, join_lines=False):
+    """
+    Extrait le texte des pages [start, stop) et le découpe en phrases.
+    Retourne (texte brut de la tranche, phrases, durée d'extraction, durée de segmentation).
+    """
+    t0 = time.perf_counter()
+    text = _extract_text(document, start, stop)
+    if join_lines:
+        text = text.replace('\n', ' ')
+    t1 = time.perf_counter()
+    sentences = nltk.sent_tokenize(text, language=LANGUAGE) if text.strip() else []
+    return text, sentences, t1 - t0, time.perf_counter() - t1
+
+
+def _complete_sentences(carry, text, sentences):
+    """
+    Recolle la fin de la tranche précédente (`carry`, phrase peut-être inachevée) au début de celle-ci.
+
+    Retourne (phrases complètes, nouvelle fin en attente). Le découpage de Punkt ne dépend que
+    du voisinage de chaque ponctuation : seule la première phrase de la tranche est re-segmentée
+    avec `carry`, les suivantes sont identiques à celles d'un découpage du texte entier.
+    """
+    if len(sentences) < 2:
+        # Aucune frontière de phrase sûre dans la tranche : tout reste en attente
+        return [], carry + text
+
+    tail = text[text.rfind(sentences[-1]):]
+    if not carry.strip():
+        return sentences[:-1], tail
+
+    head_end = text.find(sentences[0]) + len(sentences[0])
+    head = nltk.sent_tokenize(carry + text[:head_end], language=LANGUAGE)
+    return head + sentences[1:-1], tail
+
+
+def iter_pdf_sentences(document, report=None, workers=None, pages_per_shard=None, join_lines=False):
+    """
+    Produit les phrases d'un PDF (chemin ou contenu en bytes) dans l'ordre du document,
+    avec le même résultat que `nltk.sent_tokenize` sur le texte complet, y compris
+    pour les phrases à cheval sur deux pages.
+    `join_lines=True` remplace les retours à la ligne par des espaces avant la segmentation.
+    Si `report` est un dictionnaire, il reçoit le nombre de pages et de tranches
+    et les durées cumulées des étapes (extraction, segmentation, attente des tranches).
+    """
+    workers = EXTRACTION_WORKERS if workers is None else workers
+    pages_per_shard = pages_per_shard or PAGES_PER_SHARD
+
+    page_count, shards = _page_shards(document, pages_per_shard)
+
+    timings = {"extraction": 0.0, "segmentation": 0.0, "attente": 0.0}
+    if report is not None:
+        report.update(pages=page_count, tranches=len(shards), durees=timings)
+
+    spooled, futures = None, []
+    carry = ""
+    try:
+        if workers > 1 and len(shards) > 1:
+            if isinstance(document, (bytes, bytearray, memoryview)):
+                # Chaque tranche reçoit le chemin d'une copie sur disque plutôt que tout le contenu du PDF
+                document = spooled = _spool_document(document)
+            pool = _get_pool(workers)
+            futures = [pool.submit(_extract_shard, document, start, stop, join_lines) for start, stop in shards]
+            results = (future.result() for future in futures)
+        else:
+            results = (_extract_shard(document, start, stop, join_lines) for start, stop in shards)
+
+        for _ in shards:
+            t0 = time.perf_counter()
+            text, sentences, extraction_time, segmentation_time = next(results)
+            timings["attente"] += time.perf_counter() - t0
+            timings["extraction"] += extraction_time
+
+            t1 = time.perf_counter()
+            complete, carry = _complete_sentences(carry, text, sentences)
+            timings["segmentation"] += segmentation_time + time.perf_counter() - t1
+            yield from complete
+
+        if carry.strip():
+            yield from nltk.sent_tokenize(carry, language=LANGUAGE)
+    finally:
+        # Arrêt anticipé du consommateur : inutile d'extraire les tranches restantes
+        for future in futures:
+            future.cancel()
+        if spooled is not None:
+            os.remove(spooled)
+
+
+def extract_pdf_text(document, workers=None, pages_per_shard=None):
+    """
+    Texte brut complet d'un PDF (chemin ou contenu en bytes), extrait par tranches de pages
+    dans le pool comme `iter_pdf_sentences`, sans segmentation en phrases.
+    Même résultat que la concaténation du texte de toutes les pages.
+    """
+    workers = EXTRACTION_WORKERS if workers is None else workers
+    _, shards = _page_shards(document, pages_per_shard or PAGES_PER_SHARD)
+    if workers <= 1 or len(shards) <= 1:
+        return "".join(_extract_text(document, start, stop) for start, stop in shards)
+
+    spooled = _spool_document(document) if isinstance(document, (bytes, bytearray, memoryview)) else None
+    try:
+        source = spooled or document
+        futures = [_get_pool(workers).submit(_extract_text, source, start, stop) for start, stop in shards]
+        return "".join(future.result() for future in futures)
+    finally:
+        if spooled is not None:
+            os.remove(spooled)
@@ -0,0 +1,53 @@
+import contextlib
+import os
+
+# ==============================================================================
+# PROFILAGE À LA DEMANDE
+#   "cprofile"    : statistiques de cProfile (.prof, à lire avec pstats ou snakeviz)
+#   "pyinstrument": arbre d'appels échantillonné (.html), si pyinstrument est installé
+# ==============================================================================
+PROFILER = os.environ.get('APLAG_PROFILER', 'cprofile')
+PROFILE_EXTENSIONS = {'cprofile': '.prof', 'pyinstrument': '.html'}
+
+
+@contextlib.contextmanager
+def profile_to(path, profiler=PROFILER):
+    """
+    Profile le bloc `with` et écrit la trace dans `path` (sans effet si `path` est None).
+    Le profil ne couvre que le thread courant : les processus d'extraction et de rendu ont le leur.
+    """
+    if path is None:
+        yield
+        return
+    if profiler not in PROFILE_EXTENSIONS:
+        raise ValueError(f"Profileur inconnu : {profiler} (attendu : {', '.join(PROFILE_EXTENSIONS)})")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise RuntimeError("Le profileur pyinstrument n'est pas installé (pip install pyinstrument).")
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(session.output_html())
+        return
+
+    import cProfile
+    session = cProfile.Profile()
+    session.enable()
+    try:
+        yield
+    finally:
+        session.disable()
+        session.dump_stats(path)
+
+
+def profile_path(directory, name, profiler=PROFILER):
+    """Chemin de la trace `name` (extension selon le profileur)."""
+    return os.path.join(directory, f"{name}{PROFILE_EXTENSIONS.get(profiler, '.prof')}")
@@ -1,15 +1,23 @@
+import io
 import os
+import time
 from datetime import datetime
 from xhtml2pdf import pisa
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
+from .profiling import profile_to
 
-def create_html_report(analysis_data: dict, document_name: str) -> str:
-    """
-    Génère le contenu HTML complet du rapport à partir des données d'analyse.
-    """
-    template = env.from_string("""
+# Échappement automatique : le nom du document et le texte des constats viennent du client.
+# Seul le HTML des différences (get_highlighted_diff_html, mots déjà échappés) est inséré tel quel.
+env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)), autoescape=select_autoescape(default_for_string=True))
+
+# Nombre maximal de constats détaillés dans un rapport PDF (0 = tous) : au-delà, les constats de plus faible
+# score sont regroupés par source, la durée de rendu de xhtml2pdf croissant avec le nombre de constats.
+# Les formats HTML et JSON de /generate-report gardent le détail de tous les constats.
+PDF_MAX_FINDINGS = int(os.environ.get('APLAG_PDF_MAX_FINDINGS', 100))
+
+# Gabarit du rapport, compilé une seule fois à l'import du module
+REPORT_TEMPLATE = env.from_string("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -32,6 +40,8 @@ def create_html_report(analysis_data: dict, document_name: str) -> str:
             .verdict.medium { color: #f0ad4e; }
             .details { font-size: 0.8em; color: #777; }
             .diff { font-family: monospace; padding: 10px; border-left: 3px solid #ccc; margin-top: 10px; background-color: #fafafa; }
+            .collapsed { width: 100%; font-size: 0.8em; }
+            .collapsed th { text-align: left; border-bottom: 1px solid #ddd; }
             #header_content { text-align: right; font-size: 0.8em; color: #888; }
             #footer_content { text-align: center; font-size: 0.8em; color: #888; }
         </style>
@@ -51,6 +61,7 @@ def create_html_report(analysis_data: dict, document_name: str) -> str:
             - <b>Phrases analysées :</b> {{ summary.phrases_analysees }} <br>
             - <b>Phrases suspectes détectées :</b> {{ summary.phrases_suspectes }} <br>
             - <b>Taux de suspicion global :</b> {{ summary.ratio_suspicion }}
+            {% if version_corpus %}<br>- <b>Version du corpus :</b> {{ version_corpus }}{% endif %}
         </div>
 
         <h2>Détail des similarités trouvées</h2>
@@ -72,38 +83,114 @@ def create_html_report(analysis_data: dict, document_name: str) -> str:
                     <div class="diff" style="border-left-color: #5cb85c;">{{ finding.html_diff_source | safe }}</div>
                 </div>
             {% endfor %}
+            {% if collapsed %}
+                <h2>Autres similarités, regroupées par source</h2>
+                <p class="details">
+                    {{ collapsed_count }} constats de score composite inférieur ou égal à {{ collapsed_max_score }}
+                    ne sont pas détaillés dans ce rapport PDF (détail complet : formats HTML et JSON).
+                </p>
+                <table class="collapsed">
+                    <tr><th>Source</th><th>Phrases</th><th>Meilleur score</th></tr>
+                    {% for group in collapsed %}
+                        <tr><td>{{ group.document_source }}</td><td>{{ group.phrases }}</td><td>{{ group.meilleur_score }}</td></tr>
+                    {% endfor %}
+                </table>
+            {% endif %}
         {% else %}
             <p>✅ Aucune similarité suspecte n'a été trouvée dans le document.</p>
         {% endif %}
     </body>
     </html>
-    """)
-    html_content = template.render(
+""")
+
+
+def split_findings(findings, max_findings=None):
+    """
+    Sépare les `max_findings` constats de meilleur score (détaillés) des autres, regroupés par source :
+    [{"document_source", "phrases", "meilleur_score"}], par meilleur score décroissant.
+    Sans limite (None ou 0), tous les constats sont détaillés dans leur ordre d'origine.
+    """
+    if not max_findings or len(findings) <= max_findings:
+        return findings, []
+    ranked = sorted(findings, key=lambda f: f['score_composite'], reverse=True)
+    groups = {}
+    for finding in ranked[max_findings:]:
+        group = groups.setdefault(finding['document_source'], {
+            "document_source": finding['document_source'], "phrases": 0, "meilleur_score": finding['score_composite']
+        })
+        group["phrases"] += 1
+    return ranked[:max_findings], sorted(groups.values(), key=lambda g: g["meilleur_score"], reverse=True)
+
+
+def create_html_report(analysis_data: dict, document_name: str, max_findings: int = None, timings: dict = None) -> str:
+    """
+    Génère le contenu HTML complet du rapport à partir des données d'analyse.
+    Avec `max_findings`, seuls les constats de meilleur score sont détaillés (voir `split_findings`).
+    Si `timings` est un dictionnaire, il reçoit la durée du rendu du gabarit ("gabarit").
+    """
+    start = time.perf_counter()
+    findings, collapsed = split_findings(analysis_data['findings'], max_findings)
+    html_content = REPORT_TEMPLATE.render(
         summary=analysis_data['summary'],
-        findings=analysis_data['findings'],
+        findings=findings,
+        collapsed=collapsed,
+        collapsed_count=sum(group["phrases"] for group in collapsed),
+        collapsed_max_score=max((group["meilleur_score"] for group in collapsed), default=None),
         document_name=document_name,
+        version_corpus=analysis_data.get('version_corpus'),
         generation_date=datetime.now().strftime("%d/%m/%Y à %H:%M")
     )
+    if timings is not None:
+        timings["gabarit"] = timings.get("gabarit", 0.0) + time.perf_counter() - start
     return html_content
 
-def generate_pdf_report(analysis_data: dict, document_name: str) -> str:
+def render_pdf_report(analysis_data: dict, document_name: str, max_findings: int = PDF_MAX_FINDINGS, timings: dict = None) -> bytes:
+    """
+    Génère le rapport PDF en mémoire et retourne son contenu.
+    Au-delà de `max_findings` constats, les moins bien notés sont regroupés par source.
+    Si `timings` est un dictionnaire, il reçoit la durée des étapes ("gabarit", "xhtml2pdf").
+    """
+    html_string = create_html_report(analysis_data, document_name, max_findings, timings=timings)
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    pisa_status = pisa.CreatePDF(html_string, dest=buffer)
+    if timings is not None:
+        timings["xhtml2pdf"] = timings.get("xhtml2pdf", 0.0) + time.perf_counter() - start
+
+    if pisa_status.err:
+        raise Exception("Erreur lors de la génération du PDF.")
+
+    return buffer.getvalue()
+
+def render_report(analysis_data: dict, document_name: str, report_format: str = "pdf", profile_path: str = None):
+    """
+    Rapport au format "pdf" (bytes) ou "html" (str), pour le pool de rendu.
+    Retourne (rapport, durée des étapes du rendu) ; avec `profile_path`, le rendu est profilé (voir profiling.py).
+    """
+    timings = {}
+    with profile_to(profile_path):
+        if report_format == "html":
+            report = create_html_report(analysis_data, document_name, timings=timings)
+        else:
+            report = render_pdf_report(analysis_data, document_name, timings=timings)
+    return report, timings
+
+def generate_pdf_report(analysis_data: dict, document_name: str, output_path: str = None) -> str:
     """
     Génère un rapport PDF à partir des données d'analyse et le sauvegarde temporairement.
-    Retourne le chemin du fichier PDF créé.
+    Retourne le chemin du fichier PDF créé (`output_path` s'il est fourni).
     """
-    html_string = create_html_report(analysis_data, document_name)
-    
+    report_data = render_pdf_report(analysis_data, document_name)
+
     # Créer un dossier temporaire pour les rapports
-    
-    
-    temp_dir = "app/corpus/temp_reports"
-    os.makedirs(temp_dir, exist_ok=True)
-    report_path = os.path.join(temp_dir, f"rapport_{document_name}.pdf")
+    if output_path is None:
+        temp_dir = "app/corpus/temp_reports"
+        os.makedirs(temp_dir, exist_ok=True)
+        report_path = os.path.join(temp_dir, f"rapport_{document_name}.pdf")
+    else:
+        report_path = output_path
 
     with open(report_path, "wb") as pdf_file:
-        pisa_status = pisa.CreatePDF(html_string, dest=pdf_file)
+        pdf_file.write(report_data)
 
-    if pisa_status.err:
-        raise Exception("Erreur lors de la génération du PDF.")
-        
-    return report_path
\ No newline at end of file
+    return report_path
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+
+from .analysis_logic import CORPUS_DIR, model_signature
+
+# ==============================================================================
+# CONFIGURATION DU CACHE DE RÉSULTATS
+# ==============================================================================
+RESULT_CACHE_DIR = os.path.join(CORPUS_DIR, 'cache', 'results')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('APLAG_RESULT_CACHE_MAX_MB', 512)) * 1024 * 1024
+# Format des analyses en cache : à changer quand leur contenu change (2 : mots des différences HTML échappés)
+RESULT_FORMAT = '2'
+
+
+class ResultCache:
+    """
+    Cache disque des analyses (JSON) et des rapports rendus (PDF).
+
+    La clé combine l'empreinte SHA-256 du document, la version du corpus,
+    les modèles (et leur moteur d'inférence) et le seuil `min_verdict_score`. Le cache n'est pas vidé
+    quand la version du corpus change : pendant un déploiement ou un rechargement, des workers servent
+    encore l'ancienne version, et les entrées qui ne sont plus demandées disparaissent d'elles-mêmes.
+    La taille totale est bornée : les entrées les moins récemment utilisées sont supprimées en premier.
+    """
+
+    def __init__(self, corpus_version, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.corpus_version = corpus_version
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, document_hash, min_verdict_score):
+        """Clé de cache d'une analyse."""
+        parts = [document_hash, self.corpus_version, *model_signature(), f"{float(min_verdict_score):.6f}", RESULT_FORMAT]
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _analysis_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _report_path(self, key, document_name):
+        # Le nom du document apparaît dans le rapport : il fait partie de la clé du PDF
+        name_hash = hashlib.sha256(document_name.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}_{name_hash}.pdf")
+
+    def _hit(self, path):
+        """Retourne True si l'entrée existe, en la marquant comme récemment utilisée."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get_analysis(self, key):
+        path = self._analysis_path(key)
+        if not self._hit(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put_analysis(self, key, analysis_data):
+        path = self._analysis_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(analysis_data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def get_report(self, key, document_name):
+        """Contenu du rapport PDF en cache, ou None."""
+        path = self._report_path(key, document_name)
+        if not self._hit(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_report(self, key, document_name, report_data):
+        """Enregistre le contenu d'un rapport rendu dans le cache."""
+        path = self._report_path(key, document_name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(report_data)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        """Supprime les entrées les moins récemment utilisées tant que le cache dépasse sa taille maximale."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,195 @@
+import atexit
+import hashlib
+import multiprocessing.util
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from .analysis_logic import CORPUS_DIR, model_signature
+
+# ==============================================================================
+# CONFIGURATION DU CACHE DE PHRASES
+# ==============================================================================
+SENTENCE_CACHE_PATH = os.path.join(CORPUS_DIR, 'cache', 'sentences.sqlite3')
+SENTENCE_CACHE_MAX_ENTRIES = int(os.environ.get('APLAG_SENTENCE_CACHE_MAX_ENTRIES', 2_000_000))
+# Phrases enregistrées par un processus entre deux évictions (chacune compte les lignes de la table) :
+# la table peut dépasser `max_entries` d'autant, par processus
+SENTENCE_CACHE_EVICT_EVERY = int(os.environ.get('APLAG_SENTENCE_CACHE_EVICT_EVERY', 10_000))
+# Intervalle d'écriture des dates d'utilisation et des compteurs de succès/échecs (0 = écriture immédiate) :
+# une lecture du cache n'écrit rien dans la base, les workers ne se disputent pas son verrou d'écriture
+SENTENCE_CACHE_FLUSH_SECONDS = float(os.environ.get('APLAG_SENTENCE_CACHE_FLUSH_SECONDS', 5))
+
+
+def normalize_sentence(sentence):
+    """Normalise les espaces d'une phrase : deux versions d'un brouillon qui ne diffèrent que par la mise en page partagent la même clé."""
+    return " ".join(sentence.split())
+
+
+class SentenceCache:
+    """
+    Cache persistant (SQLite) du meilleur hit re-classé de chaque phrase.
+
+    Seuls l'identifiant du passage du corpus et le score du Cross-Encoder
+    sont conservés : les métriques lexicales et le verdict sont recalculés,
+    si bien que le cache ne dépend pas de `min_verdict_score`.
+    Les compteurs de succès/échecs sont stockés dans la base pour être
+    partagés entre les workers et conservés entre deux redémarrages.
+    Comme les métriques (metrics.py), les dates d'utilisation et les compteurs sont cumulés
+    en mémoire puis écrits par un thread toutes les `flush_seconds` secondes.
+    """
+
+    def __init__(self, corpus_version, db_path=SENTENCE_CACHE_PATH, max_entries=SENTENCE_CACHE_MAX_ENTRIES,
+                 evict_every=SENTENCE_CACHE_EVICT_EVERY, flush_seconds=SENTENCE_CACHE_FLUSH_SECONDS):
+        self.corpus_version = corpus_version
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.flush_seconds = flush_seconds
+        self._inserted = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset_pending()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sentence_hits (
+                    key TEXT PRIMARY KEY,
+                    corpus_version TEXT NOT NULL,
+                    corpus_id INTEGER NOT NULL,
+                    cross_score REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sentence_hits_last_used ON sentence_hits (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # Les résultats calculés sur une autre version du corpus ne sont plus valides
+            conn.execute("DELETE FROM sentence_hits WHERE corpus_version != ?", (corpus_version,))
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def make_key(self, sentence, retrieval_signature):
+        """`retrieval_signature` résume les paramètres de recherche (top-k, cascade) qui influent sur le meilleur hit."""
+        parts = [normalize_sentence(sentence), self.corpus_version, *model_signature(), str(retrieval_signature)]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get_many(self, keys):
+        """Retourne {clé: (corpus_id, score Cross-Encoder)} pour les clés présentes et met à jour les compteurs."""
+        found = {}
+        unique_keys = list(set(keys))
+        with self._connect() as conn:
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, corpus_id, cross_score FROM sentence_hits WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, corpus_id, cross_score in rows:
+                    # Le score est remis en float32, comme en sortie du Cross-Encoder
+                    found[key] = (corpus_id, np.float32(cross_score))
+
+        hits = sum(1 for key in keys if key in found)
+        self._start_flusher()
+        now = time.time()
+        with self._pending_lock:
+            self._pending_used.update((key, now) for key in found)
+            self._pending_counters['hits'] += hits
+            self._pending_counters['misses'] += len(keys) - hits
+        if self.flush_seconds <= 0:
+            self.flush()
+        return found
+
+    def put_many(self, entries):
+        """Enregistre une liste de (clé, corpus_id, score Cross-Encoder)."""
+        if not entries:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sentence_hits (key, corpus_version, corpus_id, cross_score, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(key, self.corpus_version, int(corpus_id), float(cross_score), now) for key, corpus_id, cross_score in entries]
+            )
+        with self._lock:
+            self._inserted += len(entries)
+            due = self._inserted >= self.evict_every
+            if due:
+                self._inserted = 0
+        if due:
+            self._evict()
+
+    def _reset_pending(self):
+        self._pending_used = {}
+        self._pending_counters = {'hits': 0, 'misses': 0}
+        self._pending_lock = threading.Lock()
+
+    def _start_flusher(self):
+        """Démarre, une fois par processus, le thread d'écriture et l'écriture finale à la sortie (voir metrics.py)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._reset_pending()
+        if self.flush_seconds > 0:
+            threading.Thread(target=self._flush_loop, name='sentence-cache-flush', daemon=True).start()
+        atexit.register(self.flush)
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        """Écrit en une transaction les dates d'utilisation et les compteurs en attente (conservés si la base est indisponible)."""
+        with self._pending_lock:
+            used, counters = self._pending_used, self._pending_counters
+            self._pending_used, self._pending_counters = {}, {'hits': 0, 'misses': 0}
+        if not used and not any(counters.values()):
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "UPDATE sentence_hits SET last_used = MAX(last_used, ?) WHERE key = ?",
+                    [(last_used, key) for key, last_used in used.items()]
+                )
+                conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    list(counters.items())
+                )
+        except sqlite3.Error:
+            with self._pending_lock:
+                for key, last_used in used.items():
+                    self._pending_used[key] = max(last_used, self._pending_used.get(key, 0))
+                for name, value in counters.items():
+                    self._pending_counters[name] += value
+
+    def _evict(self):
+        """Supprime les phrases les moins récemment utilisées au-delà de `max_entries` (tous les `evict_every` enregistrements)."""
+        # Dates d'utilisation à jour avant de choisir les phrases à supprimer
+        self.flush()
+        with self._lock, self._connect() as conn:
+            (count,) = conn.execute("SELECT COUNT(*) FROM sentence_hits").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM sentence_hits WHERE key IN (SELECT key FROM sentence_hits ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+
+    def stats(self):
+        """Compteurs cumulés et taux de succès du cache (ceux des autres processus écrits au plus tard `flush_seconds` secondes après)."""
+        self.flush()
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            (entries,) = conn.execute("SELECT COUNT(*) FROM sentence_hits").fetchone()
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            "entrees": entries,
+            "succes": hits,
+            "echecs": misses,
+            "taux_succes": round(hits / lookups, 4) if lookups else 0.0
+        }
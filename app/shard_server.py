@@ -0,0 +1,86 @@
+"""
+Serveur HTTP d'un shard du corpus (mode APLAG_SHARDS=http) : un processus par shard,
+sur la même machine que l'API ou sur une autre.
+
+Exemple pour 4 shards de la version courante (depuis la racine du projet) :
+    python -m app.shard_server --shard 0 --port 8101
+    ...
+    python -m app.shard_server --shard 3 --port 8104
+puis, pour l'API :
+    APLAG_SHARDS=http APLAG_SHARD_URLS=http://127.0.0.1:8101,http://127.0.0.1:8102,http://127.0.0.1:8103,http://127.0.0.1:8104
+
+Le serveur n'importe pas les modèles : il ne fait que la recherche FAISS, la lecture des passages
+et la recherche de shingles de son shard.
+"""
+import argparse
+import asyncio
+import os
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+
+from .sharding import SHARDS_DIR, Shard, shard_directory, shards_directory
+
+
+def create_shard_app(shard):
+    """Application FastAPI qui sert le shard `shard` (voir sharding.HttpShard pour le client)."""
+    app = FastAPI(title=f"Shard {shard.meta.get('numero')} du corpus")
+
+    @app.get("/info")
+    def info():
+        return shard.info()
+
+    @app.post("/search")
+    async def search(request: Request, k: int, d: int):
+        body = await request.body()
+        if d != shard.index.d or len(body) % (4 * d):
+            raise HTTPException(status_code=400, detail=f"Embeddings attendus : float32 de dimension {shard.index.d}.")
+        queries = np.frombuffer(body, dtype=np.float32).reshape(-1, d)
+        distances, positions = await asyncio.to_thread(shard.search, queries, k)
+        return {"distances": distances.tolist(), "positions": positions.tolist()}
+
+    @app.post("/texts")
+    def texts(payload: dict):
+        rows, values = shard.texts(payload["positions"])
+        return {"rows": rows.tolist(), "values": values}
+
+    @app.post("/sources")
+    def sources(payload: dict):
+        rows, values = shard.sources(payload["positions"])
+        return {"rows": rows.tolist(), "values": values}
+
+    @app.post("/match")
+    def match(payload: dict):
+        positions, overlaps = shard.match(payload["sentences"], payload.get("min_shingles", 1))
+        return {"positions": positions.tolist(), "overlaps": overlaps.tolist()}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shard', type=int, required=True, help="Numéro du shard")
+    parser.add_argument('--version', help="Version du corpus (défaut : version courante)")
+    parser.add_argument('--shards-dir', default=SHARDS_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8101)
+    parser.add_argument('--nprobe', type=int, default=int(os.environ['APLAG_FAISS_NPROBE']) if os.environ.get('APLAG_FAISS_NPROBE') else None)
+    parser.add_argument('--ef-search', type=int, default=int(os.environ['APLAG_FAISS_EF_SEARCH']) if os.environ.get('APLAG_FAISS_EF_SEARCH') else None)
+    parser.add_argument('--mmap', action='store_true', default=os.environ.get('APLAG_FAISS_MMAP', '0') == '1',
+                        help="Projeter l'index en mémoire en lecture seule")
+    args = parser.parse_args()
+
+    version = args.version
+    if version is None:
+        from .snapshots import resolve_snapshot  # import différé : snapshots.py charge analysis_logic (modèles)
+        version = resolve_snapshot()['version']
+    directory = shard_directory(shards_directory(version, args.shards_dir), args.shard)
+    shard = Shard.load(directory, nprobe=args.nprobe, ef_search=args.ef_search, mmap=args.mmap)
+    print(f"Shard {args.shard} de la version {version} : {len(shard.store)} passages.")
+    uvicorn.run(create_shard_app(shard), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
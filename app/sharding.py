@@ -0,0 +1,476 @@
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import faiss
+import numpy as np
+
+from .corpus_store import CorpusStore
+from .index_builder import build_index, configure_search, describe_index, is_id_mapped, read_index_mmap
+from .shingle_index import ShingleIndex, shingle_index_exists
+
+# ==============================================================================
+# CONFIGURATION DU CORPUS PARTITIONNÉ (SHARDS)
+#   Le corpus d'une version est réparti en N shards selon l'empreinte du titre de son document source :
+#   tous les passages d'un document sont dans le même shard. Chaque shard a son index FAISS,
+#   son CorpusStore et son index de shingles, comme un instantané (voir snapshots.py).
+#   Une recherche interroge tous les shards en parallèle et fusionne leurs top-k.
+#   Les passages gardent leur position dans le corpus d'origine : les résultats, le cache de phrases
+#   et les rapports sont les mêmes qu'avec un seul index exact.
+#   Ce module n'importe pas les modèles : il est chargé par les processus et serveurs de shards.
+# ==============================================================================
+SHARDS_DIR = os.path.join(os.path.dirname(__file__), 'corpus', 'shards')
+# Service des shards : "" (corpus non partitionné), "thread" (shards dans le processus de l'API),
+# "process" (un processus par shard) ou "http" (serveurs de shards, voir shard_server.py)
+SHARD_MODES = ('thread', 'process', 'http')
+SHARD_MODE = os.environ.get('APLAG_SHARDS', '')
+# Adresses des serveurs de shards en mode "http", séparées par des virgules (un serveur par shard)
+SHARD_URLS = [url.strip() for url in os.environ.get('APLAG_SHARD_URLS', '').split(',') if url.strip()]
+SHARD_TIMEOUT = float(os.environ.get('APLAG_SHARD_TIMEOUT', 30))
+INDEX_FILE = 'index.faiss'
+STORE_SUBDIR = 'store'
+SHINGLES_SUBDIR = 'shingles'
+# Position dans le corpus d'origine de chaque passage du shard (croissantes)
+POSITIONS_FILE = 'positions.npy'
+SHARD_FILE = 'shard.json'
+MANIFEST_FILE = 'manifest.json'
+
+
+def shard_of(title, n_shards):
+    """Shard d'un document source : empreinte SHA-256 de son titre, modulo le nombre de shards."""
+    digest = hashlib.sha256(str(title).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n_shards
+
+
+def partition_positions(store, n_shards):
+    """Positions des passages de chaque shard, dans l'ordre du corpus."""
+    source_shards = np.fromiter((shard_of(title, n_shards) for title in store.sources), dtype=np.int64, count=len(store.sources))
+    passage_shards = source_shards[np.asarray(store.source_codes)] if len(store) else np.zeros(0, dtype=np.int64)
+    return [np.flatnonzero(passage_shards == shard) for shard in range(n_shards)]
+
+
+def shards_directory(version, shards_dir=SHARDS_DIR):
+    return os.path.join(shards_dir, version)
+
+
+def shard_directory(directory, number):
+    return os.path.join(directory, f"shard_{number:03d}")
+
+
+def read_shards_manifest(directory):
+    """Manifeste d'un ensemble de shards, ou None s'il n'a pas été (entièrement) écrit."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_shards(directory, version, store, embeddings, n_shards, index_type='flat', metric=faiss.METRIC_INNER_PRODUCT,
+                 shingles=True, **index_options):
+    """
+    Écrit les `n_shards` shards du corpus `store` dans `directory` (remplacé s'il existe).
+    `embeddings` sont les vecteurs des passages dans l'ordre du store ; chaque shard reçoit un index
+    `index_type` (voir index_builder.build_index), à identifiants si le store en a.
+    Un shard sans passage reçoit un index exact vide. Retourne le manifeste.
+
+    Les shards sont écrits dans un répertoire temporaire renommé une fois complet, manifeste compris.
+    """
+    tmp_dir = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    shards = []
+    for number, positions in enumerate(partition_positions(store, n_shards)):
+        shard_dir = shard_directory(tmp_dir, number)
+        shard_store = store.select(positions)
+        shard_store.save(os.path.join(shard_dir, STORE_SUBDIR))
+        if len(positions):
+            index = build_index(embeddings[positions], index_type, metric=metric, ids=shard_store.ids, **index_options)
+        else:
+            index = build_index(np.zeros((0, embeddings.shape[1]), dtype=np.float32), 'flat', metric=metric, ids=shard_store.ids)
+        faiss.write_index(index, os.path.join(shard_dir, INDEX_FILE))
+        np.save(os.path.join(shard_dir, POSITIONS_FILE), positions.astype(np.int64))
+        if shingles:
+            ShingleIndex.build(shard_store.all_texts()).save(os.path.join(shard_dir, SHINGLES_SUBDIR))
+        shard = {"numero": number, "shards": n_shards, "version": version,
+                 "paragraphes": len(positions), "documents": len(shard_store.sources), "index": describe_index(index)}
+        with open(os.path.join(shard_dir, SHARD_FILE), 'w', encoding='utf-8') as f:
+            json.dump(shard, f, ensure_ascii=False)
+        shards.append(shard)
+
+    manifest = {
+        "version": version,
+        "shards": n_shards,
+        "cree_le": datetime.now(timezone.utc).isoformat(),
+        "paragraphes": len(store),
+        "type_index": index_type,
+        "repartition": [shard["paragraphes"] for shard in shards],
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp_dir, directory)
+    return manifest
+
+
+class Shard:
+    """
+    Un shard servi par un processus : index FAISS, CorpusStore et index de shingles d'une partie du corpus.
+    Les méthodes prennent et retournent des positions du corpus d'origine (`positions.npy`).
+    """
+
+    def __init__(self, index, store, positions, shingle_index=None, meta=None):
+        self.index = index
+        self.store = store
+        self.positions = positions
+        self.shingle_index = shingle_index
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, directory, nprobe=None, ef_search=None, mmap=False):
+        """Ouvre un shard écrit par `write_shards` (index projeté en mémoire avec `mmap=True`)."""
+        index_path = os.path.join(directory, INDEX_FILE)
+        index = read_index_mmap(index_path) if mmap else faiss.read_index(index_path)
+        configure_search(index, nprobe=nprobe, ef_search=ef_search)
+        store = CorpusStore.load(os.path.join(directory, STORE_SUBDIR))
+        if store.ids is not None:
+            # Table identifiants -> positions construite au chargement, pas à la première recherche
+            store.positions_of([])
+        positions = np.load(os.path.join(directory, POSITIONS_FILE), mmap_mode='r')
+        shingles_dir = os.path.join(directory, SHINGLES_SUBDIR)
+        shingle_index = ShingleIndex.load(shingles_dir) if shingle_index_exists(shingles_dir) else None
+        with open(os.path.join(directory, SHARD_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(index, store, positions, shingle_index, meta)
+
+    def _global(self, local):
+        local = np.asarray(local, dtype=np.int64)
+        return np.where(local >= 0, np.asarray(self.positions)[np.maximum(local, 0)], -1) if len(self.positions) else np.full(local.shape, -1)
+
+    def _owned(self, positions):
+        """(rangs des positions demandées qui appartiennent au shard, positions correspondantes dans le shard)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(self.positions) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        slots = np.minimum(np.searchsorted(self.positions, positions), len(self.positions) - 1)
+        rows = np.flatnonzero(np.asarray(self.positions)[slots] == positions)
+        return rows, slots[rows]
+
+    def info(self):
+        return {
+            "numero": self.meta.get("numero"), "shards": self.meta.get("shards"), "version": self.meta.get("version"),
+            "paragraphes": len(self.store), "dimension": self.index.d, "metrique": int(self.index.metric_type),
+            "shingles": self.shingle_index is not None,
+        }
+
+    def search(self, queries, k):
+        """Top-k du shard : (distances, positions dans le corpus d'origine, -1 si moins de k résultats)."""
+        distances, ids = self.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        return distances, self._global(self.store.positions_of(ids))
+
+    def texts(self, positions):
+        rows, local = self._owned(positions)
+        return rows, self.store.get_texts(local)
+
+    def sources(self, positions):
+        rows, local = self._owned(positions)
+        return rows, self.store.get_sources(local)
+
+    def match(self, sentences, min_shingles=1):
+        """Passage du shard qui contient le plus de shingles de chaque phrase (voir ShingleIndex.match)."""
+        if self.shingle_index is None:
+            return np.full(len(sentences), -1, dtype=np.int64), np.zeros(len(sentences))
+        local, overlaps = self.shingle_index.match(sentences, min_shingles=min_shingles)
+        return self._global(local), overlaps
+
+
+class LocalShard:
+    """Shard ouvert dans le processus courant (mode "thread")."""
+
+    def __init__(self, directory, **options):
+        self.name = directory
+        self.shard = Shard.load(directory, **options)
+
+    def call(self, method, *args):
+        return getattr(self.shard, method)(*args)
+
+    def close(self):
+        pass
+
+
+def _serve_shard(connection, directory, options):
+    """Boucle d'un processus de shard : exécute les appels reçus par le tube jusqu'à sa fermeture."""
+    try:
+        shard = Shard.load(directory, **options)
+    except Exception as e:
+        connection.send((False, f"{type(e).__name__}: {e}"))
+        return
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        method, args = request
+        try:
+            connection.send((True, getattr(shard, method)(*args)))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+
+
+class ProcessShard:
+    """
+    Shard servi par un processus dédié (mode "process"), lancé en "spawn" : il n'importe que ce module,
+    ni torch ni les modèles. Un appel à la fois par shard ; les shards travaillent en parallèle.
+    """
+
+    def __init__(self, directory, **options):
+        self.name = directory
+        context = multiprocessing.get_context('spawn')
+        self._connection, child = context.Pipe()
+        self.process = context.Process(target=_serve_shard, args=(child, directory, options), daemon=True)
+        self.process.start()
+        child.close()
+        self._lock = threading.Lock()
+
+    def call(self, method, *args):
+        with self._lock:
+            try:
+                self._connection.send((method, args))
+                ok, result = self._connection.recv()
+            except (EOFError, OSError) as e:
+                raise RuntimeError(f"Le processus du shard {self.name} s'est arrêté.") from e
+        if not ok:
+            raise RuntimeError(f"Shard {self.name} : {result}")
+        return result
+
+    def close(self):
+        try:
+            with self._lock:
+                self._connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._connection.close()
+
+
+class HttpShard:
+    """
+    Shard servi par un serveur HTTP (mode "http", voir shard_server.py). Une connexion persistante
+    par thread ; les embeddings partent en float32 bruts, les réponses sont en JSON.
+    """
+
+    def __init__(self, url, timeout=SHARD_TIMEOUT):
+        self.name = url
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port, self.prefix = parts.hostname, parts.port or 80, parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _request(self, path, body=None, content_type='application/json'):
+        # Une connexion persistante fermée par le serveur n'est détectée qu'à l'envoi : un nouvel essai
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                connection.request('GET' if body is None else 'POST', self.prefix + path, body=body,
+                                   headers={} if body is None else {'Content-Type': content_type})
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(f"Shard {self.name} : HTTP {response.status} {data[:200].decode('utf-8', 'replace')}")
+            return json.loads(data)
+
+    def call(self, method, *args):
+        if method == 'info':
+            return self._request('/info')
+        if method == 'search':
+            queries, k = args
+            queries = np.ascontiguousarray(queries, dtype=np.float32)
+            result = self._request(f"/search?k={k}&d={queries.shape[1]}", queries.tobytes(), 'application/octet-stream')
+            return (np.asarray(result['distances'], dtype=np.float32).reshape(len(queries), -1),
+                    np.asarray(result['positions'], dtype=np.int64).reshape(len(queries), -1))
+        if method in ('texts', 'sources'):
+            (positions,) = args
+            result = self._request(f"/{method}", json.dumps({"positions": np.asarray(positions).tolist()}))
+            return np.asarray(result['rows'], dtype=np.int64), result['values']
+        if method == 'match':
+            sentences, min_shingles = args
+            result = self._request("/match", json.dumps({"sentences": list(sentences), "min_shingles": min_shingles}))
+            return np.asarray(result['positions'], dtype=np.int64), np.asarray(result['overlaps'], dtype=np.float64)
+        raise ValueError(f"Méthode de shard inconnue : {method}")
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+
+
+def merge_top_k(distances, positions, k, metric_type):
+    """
+    Fusionne les top-k de plusieurs shards (tableaux concaténés colonne à colonne) en un top-k global,
+    trié comme celui d'un index unique : meilleur score d'abord, puis position croissante à score égal.
+    Les résultats manquants (-1) passent en dernier.
+    """
+    scores = distances if metric_type == faiss.METRIC_INNER_PRODUCT else -distances
+    scores = np.where(positions >= 0, scores, -np.inf)
+    order = np.lexsort((positions, -scores), axis=-1)[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(positions, order, axis=1)
+
+
+class ShardedCorpus:
+    """
+    Corpus réparti sur plusieurs shards, interrogés en parallèle (scatter-gather).
+    Il tient dans `iter_pdf_analysis` les trois rôles du corpus non partitionné :
+      - index FAISS : `search` fusionne les top-k des shards (`merge_top_k`), `metric_type`, `ntotal` ;
+      - CorpusStore : `get_texts`, `get_sources`, `positions_of` (les identifiants sont les positions d'origine) ;
+      - index de shingles : `match` retient le meilleur passage de tous les shards.
+    """
+
+    # Identifiants = positions dans le corpus d'origine (voir CorpusStore.positions_of)
+    ids = None
+
+    def __init__(self, shards, version=None):
+        self.shards = shards
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(shards)), thread_name_prefix='aplag-shard')
+        infos = self._scatter('info')
+        numbers = sorted(info['numero'] for info in infos)
+        if numbers != list(range(len(shards))) or any(info['shards'] != len(shards) for info in infos):
+            raise ValueError(f"Shards incomplets ou en double : {numbers} pour {len(shards)} shards attendus.")
+        versions = {info['version'] for info in infos}
+        if version is not None and versions != {version}:
+            raise ValueError(f"Les shards servent la version {', '.join(sorted(map(str, versions)))} au lieu de {version}.")
+        self.version = version
+        self.d = infos[0]['dimension']
+        self.metric_type = infos[0]['metrique']
+        self.ntotal = sum(info['paragraphes'] for info in infos)
+        self.has_shingles = all(info['shingles'] for info in infos)
+
+    def _scatter(self, method, *args):
+        """Appelle `method` sur tous les shards en parallèle ; résultats dans l'ordre des shards."""
+        futures = [self.executor.submit(shard.call, method, *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def __len__(self):
+        return self.ntotal
+
+    def _positions(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        # Même convention que CorpusStore : un identifiant négatif compte depuis la fin
+        return np.where(ids < 0, ids + self.ntotal, ids)
+
+    def positions_of(self, ids):
+        return np.asarray(ids, dtype=np.int64)
+
+    def search(self, queries, k):
+        results = self._scatter('search', np.ascontiguousarray(queries, dtype=np.float32), k)
+        distances = np.concatenate([distances for distances, _ in results], axis=1)
+        positions = np.concatenate([positions for _, positions in results], axis=1)
+        return merge_top_k(distances, positions, k, self.metric_type)
+
+    def _gather(self, method, ids):
+        positions = self._positions(ids)
+        values = [None] * len(positions)
+        for rows, shard_values in self._scatter(method, positions):
+            for row, value in zip(rows.tolist(), shard_values):
+                values[row] = value
+        missing = [int(positions[row]) for row, value in enumerate(values) if value is None]
+        if missing:
+            raise IndexError(f"Passage(s) absent(s) de tous les shards : {missing[:10]}")
+        return values
+
+    def get_texts(self, ids):
+        return self._gather('texts', ids)
+
+    def get_sources(self, ids):
+        return self._gather('sources', ids)
+
+    def get_text(self, corpus_id):
+        return self.get_texts([corpus_id])[0]
+
+    def get_source(self, corpus_id):
+        return self.get_sources([corpus_id])[0]
+
+    def match(self, sentences, min_shingles=1):
+        results = self._scatter('match', list(sentences), min_shingles)
+        positions = np.stack([positions for positions, _ in results])
+        overlaps = np.stack([overlaps for _, overlaps in results])
+        # Meilleur recouvrement, puis premier passage du corpus à égalité (comme ShingleIndex.match)
+        tie_break = np.where(positions >= 0, positions, np.iinfo(np.int64).max)
+        best = np.lexsort((tie_break, -overlaps), axis=0)[0]
+        columns = np.arange(len(sentences))
+        return positions[best, columns], overlaps[best, columns]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for shard in self.shards:
+            shard.close()
+
+
+def load_sharded_corpus(version, mode=SHARD_MODE, urls=SHARD_URLS, shards_dir=SHARDS_DIR, **options):
+    """
+    Ouvre les shards de la version `version` du corpus (écrits par build_shards.py) dans le mode `mode`.
+    `options` (nprobe, ef_search, mmap) s'appliquent aux index ouverts localement ; en mode "http",
+    chaque serveur règle les siens et doit servir cette même version.
+    """
+    if mode not in SHARD_MODES:
+        raise ValueError(f"Mode de shards inconnu : {mode} (attendu : {', '.join(SHARD_MODES)})")
+    if mode == 'http':
+        if not urls:
+            raise ValueError("APLAG_SHARD_URLS doit lister les serveurs de shards en mode http.")
+        shards = [HttpShard(url) for url in urls]
+    else:
+        directory = shards_directory(version, shards_dir)
+        manifest = read_shards_manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError(f"Aucun shard pour la version {version} dans {directory} : lancez build_shards.py.")
+        shard_class = LocalShard if mode == 'thread' else ProcessShard
+        shards = [shard_class(shard_directory(directory, number), **options) for number in range(manifest['shards'])]
+    try:
+        return ShardedCorpus(shards, version)
+    except Exception:
+        for shard in shards:
+            shard.close()
+        raise
+
+
+def check_equivalence(index, store, sharded, queries, k=10):
+    """
+    Compare les top-k d'un index unique (`index`, `store`) et du corpus partitionné `sharded`
+    pour les embeddings `queries`. Retourne la liste des différences (vide si les résultats sont identiques,
+    à l'ordre près des passages de même score).
+    Les identifiants d'un index unique à identifiants sont convertis en positions du store.
+    """
+    problems = []
+    distances, ids = index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+    positions = store.positions_of(ids) if is_id_mapped(index) else ids
+    # FAISS rend les passages à égalité de score dans un ordre quelconque : même ordre des deux côtés
+    distances, positions = merge_top_k(distances, positions, k, index.metric_type)
+    sharded_distances, sharded_positions = sharded.search(queries, k)
+    different = np.flatnonzero(np.any(positions != sharded_positions, axis=1))
+    if len(different):
+        problems.append(f"{len(different)} requête(s) sur {len(queries)} n'ont pas les mêmes passages (première : {int(different[0])}).")
+    gap = float(np.max(np.abs(distances - sharded_distances), initial=0.0))
+    if gap > 1e-5:
+        problems.append(f"Écart de score maximal de {gap:.2e} entre l'index unique et les shards.")
+    sample = np.unique(positions[positions >= 0])[:1000]
+    if len(sample) and (store.get_texts(sample) != sharded.get_texts(sample) or store.get_sources(sample) != sharded.get_sources(sample)):
+        problems.append("Les textes ou les sources des passages diffèrent entre le store et les shards.")
+    return problems
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+KEYS_FILE = 'keys.npy'
+POSITIONS_FILE = 'positions.npy'
+META_FILE = 'meta.json'
+# Nombre de mots d'un shingle (n-gramme de mots) ; lu dans meta.json à l'ouverture d'un index existant
+SHINGLE_SIZE = int(os.environ.get('APLAG_SHINGLE_SIZE', 5))
+# Multiplicateur du hachage polynomial des shingles (calcul modulo 2**64)
+_MULTIPLIER = np.uint64(0x100000001B3)
+_WORD = re.compile(r"\w+")
+
+
+def shingle_tokens(text):
+    """
+    Mots d'un texte, en minuscules, sans ponctuation : « l'analyse » et « l analyse »
+    (texte nettoyé par update_corpus.py) donnent les mêmes mots.
+    """
+    return _WORD.findall(str(text).lower())
+
+
+@lru_cache(maxsize=1 << 20)
+def _token_hash(token):
+    """Empreinte 64 bits d'un mot, identique d'un processus à l'autre (contrairement à hash())."""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _shingles(token_lists, size):
+    """
+    Empreintes des shingles de chaque liste de mots, calculées pour toutes les listes à la fois.
+    Retourne (empreintes uint64, numéro de la liste de chaque shingle).
+    """
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    hashes = np.fromiter((_token_hash(t) for tokens in token_lists for t in tokens), dtype=np.uint64, count=int(lengths.sum()))
+    counts = np.maximum(lengths - size + 1, 0)
+    owners = np.repeat(np.arange(len(token_lists), dtype=np.int64), counts)
+    rank = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    starts = np.repeat(np.cumsum(lengths) - lengths, counts) + rank
+    # Hachage polynomial, en place : un seul tableau d'empreintes et un seul tampon de lecture
+    keys = hashes[starts]
+    gathered = np.empty_like(keys)
+    for offset in range(1, size):
+        starts += 1
+        np.multiply(keys, _MULTIPLIER, out=keys)
+        np.add(keys, np.take(hashes, starts, out=gathered), out=keys)
+    return keys, owners
+
+
+def _distinct(keys, owners):
+    """Paires (empreinte, propriétaire) distinctes, triées par empreinte puis propriétaire."""
+    order = np.lexsort((owners, keys))
+    keys, owners = keys[order], owners[order]
+    keep = np.ones(len(keys), dtype=bool)
+    keep[1:] = (keys[1:] != keys[:-1]) | (owners[1:] != owners[:-1])
+    return keys[keep], owners[keep]
+
+
+def shingle_index_exists(directory):
+    return directory is not None and os.path.exists(os.path.join(directory, META_FILE))
+
+
+class ShingleIndex:
+    """
+    Index inversé des shingles (n-grammes de `size` mots) des passages du corpus,
+    pour reconnaître les copies mot pour mot sans passer par les modèles.
+
+    - keys.npy      : empreintes des shingles, triées (uint64)
+    - positions.npy : position dans le corpus du passage de chaque shingle (int32)
+    - meta.json     : taille des shingles
+
+    Une phrase copiée n'est qu'une partie d'un passage de 300 à 400 caractères : on mesure la part
+    de ses shingles présents dans un même passage (recouvrement), et non leur Jaccard.
+    Les positions sont celles du `CorpusStore` : l'index est reconstruit quand les passages changent de place.
+    """
+
+    def __init__(self, keys, positions, size=SHINGLE_SIZE):
+        self.keys = keys
+        self.positions = positions
+        self.size = size
+
+    @classmethod
+    def build(cls, texts, size=SHINGLE_SIZE, first_position=0):
+        """Index des passages `texts`, numérotés à partir de `first_position`."""
+        keys, owners = _shingles([shingle_tokens(text) for text in texts], size)
+        keys, owners = _distinct(keys, owners + first_position)
+        return cls(keys, owners.astype(np.int32), size)
+
+    def extend(self, texts, first_position):
+        """Nouvel index complété par les passages `texts`, ajoutés au corpus à partir de `first_position`."""
+        added = ShingleIndex.build(texts, self.size, first_position)
+        keys = np.concatenate([np.asarray(self.keys), added.keys])
+        positions = np.concatenate([np.asarray(self.positions), added.positions])
+        order = np.argsort(keys, kind='stable')
+        return ShingleIndex(keys[order], positions[order], self.size)
+
+    @classmethod
+    def load(cls, directory):
+        """Ouvre un index écrit par `save` en projetant ses tableaux en mémoire."""
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        keys = np.load(os.path.join(directory, KEYS_FILE), mmap_mode='r')
+        positions = np.load(os.path.join(directory, POSITIONS_FILE), mmap_mode='r')
+        return cls(keys, positions, meta['taille_shingle'])
+
+    def save(self, directory):
+        """Écrit l'index dans `directory` ; meta.json, écrit en dernier, marque un index complet."""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in ((KEYS_FILE, self.keys), (POSITIONS_FILE, self.positions)):
+            tmp_path = os.path.join(directory, f"{name}.tmp")
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmp_path, os.path.join(directory, name))
+        with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'taille_shingle': self.size, 'shingles': len(self)}, f)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match(self, sentences, min_shingles=1):
+        """
+        Passage du corpus qui contient le plus de shingles de chaque phrase.
+        Retourne (positions, recouvrements) : part des shingles de la phrase présents dans ce passage,
+        position -1 et recouvrement 0 pour une phrase sans correspondance ou de moins de `min_shingles` shingles.
+        """
+        positions = np.full(len(sentences), -1, dtype=np.int64)
+        overlaps = np.zeros(len(sentences))
+        keys, owners = _distinct(*_shingles([shingle_tokens(s) for s in sentences], self.size))
+        n_shingles = np.bincount(owners, minlength=len(sentences))
+        if len(keys) == 0 or len(self.keys) == 0:
+            return positions, overlaps
+
+        # Passages de chaque shingle de chaque phrase
+        lo = np.searchsorted(self.keys, keys, side='left')
+        counts = np.searchsorted(self.keys, keys, side='right') - lo
+        rank = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        hits = np.asarray(self.positions)[np.repeat(lo, counts) + rank].astype(np.int64)
+        pairs, shared = np.unique((np.repeat(owners, counts) << 32) | hits, return_counts=True)
+        pair_owners, pair_positions = pairs >> 32, pairs & 0xFFFF_FFFF
+
+        # Meilleur passage de chaque phrase (le premier du corpus en cas d'égalité)
+        order = np.lexsort((pair_positions, -shared, pair_owners))
+        first = order[np.r_[True, pair_owners[order][1:] != pair_owners[order][:-1]]] if len(order) else order
+        best_owners = pair_owners[first]
+        eligible = n_shingles[best_owners] >= min_shingles
+        best_owners = best_owners[eligible]
+        positions[best_owners] = pair_positions[first][eligible]
+        overlaps[best_owners] = shared[first][eligible] / n_shingles[best_owners]
+        return positions, overlaps
@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+
+import faiss
+
+from .analysis_logic import CORPUS_DIR, CORPUS_SHINGLES_DIR, CORPUS_STORE_DIR, FAISS_INDEX_PATH, get_corpus_version
+from .index_builder import describe_index
+from .shingle_index import shingle_index_exists
+
+# ==============================================================================
+# CONFIGURATION DES INSTANTANÉS DU CORPUS
+#   Chaque version du corpus est un répertoire snapshots/<version>/ :
+#     index.faiss, store/ (CorpusStore), shingles/ (ShingleIndex, facultatif) et manifest.json.
+#   Le fichier snapshots/CURRENT désigne la version servie par l'API ; il est
+#   remplacé atomiquement une fois l'instantané entièrement écrit.
+#   Sans instantané, l'API lit les anciens fichiers (corpus_doc.index, corpus_store/).
+# ==============================================================================
+SNAPSHOTS_DIR = os.path.join(CORPUS_DIR, 'snapshots')
+SNAPSHOTS_KEEP = int(os.environ.get('APLAG_SNAPSHOTS_KEEP', 3))
+CURRENT_FILE = 'CURRENT'
+INDEX_FILE = 'index.faiss'
+STORE_SUBDIR = 'store'
+SHINGLES_SUBDIR = 'shingles'
+MANIFEST_FILE = 'manifest.json'
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def current_version(snapshots_dir=SNAPSHOTS_DIR):
+    """Version désignée par CURRENT, ou None s'il n'existe pas encore d'instantané."""
+    try:
+        with open(os.path.join(snapshots_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_snapshot(snapshots_dir=SNAPSHOTS_DIR):
+    """
+    Emplacements de la version courante du corpus : {"version", "index_path", "store_dir", "shingles_dir"}.
+    À lire une seule fois par chargement, pour que l'index et le corpus viennent de la même version.
+    """
+    version = current_version(snapshots_dir)
+    if version is None:
+        return {
+            "version": get_corpus_version(), "index_path": FAISS_INDEX_PATH,
+            "store_dir": CORPUS_STORE_DIR, "shingles_dir": CORPUS_SHINGLES_DIR,
+        }
+    snapshot_dir = os.path.join(snapshots_dir, version)
+    return {
+        "version": version,
+        "index_path": os.path.join(snapshot_dir, INDEX_FILE),
+        "store_dir": os.path.join(snapshot_dir, STORE_SUBDIR),
+        "shingles_dir": os.path.join(snapshot_dir, SHINGLES_SUBDIR),
+    }
+
+
+def read_manifest(version, snapshots_dir=SNAPSHOTS_DIR):
+    """Manifeste d'un instantané, ou None (version absente ou anciens fichiers)."""
+    try:
+        with open(os.path.join(snapshots_dir, version, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+def _link_or_copy_tree(src, dst):
+    """Reprend un store existant sans le dupliquer sur disque (liens physiques si possible)."""
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        try:
+            os.link(os.path.join(src, name), os.path.join(dst, name))
+        except OSError:
+            shutil.copy2(os.path.join(src, name), os.path.join(dst, name))
+
+
+def publish_snapshot(index, store=None, store_dir=None, metadata=None, snapshots_dir=SNAPSHOTS_DIR, keep=SNAPSHOTS_KEEP,
+                     shingle_index=None, shingles_dir=None):
+    """
+    Écrit un nouvel instantané (index FAISS + `store`, ou le store existant `store_dir`)
+    puis le désigne comme version courante. Retourne la nouvelle version.
+    L'index de shingles de la voie rapide (`shingle_index`, ou l'existant `shingles_dir`) est facultatif :
+    il doit suivre les positions du store publié.
+
+    L'instantané est écrit dans un répertoire temporaire renommé une fois complet :
+    un arrêt brutal laisse au pire un répertoire ".tmp-*" ignoré, jamais une version incomplète.
+    """
+    os.makedirs(snapshots_dir, exist_ok=True)
+    parent = current_version(snapshots_dir)
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(snapshots_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE))
+    if store is not None:
+        store.save(os.path.join(tmp_dir, STORE_SUBDIR))
+        paragraphs = len(store)
+    else:
+        _link_or_copy_tree(store_dir, os.path.join(tmp_dir, STORE_SUBDIR))
+        paragraphs = None
+    shingles = None
+    if shingle_index is not None:
+        shingle_index.save(os.path.join(tmp_dir, SHINGLES_SUBDIR))
+        shingles = len(shingle_index)
+    elif shingle_index_exists(shingles_dir):
+        _link_or_copy_tree(shingles_dir, os.path.join(tmp_dir, SHINGLES_SUBDIR))
+
+    manifest = {
+        "version": version,
+        "parent": parent,
+        "cree_le": datetime.now(timezone.utc).isoformat(),
+        "paragraphes": paragraphs,
+        "vecteurs": index.ntotal,
+        "index": describe_index(index),
+        "shingles": shingles,
+        **(metadata or {}),
+    }
+    _write_atomic(os.path.join(tmp_dir, MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    os.rename(tmp_dir, os.path.join(snapshots_dir, version))
+    _write_atomic(os.path.join(snapshots_dir, CURRENT_FILE), version)
+    prune_snapshots(snapshots_dir, keep)
+    return version
+
+
+def prune_snapshots(snapshots_dir=SNAPSHOTS_DIR, keep=SNAPSHOTS_KEEP):
+    """
+    Supprime les instantanés les plus anciens au-delà de `keep`, ainsi que les écritures abandonnées.
+    La version courante n'est jamais supprimée ; un processus qui sert encore une ancienne
+    version garde ses fichiers ouverts (index en mémoire, store projeté) jusqu'à sa fermeture.
+    """
+    current = current_version(snapshots_dir)
+    versions = sorted(
+        name for name in os.listdir(snapshots_dir)
+        if os.path.isdir(os.path.join(snapshots_dir, name)) and not name.startswith(".")
+    )
+    for name in os.listdir(snapshots_dir):
+        if name.startswith(".tmp-") and name[len(".tmp-"):] < (versions[-1] if versions else ""):
+            shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+    for name in versions[:-keep] if keep > 0 else []:
+        if name != current:
+            shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
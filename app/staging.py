@@ -0,0 +1,45 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from .analysis_logic import CORPUS_DIR
+from .functions.content_hash import sha256_bytes
+
+# ==============================================================================
+# CONFIGURATION DE LA MISE EN ATTENTE DES DOCUMENTS
+#   Les documents reçus par l'API sont conservés pour enrichir le corpus (update_corpus.py).
+#   Ils sont nommés par leur empreinte SHA-256 : un même document n'est stocké qu'une fois
+#   et le nom fourni par le client n'est jamais utilisé comme chemin.
+# ==============================================================================
+STAGING_DIR = os.path.join(CORPUS_DIR, 'staging_files')
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def stage_upload(data, filename, staging_dir=STAGING_DIR):
+    """
+    Enregistre un document reçu sous `<sha256>.pdf`, accompagné de `<sha256>.json`
+    qui conserve son nom d'origine (utilisé comme titre lors de l'ajout au corpus).
+    Appelée en tâche de fond, après l'envoi de la réponse. Retourne le chemin du PDF.
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    digest = sha256_bytes(data)
+    pdf_path = os.path.join(staging_dir, f"{digest}.pdf")
+    if os.path.exists(pdf_path):
+        return pdf_path
+
+    # La fiche est écrite avant le PDF : un PDF visible a toujours son nom d'origine
+    metadata = {
+        "filename": os.path.basename(filename or f"{digest}.pdf"),
+        "sha256": digest,
+        "recu_le": datetime.now(timezone.utc).isoformat()
+    }
+    _write_atomic(os.path.join(staging_dir, f"{digest}.json"), json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+    _write_atomic(pdf_path, data)
+    return pdf_path
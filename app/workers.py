@@ -0,0 +1,473 @@
+import asyncio
+import gc
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from .analysis_logic import FAISS_EF_SEARCH, FAISS_MMAP, FAISS_NPROBE, FAST_PATH, bi_encoder_signature, load_bi_encoder, load_corpus_dataframe, load_cross_encoder, load_faiss_index, load_shingle_index, analyze_pdf_for_plagiarism, iter_pdf_analysis
+from .batching import MICROBATCH_ENABLED, BatchedBiEncoder, BatchedCrossEncoder
+from .cohort import cohort_archive, cohort_report, compare_cohort, document_report_data, encode_cohort, extract_cohort
+from .embedding_cache import EMBEDDING_CACHE_ENABLED, EmbeddingCache
+from .functions.content_hash import sha256_document
+from .metrics import record_analysis, record_event, record_stage_timings
+from .profiling import profile_to
+from .report_generator import render_pdf_report
+from .result_cache import ResultCache
+from .sentence_cache import SentenceCache
+from .sharding import SHARD_MODE, ShardedCorpus, load_sharded_corpus
+from .snapshots import resolve_snapshot
+
+# ==============================================================================
+# CONFIGURATION DU POOL D'ANALYSE
+#   - "thread"  : les modèles de l'API sont partagés (torch et faiss libèrent le GIL)
+#   - "process" : chaque processus charge ses propres modèles au démarrage
+# ==============================================================================
+EXECUTOR_KIND = os.environ.get('APLAG_EXECUTOR', 'thread')
+MAX_WORKERS = int(os.environ.get('APLAG_MAX_WORKERS', 2))
+# Nombre de demandes autorisées à attendre un worker libre avant de refuser (503)
+MAX_QUEUE = int(os.environ.get('APLAG_MAX_QUEUE', 8))
+RETRY_AFTER_SECONDS = int(os.environ.get('APLAG_RETRY_AFTER', 30))
+# Chargement des modèles, de l'index et du corpus dans le processus parent avant le fork des workers
+# (gunicorn --preload, voir gunicorn.conf.py) : leurs pages sont partagées en copie sur écriture.
+PRELOAD = os.environ.get('APLAG_PRELOAD', '0') == '1'
+# Processus de rendu des rapports de /generate-report (0 = rendu dans le worker d'analyse) :
+# le worker d'analyse est libéré dès la fin de l'analyse et passe à la demande suivante pendant le rendu.
+RENDER_WORKERS = int(os.environ.get('APLAG_RENDER_WORKERS', 1))
+# "spawn" évite de dupliquer par fork un processus qui a déjà chargé torch et ses threads
+RENDER_START_METHOD = os.environ.get('APLAG_RENDER_START_METHOD', 'spawn')
+
+
+class PoolSaturatedError(Exception):
+    """Levée lorsque tous les workers sont occupés et que la file d'attente est pleine."""
+
+
+# Ressources chargées par `preload_resources` dans le processus parent
+_preloaded = {}
+
+def preload_resources():
+    """
+    Charge les modèles, l'index et le corpus de la version courante avant le fork des workers.
+    Les caches (connexions SQLite) et les threads de micro-batching ne sont pas préchargés :
+    ils ne survivent pas au fork et sont créés dans chaque worker.
+    """
+    snapshot = resolve_snapshot()
+    _preloaded.update(bi_encoder=load_bi_encoder(), cross_encoder=load_cross_encoder())
+    if not SHARD_MODE:
+        # Un corpus partitionné est ouvert par chaque worker : ses threads et processus de shards ne survivent pas au fork
+        _preloaded.update(
+            version=snapshot['version'],
+            faiss_index=load_faiss_index(snapshot['index_path']),
+            df_corpus=load_corpus_dataframe(snapshot['store_dir']),
+            shingle_index=load_shingle_index(snapshot['shingles_dir']),
+        )
+        df_corpus = _preloaded['df_corpus']
+        if df_corpus.ids is not None:
+            # Table de correspondance identifiants -> positions construite une fois, partagée après le fork
+            df_corpus.positions_of([])
+    # Les objets déjà chargés ne sont plus parcourus par le ramasse-miettes :
+    # leurs en-têtes ne sont pas réécrits, leurs pages restent partagées.
+    gc.freeze()
+    print(f"Ressources préchargées avant le fork des workers (corpus : {snapshot['version']}).")
+
+
+def load_corpus_resources(snapshot=None):
+    """
+    Charge l'index FAISS, le corpus, l'index de shingles et les caches d'une version du corpus
+    (`snapshot` renvoyé par `resolve_snapshot`, par défaut la version courante).
+    Les index et le corpus préchargés par le processus parent sont repris s'ils sont de la même version.
+    Avec APLAG_SHARDS, le corpus partitionné (sharding.py) tient lieu d'index, de corpus et d'index de shingles.
+    """
+    snapshot = snapshot or resolve_snapshot()
+    corpus_version = snapshot['version']
+    if SHARD_MODE:
+        sharded = load_sharded_corpus(corpus_version, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH, mmap=FAISS_MMAP)
+        faiss_index = df_corpus = sharded
+        shingle_index = sharded if FAST_PATH and sharded.has_shingles else None
+    elif _preloaded.get('version') == corpus_version:
+        faiss_index, df_corpus, shingle_index = _preloaded['faiss_index'], _preloaded['df_corpus'], _preloaded['shingle_index']
+    else:
+        faiss_index, df_corpus = load_faiss_index(snapshot['index_path']), load_corpus_dataframe(snapshot['store_dir'])
+        shingle_index = load_shingle_index(snapshot['shingles_dir'])
+    return {
+        'faiss_index': faiss_index,
+        'df_corpus': df_corpus,
+        'shingle_index': shingle_index,
+        'corpus_version': corpus_version,
+        'result_cache': ResultCache(corpus_version),
+        'sentence_cache': SentenceCache(corpus_version),
+    }
+
+
+def load_models(snapshot=None):
+    """
+    Charge les modèles, l'index FAISS, le corpus et les caches de résultats dans un dictionnaire.
+    Le cache d'embeddings ne dépend que du Bi-Encoder : il est conservé d'une version du corpus à l'autre.
+    """
+    if _preloaded:
+        bi_encoder, cross_encoder = _preloaded['bi_encoder'], _preloaded['cross_encoder']
+    else:
+        bi_encoder, cross_encoder = load_bi_encoder(), load_cross_encoder()
+    if EXECUTOR_KIND == 'thread' and MICROBATCH_ENABLED:
+        # Modèles partagés par les threads : on regroupe les appels des requêtes concurrentes
+        bi_encoder, cross_encoder = BatchedBiEncoder(bi_encoder), BatchedCrossEncoder(cross_encoder)
+    return {
+        'bi_encoder': bi_encoder,
+        'cross_encoder': cross_encoder,
+        'embedding_cache': EmbeddingCache(bi_encoder_signature()) if EMBEDDING_CACHE_ENABLED else None,
+        **load_corpus_resources(snapshot),
+    }
+
+
+# Modèles propres à un processus du pool (mode "process" uniquement)
+_process_models = {}
+
+def _init_process_worker(snapshot=None):
+    """Initialiseur des processus du pool : charge les modèles une seule fois par processus."""
+    _process_models.update(load_models(snapshot))
+
+
+def _warmup():
+    """Tâche vide utilisée pour forcer le démarrage des processus du pool."""
+    return os.getpid()
+
+
+def analyze_document(document, min_verdict_score, models=None, progress_callback=None, profile_path=None, sentences=None, embedding_cache=None):
+    """
+    Analyse un PDF (chemin ou contenu en bytes), en réutilisant le cache de résultats quand le même
+    document a déjà été analysé sur la même version du corpus. Aucun rapport n'est rendu.
+    Exécutée dans le pool : `models` est fourni en mode "thread",
+    sinon on utilise les modèles préchargés du processus.
+    Les résultats portent la version du corpus utilisée ("version_corpus").
+    La durée des étapes et les compteurs de l'analyse sont enregistrés dans les métriques (metrics.py) ;
+    avec `profile_path`, l'analyse est refaite sans consulter le cache et profilée (profiling.py).
+    `sentences` (phrases déjà extraites) et `embedding_cache` (embeddings déjà calculés) viennent
+    de l'analyse de cohorte (`analyze_cohort_documents`).
+    """
+    models = models if models is not None else _process_models
+    result_cache = models['result_cache']
+    cache_key = result_cache.make_key(sha256_document(document), min_verdict_score)
+
+    analysis_results = result_cache.get_analysis(cache_key) if profile_path is None else None
+    if analysis_results is not None:
+        record_event('aplag_analyses_total', origine='cache')
+        return analysis_results
+
+    timings, stats = {}, {}
+    start = time.perf_counter()
+    with profile_to(profile_path):
+        analysis_results = analyze_pdf_for_plagiarism(
+            file_path=document,
+            bi_encoder=models['bi_encoder'],
+            cross_encoder=models['cross_encoder'],
+            index=models['faiss_index'],
+            df_corpus=models['df_corpus'],
+            min_verdict_score=min_verdict_score,
+            progress_callback=progress_callback,
+            sentence_cache=models['sentence_cache'],
+            shingle_index=models['shingle_index'],
+            embedding_cache=embedding_cache or models['embedding_cache'],
+            sentences=sentences,
+            stats=stats,
+            timings=timings
+        )
+    record_analysis(time.perf_counter() - start, timings, stats, analysis_results.get('summary'))
+    analysis_results['version_corpus'] = models['corpus_version']
+    result_cache.put_analysis(cache_key, analysis_results)
+    return analysis_results
+
+
+def analyze_and_render(document, document_name, min_verdict_score, models=None, output_path=None, progress_callback=None):
+    """
+    Analyse un PDF (voir `analyze_document`) puis génère son rapport PDF dans le même worker
+    (tâches asynchrones ; /generate-report confie le rendu au `RenderPool`).
+    Retourne (résultats de l'analyse, rapport) : le rapport est le contenu du PDF,
+    ou `output_path` une fois le PDF écrit à cet emplacement, ou None si le document est vide.
+    """
+    models = models if models is not None else _process_models
+    result_cache = models['result_cache']
+    cache_key = result_cache.make_key(sha256_document(document), min_verdict_score)
+    analysis_results = analyze_document(document, min_verdict_score, models=models, progress_callback=progress_callback)
+
+    # Les documents vides ne produisent qu'un message : pas de rapport PDF
+    if 'summary' not in analysis_results:
+        return analysis_results, None
+
+    if progress_callback is not None:
+        total = analysis_results['summary']['phrases_analysees']
+        progress_callback("rendu", total, total)
+
+    report_data = result_cache.get_report(cache_key, document_name)
+    render_timings = {}
+    if report_data is None:
+        report_data = render_pdf_report(analysis_results, document_name, timings=render_timings)
+        result_cache.put_report(cache_key, document_name, report_data)
+        record_stage_timings(render_timings)
+    record_event('aplag_rapports_total', origine='rendu' if render_timings else 'cache')
+
+    if output_path is None:
+        return analysis_results, report_data
+    with open(output_path, "wb") as f:
+        f.write(report_data)
+    return analysis_results, output_path
+
+
+def analyze_cohort_documents(documents, names, min_verdict_score, models=None, with_corpus=True, progress_callback=None):
+    """
+    Analyse de cohorte (cohort.py) : les documents sont comparés entre eux et, avec `with_corpus`,
+    chacun au corpus. Les phrases de chaque document ne sont extraites qu'une fois et celles de toute
+    la cohorte sont encodées en un seul appel : l'analyse sur le corpus (`analyze_document`, avec son
+    cache de résultats) et la comparaison des documents réutilisent ces embeddings.
+    Toute la cohorte est traitée par une seule tâche du pool.
+    `progress_callback(étape, phrases traitées, phrases totales)` suit les étapes "extraction", "encodage",
+    "corpus" (document par document) et "cohorte" (bloc par bloc).
+    Retourne les résultats de `cohort_report`, `names` devant être uniques (voir `unique_names`).
+    """
+    models = models if models is not None else _process_models
+    start = time.perf_counter()
+    if progress_callback is not None:
+        progress_callback("extraction", 0, 0)
+    extracted, relevant = extract_cohort(documents)
+    total = sum(len(sentences) for sentences in relevant)
+    if progress_callback is not None:
+        progress_callback("encodage", 0, total)
+    embeddings = encode_cohort(models['bi_encoder'], relevant, models['embedding_cache'])
+
+    corpus_results = None
+    if with_corpus:
+        corpus_results, done = [], 0
+        for document, sentences, document_relevant in zip(documents, extracted, relevant):
+            if progress_callback is not None:
+                progress_callback("corpus", done, total)
+            corpus_results.append(analyze_document(document, min_verdict_score, models=models, sentences=sentences, embedding_cache=embeddings))
+            done += len(document_relevant)
+    findings, matrix = compare_cohort(relevant, names, models['bi_encoder'], embeddings, models['cross_encoder'], min_verdict_score,
+                                      progress_callback=progress_callback)
+    record_event('aplag_cohortes_total')
+    record_event('aplag_cohorte_duree_secondes', duration=time.perf_counter() - start)
+    return cohort_report(names, relevant, matrix, findings, corpus_results, version_corpus=models['corpus_version'])
+
+
+def analyze_and_render_cohort(documents, names, min_verdict_score, models=None, with_corpus=True, output_path=None, progress_callback=None):
+    """
+    Analyse de cohorte (voir `analyze_cohort_documents`) pour les tâches asynchrones ; avec `output_path`,
+    écrit à cet emplacement l'archive zip de la cohorte (cohorte.json, matrice.csv et le rapport PDF
+    de chaque document ; l'étape "rendu" de `progress_callback` compte les documents).
+    Retourne (résultats de la cohorte, `output_path` ou None).
+    """
+    results = analyze_cohort_documents(documents, names, min_verdict_score, models=models, with_corpus=with_corpus,
+                                       progress_callback=progress_callback)
+    if output_path is None:
+        return results, None
+
+    reports = []
+    for position, document in enumerate(results["documents"]):
+        if progress_callback is not None:
+            progress_callback("rendu", position, len(results["documents"]))
+        render_timings = {}
+        reports.append(render_pdf_report(document_report_data(document, results["version_corpus"]), document["document"], timings=render_timings))
+        record_stage_timings(render_timings)
+    with open(output_path, "wb") as f:
+        f.write(cohort_archive(results, reports))
+    return results, output_path
+
+
+def stream_analysis(document, min_verdict_score, models=None):
+    """
+    Version en flux de l'analyse : produit les événements de `iter_pdf_analysis`
+    (progression, constats, résumé) au fur et à mesure des paquets de phrases.
+    Un document déjà analysé sur la même version du corpus est rejoué depuis le cache de résultats.
+    Le résumé final porte la version du corpus utilisée ("version_corpus").
+    """
+    models = models if models is not None else _process_models
+    result_cache = models['result_cache']
+    cache_key = result_cache.make_key(sha256_document(document), min_verdict_score)
+
+    analysis_results = result_cache.get_analysis(cache_key)
+    if analysis_results is not None:
+        record_event('aplag_analyses_total', origine='cache')
+        if 'summary' not in analysis_results:
+            yield {"type": "message", "message": analysis_results['message']}
+            return
+        for finding in analysis_results['findings']:
+            yield {"type": "finding", "finding": finding}
+        yield {"type": "summary", "summary": analysis_results['summary'], "version_corpus": models['corpus_version']}
+        return
+
+    findings, timings, stats = [], {}, {}
+    start = time.perf_counter()
+    for event in iter_pdf_analysis(
+        document,
+        models['bi_encoder'],
+        models['cross_encoder'],
+        models['faiss_index'],
+        models['df_corpus'],
+        min_verdict_score=min_verdict_score,
+        sentence_cache=models['sentence_cache'],
+        shingle_index=models['shingle_index'],
+        embedding_cache=models['embedding_cache'],
+        stats=stats,
+        timings=timings
+    ):
+        if event["type"] == "finding":
+            findings.append(event["finding"])
+        elif event["type"] == "message":
+            record_analysis(time.perf_counter() - start, timings, stats, None)
+            result_cache.put_analysis(cache_key, {"message": event["message"], "version_corpus": models['corpus_version']})
+        elif event["type"] == "summary":
+            record_analysis(time.perf_counter() - start, timings, stats, event["summary"])
+            event["version_corpus"] = models['corpus_version']
+            # Même contenu que le rapport de `analyze_and_render`
+            result_cache.put_analysis(cache_key, {
+                "summary": event["summary"],
+                "findings": sorted(findings, key=lambda x: x['score_composite'], reverse=True),
+                "version_corpus": models['corpus_version']
+            })
+        yield event
+
+
+def _pump_events(func, events, *args, **kwargs):
+    """
+    Exécutée dans le pool : déverse les événements du générateur `func` dans la file `events`,
+    puis None pour signaler la fin (ou un événement "erreur" si l'analyse échoue).
+    """
+    try:
+        for event in func(*args, **kwargs):
+            events.put(event)
+    except Exception as e:
+        events.put({"type": "erreur", "message": str(e)})
+    finally:
+        events.put(None)
+
+
+class WorkerPool:
+    """
+    Exécuteur borné pour le travail CPU de l'API.
+    Au-delà de `max_workers + max_queue` tâches en cours, `run` refuse
+    immédiatement la demande au lieu de la laisser s'accumuler.
+    Un pool sert une seule version du corpus : `models` en mode "thread",
+    `snapshot` (chargé par chaque processus) en mode "process".
+    """
+
+    def __init__(self, kind=EXECUTOR_KIND, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE, models=None, snapshot=None):
+        if kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='aplag-worker')
+        elif kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_process_worker, initargs=(snapshot,))
+        else:
+            raise ValueError(f"Type d'exécuteur inconnu : {kind} (attendu : 'thread' ou 'process')")
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self.models = models
+        self.pending = 0
+        # Files inter-processus pour `stream` (créées à la demande en mode "process")
+        self._manager = None
+
+    def start(self):
+        """En mode "process", démarre les processus pour que les modèles soient chargés avant la première requête."""
+        if self.kind == 'process':
+            for future in [self.executor.submit(_warmup) for _ in range(self.max_workers)]:
+                future.result()
+
+    async def run(self, func, *args, **kwargs):
+        """Exécute `func` dans le pool sans bloquer la boucle d'événements."""
+        if self.pending >= self.capacity:
+            raise PoolSaturatedError(f"{self.pending} analyses en cours ou en attente (capacité : {self.capacity}).")
+
+        if self.kind == 'thread':
+            kwargs['models'] = self.models
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def stream(self, func, *args, **kwargs):
+        """
+        Exécute le générateur `func` dans le pool et retourne un générateur asynchrone de ses événements.
+        L'admission est vérifiée immédiatement (PoolSaturatedError), avant le début de la réponse.
+        """
+        if self.pending >= self.capacity:
+            raise PoolSaturatedError(f"{self.pending} analyses en cours ou en attente (capacité : {self.capacity}).")
+
+        if self.kind == 'thread':
+            kwargs['models'] = self.models
+            events = queue.Queue()
+        else:
+            if self._manager is None:
+                self._manager = multiprocessing.Manager()
+            events = self._manager.Queue()
+
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        future = self.executor.submit(_pump_events, func, events, *args, **kwargs)
+        # Le worker va jusqu'au bout même si le client se déconnecte : l'analyse alimente les caches
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+
+        async def _events():
+            while True:
+                event = await loop.run_in_executor(None, events.get)
+                if event is None:
+                    return
+                yield event
+
+        return _events()
+
+    def _release(self):
+        self.pending -= 1
+
+    def shutdown(self, wait=False):
+        """Arrête le pool ; avec `wait=True`, les tâches déjà acceptées se terminent d'abord (changement de version)."""
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        if self._manager is not None:
+            self._manager.shutdown()
+        if self.kind == 'thread' and isinstance((self.models or {}).get('df_corpus'), ShardedCorpus):
+            # Processus et connexions des shards de la version servie par ce pool
+            self.models['df_corpus'].close()
+
+
+class RenderPool:
+    """
+    Processus dédiés au rendu des rapports (xhtml2pdf tient le GIL pendant tout le rendu).
+    Ils ne chargent ni modèles ni corpus : seules les données de l'analyse leur sont transmises.
+    Le pool n'est pas lié à une version du corpus et survit aux rechargements.
+    Avec `max_workers=0`, le rendu a lieu dans le thread par défaut de la boucle d'événements.
+    """
+
+    def __init__(self, max_workers=RENDER_WORKERS, start_method=RENDER_START_METHOD):
+        self.executor = None
+        if max_workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+        self.max_workers = max_workers
+        # Rendus en cours ou en attente d'un processus (jauge de /metrics)
+        self.pending = 0
+
+    def start(self):
+        """
+        Démarre les processus par le rendu d'un rapport vide : les imports (xhtml2pdf, reportlab) précèdent
+        la première demande. Les fonctions soumises viennent de report_generator.py, dont l'import
+        n'entraîne pas celui des modèles.
+        """
+        if self.executor is not None:
+            empty_report = {"summary": {}, "findings": []}
+            for future in [self.executor.submit(render_pdf_report, empty_report, "") for _ in range(self.max_workers)]:
+                future.result()
+
+    async def run(self, func, *args, **kwargs):
+        """Exécute la fonction de rendu `func` sans bloquer la boucle d'événements."""
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self, wait=False):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,75 @@
+"""
+Compare un moteur d'inférence (ONNX fp32 ou int8) au modèle PyTorch fp32 de référence :
+- modèles seuls : débit, similarité des embeddings et écart des scores du Cross-Encoder
+  sur des passages du corpus ;
+- analyse complète d'un ensemble de PDF de référence : constats perdus ou gagnés et
+  verdicts (get_final_verdict) modifiés, durée d'analyse.
+
+Utilisation (depuis la racine du projet, après export_models.py) :
+    python -m benchmarks.bench_backend validation/*.pdf --backend onnx-int8
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app.analysis_logic import load_bi_encoder, load_corpus_dataframe, load_cross_encoder, load_faiss_index
+from benchmarks.bench_cascade import compare, run
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def compare_models(reference, candidate, texts):
+    """Débit et écarts de sortie des deux modèles sur les mêmes passages."""
+    encode_kwargs = dict(convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+    ref_embeddings, ref_time = timed(reference['bi_encoder'].encode, texts, **encode_kwargs)
+    cand_embeddings, cand_time = timed(candidate['bi_encoder'].encode, texts, **encode_kwargs)
+    cosine = np.sum(ref_embeddings * cand_embeddings, axis=1)
+    print(f"Bi-Encoder    : {len(texts) / ref_time:8.1f} -> {len(texts) / cand_time:8.1f} passages/s "
+          f"({ref_time / cand_time:.2f}x), cosinus min {cosine.min():.4f}, moyen {cosine.mean():.4f}")
+
+    # Paires proches (passage, passage suivant) et identiques, pour couvrir toute l'échelle de scores
+    pairs = [[a, b] for a, b in zip(texts, texts[1:])] + [[a, a] for a in texts[:len(texts) // 4]]
+    ref_scores, ref_time = timed(reference['cross_encoder'].predict, pairs, show_progress_bar=False)
+    cand_scores, cand_time = timed(candidate['cross_encoder'].predict, pairs, show_progress_bar=False)
+    diff = np.abs(np.asarray(ref_scores) - np.asarray(cand_scores))
+    print(f"Cross-Encoder : {len(pairs) / ref_time:8.1f} -> {len(pairs) / cand_time:8.1f} paires/s "
+          f"({ref_time / cand_time:.2f}x), écart de score max {diff.max():.4f}, moyen {diff.mean():.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='+', help="PDF de l'ensemble de référence")
+    parser.add_argument('--backend', default='onnx-int8', help="Moteur d'inférence à comparer à torch")
+    parser.add_argument('--passages', type=int, default=512, help="Passages du corpus pour la comparaison des modèles")
+    parser.add_argument('--min-verdict-score', type=float, default=0.5)
+    args = parser.parse_args()
+
+    index, df_corpus = load_faiss_index(), load_corpus_dataframe()
+    reference = {'bi_encoder': load_bi_encoder('torch'), 'cross_encoder': load_cross_encoder('torch')}
+    candidate = {'bi_encoder': load_bi_encoder(args.backend), 'cross_encoder': load_cross_encoder(args.backend)}
+
+    rng = random.Random(0)
+    texts = df_corpus.get_texts([rng.randrange(len(df_corpus)) for _ in range(args.passages)])
+    print(f"torch -> {args.backend}\n")
+    compare_models(reference, candidate, texts)
+
+    resources = {'index': index, 'df_corpus': df_corpus}
+    ref_findings, _, ref_time = run(args.pdfs, {**reference, **resources}, args.min_verdict_score)
+    cand_findings, _, cand_time = run(args.pdfs, {**candidate, **resources}, args.min_verdict_score)
+    lost, gained, changed = compare(ref_findings, cand_findings)
+    n_reference = sum(len(f) for f in ref_findings.values())
+    agreement = (n_reference - lost - changed) / n_reference if n_reference else 1.0
+
+    print(f"\nAnalyse de {len(args.pdfs)} PDF : {ref_time:.1f} s -> {cand_time:.1f} s ({ref_time / cand_time:.2f}x)")
+    print(f"Constats de référence : {n_reference} ; perdus : {lost} ; gagnés : {gained} ; verdicts modifiés : {changed}")
+    print(f"Accord sur les verdicts : {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
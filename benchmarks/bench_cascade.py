@@ -0,0 +1,84 @@
+"""
+Évalue la cascade Bi-Encoder -> Cross-Encoder sur un ensemble de validation :
+paires élaguées, temps d'analyse et écarts de constats par rapport à l'analyse complète.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_cascade validation/*.pdf --floors 0.3,0.4 --margins 0.1,0.2
+"""
+import argparse
+import itertools
+import time
+
+from app.analysis_logic import (
+    analyze_pdf_for_plagiarism, load_bi_encoder, load_corpus_dataframe, load_cross_encoder, load_faiss_index
+)
+
+
+def parse_values(text):
+    """'0.3,none' -> [0.3, None]"""
+    return [None if v.strip().lower() == 'none' else float(v) for v in text.split(',')]
+
+
+def run(pdf_paths, resources, min_verdict_score, **cascade):
+    """Analyse chaque PDF ; retourne les constats par document, les compteurs cumulés et la durée."""
+    findings, totals = {}, {}
+    start = time.perf_counter()
+    for path in pdf_paths:
+        stats = {}
+        report = analyze_pdf_for_plagiarism(path, **resources, min_verdict_score=min_verdict_score, stats=stats, **cascade)
+        findings[path] = {f['phrase_suspecte']: f for f in report.get('findings', [])}
+        for name, value in stats.items():
+            totals[name] = totals.get(name, 0) + value
+    return findings, totals, time.perf_counter() - start
+
+
+def compare(reference, candidate):
+    """Constats perdus, gagnés et verdicts modifiés par rapport à la référence."""
+    lost = gained = changed = 0
+    for path, ref_findings in reference.items():
+        cand_findings = candidate[path]
+        lost += len(ref_findings.keys() - cand_findings.keys())
+        gained += len(cand_findings.keys() - ref_findings.keys())
+        changed += sum(
+            1 for phrase in ref_findings.keys() & cand_findings.keys()
+            if ref_findings[phrase]['verdict'] != cand_findings[phrase]['verdict']
+        )
+    return lost, gained, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='+', help="PDF de l'ensemble de validation")
+    parser.add_argument('--floors', default='none,0.3,0.4,0.5', help="Planchers Bi-Encoder à tester ('none' = désactivé)")
+    parser.add_argument('--margins', default='none,0.1,0.2', help="Marges Bi-Encoder à tester ('none' = désactivé)")
+    parser.add_argument('--min-k', type=int, default=1)
+    parser.add_argument('--min-verdict-score', type=float, default=0.5)
+    args = parser.parse_args()
+
+    resources = {
+        'bi_encoder': load_bi_encoder(),
+        'cross_encoder': load_cross_encoder(),
+        'index': load_faiss_index(),
+        'df_corpus': load_corpus_dataframe(),
+    }
+
+    reference, ref_stats, ref_time = run(args.pdfs, resources, args.min_verdict_score, bi_score_floor=None, bi_score_margin=None)
+    n_reference = sum(len(f) for f in reference.values())
+    print(f"Référence (sans cascade) : {ref_stats['paires_reclassees']} paires, {n_reference} constats, {ref_time:.1f} s\n")
+
+    print(f"{'plancher':>8} {'marge':>6} {'paires':>8} {'élaguées':>9} {'écartées':>9} {'durée':>8} {'perdus':>7} {'gagnés':>7} {'verdicts':>9}")
+    for floor, margin in itertools.product(parse_values(args.floors), parse_values(args.margins)):
+        if floor is None and margin is None:
+            continue
+        findings, stats, duration = run(
+            args.pdfs, resources, args.min_verdict_score,
+            bi_score_floor=floor, bi_score_margin=margin, min_rerank_k=args.min_k
+        )
+        lost, gained, changed = compare(reference, findings)
+        pruned_ratio = stats['paires_elaguees'] / (stats['paires_elaguees'] + stats['paires_reclassees'])
+        print(f"{str(floor):>8} {str(margin):>6} {stats['paires_reclassees']:>8} {pruned_ratio:>9.1%} "
+              f"{stats['phrases_ecartees']:>9} {duration:>7.1f}s {lost:>7} {gained:>7} {changed:>9}")
+
+
+if __name__ == "__main__":
+    main()
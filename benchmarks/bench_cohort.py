@@ -0,0 +1,160 @@
+"""
+Analyse de cohorte (app/cohort.py) sur des documents synthétiques : une partie des paires de documents
+partage des phrases (copiées ou paraphrasées de l'un à l'autre), absentes du corpus.
+
+Pour chaque taille de cohorte, avec les modèles factices de benchmarks/synthetic.py :
+  - cohorte : workers.analyze_cohort_documents (chaque document sur le corpus, puis les documents entre eux) ;
+  - envois séparés : un analyze_pdf_for_plagiarism par document, sur le corpus seulement
+    (ce que coûtent les N envois actuels, qui ne voient pas les phrases partagées entre documents) ;
+  - paire par paire (jusqu'à --max-pairwise documents) : la comparaison des documents deux à deux,
+    chaque paire extraite, encodée et comparée séparément.
+Vérifie que chaque paire plantée figure dans les paires suspectes, et compare la part de phrases partagées
+des paires plantées (la plus faible) à celle des autres paires signalées (la plus forte : phrases du corpus
+copiées par deux documents, rapprochements fortuits des modèles factices).
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_cohort --documents 10,50,100 --sentences 200
+    python -m benchmarks.bench_cohort --documents 20 --encode-delay 0.002 --rerank-delay 0.0005
+"""
+import argparse
+import itertools
+import os
+import tempfile
+import time
+
+os.environ.setdefault('APLAG_METRICS', '0')  # ne pas écrire dans les métriques de l'application
+
+import numpy as np
+
+from benchmarks.synthetic import (
+    StubBiEncoder, StubCrossEncoder, Vocabulary, _paraphrase, document_sentences, parse_size, synthetic_pdf, write_corpus
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+VERSION = 'synthetique'
+
+
+def build_corpus(directory, n_paragraphs, dim, seed):
+    """Corpus synthétique et son index exact (réutilisés d'une exécution à l'autre)."""
+    import faiss
+    from app.corpus_store import CorpusStore
+    from app.index_builder import build_index
+
+    index_path = os.path.join(directory, 'index.faiss')
+    if not os.path.exists(index_path):
+        encoder = StubBiEncoder(dim=dim, seed=seed)
+        parts = []
+        write_corpus(os.path.join(directory, 'store'), n_paragraphs, Vocabulary(seed=seed), seed=seed,
+                     on_chunk=lambda texts, _: parts.append(encoder.encode(texts, normalize_embeddings=True)))
+        faiss.write_index(build_index(np.concatenate(parts), 'flat'), index_path)
+    return CorpusStore.load(os.path.join(directory, 'store')), faiss.read_index(index_path)
+
+
+def synthetic_cohort(store, vocabulary, n_documents, n_sentences, collusion_ratio, shared_ratio, seed):
+    """
+    Phrases de `n_documents` documents ; les `collusion_ratio` premières paires (0, 1), (2, 3)...
+    partagent `shared_ratio` des phrases du second document, reprises du premier (copies et paraphrases).
+    Retourne (phrases par document, paires plantées).
+    """
+    rng = np.random.default_rng(seed)
+    cohort = [document_sentences(store, vocabulary, n_sentences, seed=seed * 10_007 + d) for d in range(n_documents)]
+    planted = [(a, a + 1) for a in range(0, n_documents - 1, 2)][:int(round(collusion_ratio * (n_documents // 2)))]
+    for a, b in planted:
+        # Phrases nouvelles de `a` (hors corpus), reprises à des positions aléatoires de `b`
+        own = [s for s in cohort[a] if len(s.split()) >= 8]
+        n_shared = min(int(shared_ratio * n_sentences), len(own))
+        for slot, p in zip(rng.choice(n_sentences, n_shared, replace=False), rng.choice(len(own), n_shared, replace=False)):
+            sentence = own[p]
+            cohort[b][slot] = _paraphrase(sentence, vocabulary, rng, replaced=0.1) if rng.random() < 0.3 else sentence
+    return cohort, planted
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--passages', default='10k', help="Taille du corpus synthétique (ex. 10k, 100k)")
+    parser.add_argument('--documents', default='10,50', help="Tailles de cohorte")
+    parser.add_argument('--sentences', type=int, default=200, help="Phrases par document")
+    parser.add_argument('--collusion', type=float, default=0.5, help="Part des paires (0, 1), (2, 3)... qui partagent des phrases")
+    parser.add_argument('--shared', type=float, default=0.2, help="Part des phrases d'un document reprises de l'autre")
+    parser.add_argument('--max-pairwise', type=int, default=20, help="Taille maximale de cohorte comparée paire par paire")
+    parser.add_argument('--encode-delay', type=float, default=0.0, help="Durée simulée d'encodage par phrase (s)")
+    parser.add_argument('--rerank-delay', type=float, default=0.0, help="Durée simulée de re-ranking par paire (s)")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    from app.analysis_logic import analyze_pdf_for_plagiarism
+    from app.cohort import compare_cohort, encode_cohort, extract_cohort
+    from app.pdf_extraction import shutdown_extraction_pool
+    from app.result_cache import ResultCache
+    from app.workers import analyze_cohort_documents
+
+    n_paragraphs = parse_size(args.passages)
+    store, index = build_corpus(os.path.join(args.data_dir, f"cohorte-{n_paragraphs}-d{args.dim}-s{args.seed}"),
+                                n_paragraphs, args.dim, args.seed)
+    vocabulary = Vocabulary(seed=args.seed)
+    bi_encoder = StubBiEncoder(dim=args.dim, seed=args.seed, delay=args.encode_delay)
+    cross_encoder = StubCrossEncoder(delay=args.rerank_delay)
+
+    print(f"Corpus : {n_paragraphs} passages ; {args.sentences} phrases par document")
+    print(f"{'documents':>9} {'cohorte':>9} {'dont paires':>11} {'envois':>9} {'paire/paire':>11}  paires plantées trouvées (part min.), autres paires (part max.)")
+    failures = []
+    try:
+        for n_documents in (int(n) for n in args.documents.split(',')):
+            cohort, planted = synthetic_cohort(store, vocabulary, n_documents, args.sentences, args.collusion, args.shared, args.seed + 1)
+            pdfs = [synthetic_pdf(sentences) for sentences in cohort]
+            names = [f"rendu_{d:03d}.pdf" for d in range(n_documents)]
+
+            with tempfile.TemporaryDirectory() as cache_dir:
+                models = {
+                    'bi_encoder': bi_encoder, 'cross_encoder': cross_encoder, 'faiss_index': index, 'df_corpus': store,
+                    'shingle_index': None, 'sentence_cache': None, 'embedding_cache': None,
+                    'result_cache': ResultCache(VERSION, cache_dir=cache_dir), 'corpus_version': VERSION,
+                }
+                report, cohort_time = timed(lambda: analyze_cohort_documents(pdfs, names, 0.5, models=models))
+
+            # Part de la comparaison des documents entre eux (extraction et encodage compris)
+            def compare_only(documents, document_names):
+                _, relevant = extract_cohort(documents)
+                embeddings = encode_cohort(bi_encoder, relevant)
+                return compare_cohort(relevant, document_names, bi_encoder, embeddings, cross_encoder, 0.5)
+            _, compare_time = timed(lambda: compare_only(pdfs, names))
+
+            _, uploads_time = timed(lambda: [
+                analyze_pdf_for_plagiarism(pdf, bi_encoder, cross_encoder, index, store, min_verdict_score=0.5) for pdf in pdfs
+            ])
+
+            pairwise = "—"
+            if n_documents <= args.max_pairwise:
+                _, pairwise_time = timed(lambda: [
+                    compare_only([pdfs[a], pdfs[b]], [names[a], names[b]]) for a, b in itertools.combinations(range(n_documents), 2)
+                ])
+                pairwise = f"{pairwise_time:.2f}s"
+
+            shares = {(pair["document_a"], pair["document_b"]): max(pair["part_a"], pair["part_b"]) for pair in report["paires"]}
+            expected = {(names[a], names[b]) for a, b in planted}
+            missed = expected - set(shares)
+            planted_share = min((shares[pair] for pair in expected & set(shares)), default=0.0)
+            others = [share for pair, share in shares.items() if pair not in expected]
+            if missed:
+                failures.append(f"{n_documents} documents : paires plantées non trouvées {sorted(missed)}")
+            print(f"{n_documents:>9} {cohort_time:>8.2f}s {compare_time:>10.2f}s {uploads_time:>8.2f}s {pairwise:>11}  "
+                  f"{len(expected) - len(missed)}/{len(expected)} ({planted_share:.0%}), {len(others)} ({max(others, default=0.0):.0%})")
+    finally:
+        shutdown_extraction_pool()
+
+    if failures:
+        raise SystemExit("\n".join(failures))
+    print("✅ Toutes les paires plantées sont signalées.")
+
+
+if __name__ == "__main__":
+    main()
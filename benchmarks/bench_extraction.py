@@ -0,0 +1,57 @@
+"""
+Compare l'extraction séquentielle d'origine (texte complet puis `nltk.sent_tokenize`)
+et l'extraction parallèle par tranches de pages : durée par étape et identité des phrases.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_extraction these.pdf --workers 1,2,4 --pages-per-shard 8,16
+"""
+import argparse
+import time
+
+import nltk
+
+from app.pdf_extraction import LANGUAGE, iter_pdf_sentences, open_pdf, shutdown_extraction_pool
+
+
+def sequential_sentences(pdf_path):
+    """Chemin d'origine ; retourne (phrases, durée d'extraction, durée de segmentation)."""
+    start = time.perf_counter()
+    doc = open_pdf(pdf_path)
+    full_text = "".join(page.get_text() for page in doc)
+    doc.close()
+    extracted = time.perf_counter()
+    sentences = nltk.sent_tokenize(full_text, language=LANGUAGE)
+    return sentences, extracted - start, time.perf_counter() - extracted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='+')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--pages-per-shard', default='8,16')
+    args = parser.parse_args()
+
+    print(f"{'document':<30} {'workers':>7} {'pages/tr.':>9} {'1re phrase':>11} {'total':>8} {'extraction':>11} {'segment.':>9} {'identique':>9}")
+    for pdf_path in args.pdfs:
+        reference, extraction_time, segmentation_time = sequential_sentences(pdf_path)
+        total = extraction_time + segmentation_time
+        print(f"{pdf_path[-30:]:<30} {'séq.':>7} {'-':>9} {total:>10.3f}s {total:>7.3f}s {extraction_time:>10.3f}s {segmentation_time:>8.3f}s {'-':>9}")
+
+        for workers in (int(v) for v in args.workers.split(',')):
+            for pages_per_shard in (int(v) for v in args.pages_per_shard.split(',')):
+                report = {}
+                start = time.perf_counter()
+                sentences, first = [], None
+                for sentence in iter_pdf_sentences(pdf_path, report=report, workers=workers, pages_per_shard=pages_per_shard):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    sentences.append(sentence)
+                total = time.perf_counter() - start
+                timings = report['durees']
+                print(f"{'':<30} {workers:>7} {pages_per_shard:>9} {first or 0:>10.3f}s {total:>7.3f}s "
+                      f"{timings['extraction']:>10.3f}s {timings['segmentation']:>8.3f}s {str(sentences == reference):>9}")
+    shutdown_extraction_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Mesure le rappel@k et la latence (p50/p99 par requête) des index approximatifs
+par rapport à l'index exact, pour plusieurs valeurs de nprobe / efSearch.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_index --types ivf-flat,ivf-sq8,ivf-pq,hnsw
+    python -m benchmarks.bench_index --index app/corpus/corpus_doc.hnsw.index --ef-search 16,64,256
+    python -m benchmarks.bench_index --types ivf-flat --pdf memoire.pdf
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from app.index_builder import base_index, build_index, configure_search, describe_index, index_ids, is_id_mapped, reconstruct_embeddings
+from build_index import load_exact_index
+
+
+def sample_queries(embeddings, n_queries, noise, seed=0):
+    """Passages du corpus légèrement bruités (normalisés), pour simuler des paraphrases."""
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), n_queries, replace=False)].copy()
+    queries += rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def pdf_queries(pdf_path, n_queries):
+    """Phrases réelles d'un PDF, encodées avec le Bi-Encoder de l'API."""
+    import fitz
+    import nltk
+    from app.analysis_logic import load_bi_encoder
+    from app.functions.is_citation import is_citation_or_reference
+
+    doc = fitz.open(pdf_path)
+    full_text = "".join(page.get_text() for page in doc)
+    doc.close()
+    sentences = [s for s in nltk.sent_tokenize(full_text, language='french') if not is_citation_or_reference(s)][:n_queries]
+    return load_bi_encoder().encode(sentences, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+
+
+def measure(index, queries, ground_truth, k):
+    """Rappel@k moyen et latences par requête (en ms)."""
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+
+    recall = np.mean([len(set(f) & set(g)) / k for f, g in zip(found, ground_truth)])
+    return recall, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--types', default='', help="Types d'index à construire à partir de l'index exact (ex. ivf-flat,hnsw)")
+    parser.add_argument('--index', action='append', default=[], help="Index déjà construit à évaluer (répétable)")
+    parser.add_argument('--nprobe', default='1,4,16,64', help="Valeurs de nprobe à tester (IVF)")
+    parser.add_argument('--ef-search', default='16,64,256', help="Valeurs de efSearch à tester (HNSW)")
+    parser.add_argument('--nlist', type=int)
+    parser.add_argument('--pq-m', type=int, default=48)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--noise', type=float, default=0.02, help="Bruit ajouté aux requêtes synthétiques")
+    parser.add_argument('--pdf', help="Utiliser les phrases d'un PDF comme requêtes")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=1, help="Threads OpenMP de FAISS (1 = latence d'une requête isolée)")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    exact_index = load_exact_index()
+    if exact_index is None:
+        raise SystemExit("Aucun index exact trouvé : il sert de référence pour le rappel.")
+    embeddings = reconstruct_embeddings(exact_index)
+
+    queries = pdf_queries(args.pdf, args.queries) if args.pdf else sample_queries(embeddings, min(args.queries, len(embeddings)), args.noise)
+    _, ground_truth = exact_index.search(queries, args.k)
+    # Les index construits ici reprennent les identifiants de l'index exact, pour comparer les mêmes résultats
+    ids = index_ids(exact_index) if is_id_mapped(exact_index) else None
+
+    candidates = [('exact', exact_index)]
+    for index_type in filter(None, args.types.split(',')):
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type, metric=exact_index.metric_type, nlist=args.nlist, pq_m=args.pq_m, ids=ids)
+        print(f"{index_type} construit en {time.perf_counter() - start:.1f} s")
+        candidates.append((index_type, index))
+    for path in args.index:
+        candidates.append((path, faiss.read_index(path)))
+
+    nprobes = [int(v) for v in args.nprobe.split(',')]
+    ef_searches = [int(v) for v in args.ef_search.split(',')]
+
+    print(f"\n{len(queries)} requêtes, k={args.k}, {args.threads} thread(s)")
+    print(f"{'index':<40} {'paramètre':<14} {'rappel@k':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for name, index in candidates:
+        inner = base_index(index)
+        if isinstance(inner, faiss.IndexIVF):
+            settings = [(f"nprobe={v}", dict(nprobe=v)) for v in nprobes]
+        elif isinstance(inner, faiss.IndexHNSW):
+            settings = [(f"efSearch={v}", dict(ef_search=v)) for v in ef_searches]
+        else:
+            settings = [("-", {})]
+
+        for label, params in settings:
+            configure_search(index, **params)
+            recall, p50, p99 = measure(index, queries, ground_truth, args.k)
+            print(f"{name:<40} {label:<14} {recall:>9.3f} {p50:>9.3f} {p99:>9.3f}")
+        print(f"  {describe_index(index)}")
+
+
+if __name__ == "__main__":
+    main()
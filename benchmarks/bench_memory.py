@@ -0,0 +1,149 @@
+"""
+Mémoire par worker de l'API (RSS, PSS, pages partagées / privées), avec et sans partage :
+
+- "isolated" : uvicorn --workers N, chaque worker charge ses propres modèles, index et corpus
+- "shared"   : gunicorn (gunicorn.conf.py), ressources préchargées par le parent et index projeté en mémoire
+
+Le PSS répartit chaque page partagée entre les processus qui la projettent : la somme des PSS
+est la mémoire réellement occupée par l'ensemble des processus.
+Lit /proc/<pid>/smaps_rollup (Linux uniquement).
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_memory --workers 4
+    python -m benchmarks.bench_memory --modes shared --workers 2,4 --pdf memoire.pdf
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+READY_MARKER = "Ressources chargées avec succès"
+
+
+def smaps_rollup(pid):
+    """Compteurs mémoire d'un processus, en Mo."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': values.get('Rss', 0.0),
+        'pss': values.get('Pss', 0.0),
+        'partagee': values.get('Shared_Clean', 0.0) + values.get('Shared_Dirty', 0.0),
+        'privee': values.get('Private_Clean', 0.0) + values.get('Private_Dirty', 0.0),
+    }
+
+
+def descendants(pid):
+    """Processus descendants de `pid` (workers, pools d'analyse ou d'extraction)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def server_command(mode, workers, port):
+    if mode == 'isolated':
+        env = {'APLAG_PRELOAD': '0', 'APLAG_FAISS_MMAP': '0'}
+        command = [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port), '--workers', str(workers)]
+    else:
+        env = {'APLAG_PRELOAD': '1', 'APLAG_FAISS_MMAP': '1', 'WEB_CONCURRENCY': str(workers), 'PORT': str(port)}
+        command = [sys.executable, '-m', 'gunicorn', 'app.main:app', '-c', 'gunicorn.conf.py']
+    # Sortie non tamponnée : le message de fin de chargement de chaque worker arrive immédiatement
+    return command, {**os.environ, 'PYTHONUNBUFFERED': '1', **env}
+
+
+def start_server(mode, workers, port, timeout):
+    """Démarre l'API et attend que chaque worker ait chargé ses ressources ; retourne (processus, durée)."""
+    command, env = server_command(mode, workers, port)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    ready = threading.Semaphore(0)
+
+    def read_output():
+        for line in process.stdout:
+            if READY_MARKER in line:
+                ready.release()
+
+    threading.Thread(target=read_output, daemon=True).start()
+    for _ in range(workers):
+        if not ready.acquire(timeout=max(1, timeout - (time.perf_counter() - start))):
+            stop_server(process)
+            raise SystemExit(f"{mode} : les {workers} workers n'ont pas démarré en {timeout} s.")
+    return process, time.perf_counter() - start
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def warm_up(port, pdf_path, requests):
+    """Quelques analyses réelles, pour que les pages de l'index et des modèles soient effectivement lues."""
+    with open(pdf_path, 'rb') as f:
+        data = f.read()
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+        for _ in range(requests):
+            client.post("/analyze/stream", files={"file": (os.path.basename(pdf_path), data, "application/pdf")}).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='isolated,shared')
+    parser.add_argument('--workers', default='2', help="Nombres de workers à tester (ex. 2,4)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pdf', help="PDF analysé avant la mesure (sinon, mesure juste après le démarrage)")
+    parser.add_argument('--requests', type=int, default=4, help="Analyses du PDF avant la mesure")
+    parser.add_argument('--timeout', type=float, default=900, help="Délai maximal de démarrage (s)")
+    args = parser.parse_args()
+
+    print(f"{'mode':<9} {'workers':>7} {'démarrage':>10} {'processus':<28} {'RSS (Mo)':>9} {'PSS (Mo)':>9} {'partagée':>9} {'privée':>8}")
+    for mode in args.modes.split(','):
+        for n_workers in (int(v) for v in args.workers.split(',')):
+            process, startup = start_server(mode, n_workers, args.port, args.timeout)
+            try:
+                if args.pdf:
+                    warm_up(args.port, args.pdf, args.requests)
+                pids = [process.pid] + descendants(process.pid)
+                total_pss = total_rss = 0.0
+                for pid in pids:
+                    try:
+                        memory = smaps_rollup(pid)
+                        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                            name = f.read().replace(b'\0', b' ').decode(errors='replace').strip()
+                    except OSError:
+                        continue
+                    role = 'parent' if pid == process.pid else 'worker'
+                    total_pss += memory['pss']
+                    total_rss += memory['rss']
+                    print(f"{mode:<9} {n_workers:>7} {startup:>9.1f}s {f'{role} {pid}':<28} {memory['rss']:>9.0f} "
+                          f"{memory['pss']:>9.0f} {memory['partagee']:>9.0f} {memory['privee']:>8.0f}  {name[:40]}")
+                print(f"{mode:<9} {n_workers:>7} {'':>10} {'total':<28} {total_rss:>9.0f} {total_pss:>9.0f}\n")
+            finally:
+                stop_server(process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Débit du Bi-Encoder et du Cross-Encoder sous charge concurrente, avec et sans micro-batching.
+Chaque "client" est un thread qui envoie des petites demandes (comme une requête d'analyse).
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_microbatch --clients 1,4,8 --requests 20
+"""
+import argparse
+import random
+import threading
+import time
+
+from app.analysis_logic import load_bi_encoder, load_corpus_dataframe, load_cross_encoder
+from app.batching import BatchedBiEncoder, BatchedCrossEncoder
+
+
+def run_clients(n_clients, n_requests, work):
+    """Lance `n_clients` threads exécutant chacun `n_requests` fois `work(client, i)` ; retourne la durée totale."""
+    barrier = threading.Barrier(n_clients + 1)
+
+    def client(c):
+        barrier.wait()
+        for i in range(n_requests):
+            work(c, i)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', default='1,4,8')
+    parser.add_argument('--requests', type=int, default=20, help="Demandes par client")
+    parser.add_argument('--sentences', type=int, default=16, help="Phrases (ou paires) par demande")
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--max-batch-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    bi_encoder, cross_encoder = load_bi_encoder(), load_cross_encoder()
+    corpus = load_corpus_dataframe()
+    rng = random.Random(0)
+    texts = corpus.get_texts([rng.randrange(len(corpus)) for _ in range(2000)])
+
+    def sentences(c, i):
+        start = (c * 97 + i * args.sentences) % (len(texts) - args.sentences)
+        return texts[start:start + args.sentences]
+
+    batched_bi = BatchedBiEncoder(bi_encoder, args.max_batch_size, args.max_wait_ms)
+    batched_cross = BatchedCrossEncoder(cross_encoder, args.max_batch_size, args.max_wait_ms)
+    encode_kwargs = dict(convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+
+    print(f"{'modèle':<14} {'clients':>7} {'direct (/s)':>12} {'micro-batch (/s)':>17} {'gain':>6}")
+    for n_clients in (int(v) for v in args.clients.split(',')):
+        total_items = n_clients * args.requests * args.sentences
+        for name, direct, batched in (
+            ('bi-encoder',
+             lambda c, i: bi_encoder.encode(sentences(c, i), **encode_kwargs),
+             lambda c, i: batched_bi.encode(sentences(c, i), **encode_kwargs)),
+            ('cross-encoder',
+             lambda c, i: cross_encoder.predict([[s, s[::-1]] for s in sentences(c, i)], show_progress_bar=False),
+             lambda c, i: batched_cross.predict([[s, s[::-1]] for s in sentences(c, i)], show_progress_bar=False)),
+        ):
+            direct_rate = total_items / run_clients(n_clients, args.requests, direct)
+            batched_rate = total_items / run_clients(n_clients, args.requests, batched)
+            print(f"{name:<14} {n_clients:>7} {direct_rate:>12.1f} {batched_rate:>17.1f} {batched_rate / direct_rate:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Mesure la chaîne d'analyse complète (analyze_pdf_for_plagiarism puis rendu du rapport PDF) sur des corpus
+synthétiques de plusieurs tailles, avec des modèles factices déterministes (benchmarks/synthetic.py) :
+aucun modèle ni corpus réel n'est nécessaire.
+
+Pour chaque taille, le corpus (CorpusStore), son index FAISS et, avec --fast-path, son index de shingles
+sont construits une fois dans benchmarks/data/ puis réutilisés. Chaque mesure tourne dans un processus neuf :
+durée médiane de chaque étape (extraction, segmentation, filtrage, voie rapide, encodage, recherche,
+re-ranking, scoring, rendu), débit en phrases par seconde et pic de mémoire du processus.
+Les résultats sont écrits en JSON ; --compare affiche l'écart avec une exécution précédente.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_pipeline --sizes 10k,100k,1M --sentences 400
+    python -m benchmarks.bench_pipeline --sizes 100k --index-type hnsw --fast-path --compare benchmarks/results/avant.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.synthetic import (
+    StubBiEncoder, StubCrossEncoder, Vocabulary, document_sentences, parse_size, synthetic_pdf, write_corpus
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+STAGES = ("extraction", "segmentation", "filtrage", "voie_rapide", "encodage", "recherche", "re-ranking", "scoring", "rendu")
+DONE_FILE = 'complet.json'
+
+
+def dataset_dir(args, n_paragraphs):
+    return os.path.join(args.data_dir, f"corpus-{n_paragraphs}-d{args.dim}-{args.index_type}-s{args.seed}")
+
+
+def build_dataset(directory, n_paragraphs, dim, index_type, seed, fast_path, chunk_size=100_000):
+    """Écrit le corpus synthétique et son index FAISS (et l'index de shingles) ; exécuté dans un processus fils."""
+    import faiss
+
+    from app.corpus_store import CorpusStore
+    from app.index_builder import build_index
+    from app.shingle_index import ShingleIndex, shingle_index_exists
+
+    done_path = os.path.join(directory, DONE_FILE)
+    start = time.perf_counter()
+    if not os.path.exists(done_path):
+        encoder = StubBiEncoder(dim=dim, seed=seed)
+        index = None
+
+        def add_chunk(texts, first_position):
+            nonlocal index
+            embeddings = encoder.encode(texts, normalize_embeddings=True)
+            if index is None:
+                # Les index IVF sont entraînés sur la première tranche
+                index = build_index(embeddings, index_type=index_type, seed=seed)
+            else:
+                index.add(embeddings)
+
+        write_corpus(os.path.join(directory, 'store'), n_paragraphs, Vocabulary(seed=seed), seed=seed,
+                     chunk_size=chunk_size, on_chunk=add_chunk)
+        faiss.write_index(index, os.path.join(directory, 'index.faiss'))
+        with open(done_path, 'w', encoding='utf-8') as f:
+            json.dump({'passages': n_paragraphs, 'dimension': dim, 'type_index': index_type}, f)
+
+    shingles_dir = os.path.join(directory, 'shingles')
+    if fast_path and not shingle_index_exists(shingles_dir):
+        store = CorpusStore.load(os.path.join(directory, 'store'))
+        parts = [ShingleIndex.build(store.get_texts(range(s, min(s + chunk_size, len(store)))), first_position=s)
+                 for s in range(0, len(store), chunk_size)]
+        keys = np.concatenate([p.keys for p in parts])
+        positions = np.concatenate([p.positions for p in parts])
+        order = np.argsort(keys, kind='stable')
+        ShingleIndex(keys[order], positions[order], parts[0].size).save(shingles_dir)
+    return time.perf_counter() - start
+
+
+def _rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(directory, pdf_path, dim, repeat, top_k, fast_path, encode_delay, rerank_delay):
+    """Charge le corpus et analyse le PDF `repeat` fois ; exécuté dans un processus neuf."""
+    from app.analysis_logic import analyze_pdf_for_plagiarism, load_corpus_dataframe, load_faiss_index
+    from app.pdf_extraction import shutdown_extraction_pool
+    from app.report_generator import render_pdf_report
+    from app.shingle_index import ShingleIndex
+
+    rss_start = _rss_mb()
+    t0 = time.perf_counter()
+    df_corpus = load_corpus_dataframe(os.path.join(directory, 'store'))
+    index = load_faiss_index(os.path.join(directory, 'index.faiss'))
+    shingle_index = ShingleIndex.load(os.path.join(directory, 'shingles')) if fast_path else None
+    load_time = time.perf_counter() - t0
+    rss_loaded = _rss_mb()
+
+    resources = {
+        'bi_encoder': StubBiEncoder(dim=dim, delay=encode_delay),
+        'cross_encoder': StubCrossEncoder(delay=rerank_delay),
+        'index': index,
+        'df_corpus': df_corpus,
+    }
+    runs = []
+    try:
+        for _ in range(repeat):
+            timings, stats = {}, {}
+            t0 = time.perf_counter()
+            report = analyze_pdf_for_plagiarism(pdf_path, **resources, top_k_retrieve=top_k, min_verdict_score=0.5,
+                                                stats=stats, timings=timings, shingle_index=shingle_index)
+            t1 = time.perf_counter()
+            render_pdf_report(report, os.path.basename(pdf_path))
+            timings['rendu'] = time.perf_counter() - t1
+            runs.append({
+                'total': time.perf_counter() - t0,
+                'etapes': timings,
+                'phrases': report.get('summary', {}).get('phrases_analysees', 0),
+                'constats': len(report.get('findings', [])),
+                'voie_rapide': stats.get('phrases_voie_rapide', 0),
+            })
+    finally:
+        shutdown_extraction_pool()
+
+    total = statistics.median(r['total'] for r in runs)
+    return {
+        'chargement_s': round(load_time, 4),
+        'total_s': round(total, 4),
+        'etapes_s': {stage: round(statistics.median(r['etapes'].get(stage, 0.0) for r in runs), 4) for stage in STAGES},
+        'phrases_analysees': runs[-1]['phrases'],
+        'constats': runs[-1]['constats'],
+        'phrases_voie_rapide': runs[-1]['voie_rapide'],
+        'phrases_par_s': round(runs[-1]['phrases'] / total, 1) if total else 0.0,
+        'memoire_mo': {
+            'rss_depart': round(rss_start, 1),
+            'rss_apres_chargement': round(rss_loaded, 1),
+            'rss_fin': round(_rss_mb(), 1),
+            # ru_maxrss est en Ko sous Linux
+            'pic': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+
+
+def in_child(function, *args):
+    """Exécute `function` dans un processus neuf (mémoire de pointe et caches propres à la mesure)."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(function, *args).result()
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'plateforme': platform.platform(),
+        'processeurs': os.cpu_count(),
+    }
+
+
+def print_comparison(previous, current):
+    """Écart relatif de chaque étape avec une exécution précédente, pour les tailles communes."""
+    before = {r['passages']: r for r in previous.get('resultats', [])}
+    for result in current['resultats']:
+        reference = before.get(result['passages'])
+        if reference is None:
+            continue
+        print(f"\nComparaison ({result['passages']} passages) avec {previous.get('commit')} du {previous.get('date')} :")
+        rows = [(stage, reference['etapes_s'].get(stage, 0.0), result['etapes_s'][stage]) for stage in STAGES]
+        rows += [('total', reference['total_s'], result['total_s']),
+                 ('pic mémoire (Mo)', reference['memoire_mo']['pic'], result['memoire_mo']['pic'])]
+        for name, old, new in rows:
+            change = f"{(new - old) / old:+.1%}" if old else "-"
+            print(f"  {name:<18} {old:>9.3f} -> {new:>9.3f}  {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10k,100k', help="Tailles de corpus en passages (suffixes k et M acceptés)")
+    parser.add_argument('--dim', type=int, default=384, help="Dimension des embeddings factices")
+    parser.add_argument('--index-type', default='flat', help="Type d'index FAISS (voir index_builder.INDEX_TYPES)")
+    parser.add_argument('--sentences', type=int, default=400, help="Phrases du PDF analysé")
+    parser.add_argument('--copy-ratio', type=float, default=0.3, help="Part de phrases copiées du corpus")
+    parser.add_argument('--paraphrase-ratio', type=float, default=0.2, help="Part de phrases du corpus paraphrasées")
+    parser.add_argument('--short-ratio', type=float, default=0.05, help="Part de phrases trop courtes (filtrées)")
+    parser.add_argument('--repeat', type=int, default=3, help="Analyses par taille (médiane)")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--fast-path', action='store_true', help="Active la voie rapide (index de shingles)")
+    parser.add_argument('--encode-delay', type=float, default=0.0, help="Durée simulée d'encodage par phrase (s)")
+    parser.add_argument('--rerank-delay', type=float, default=0.0, help="Durée simulée de re-ranking par paire (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR, help="Répertoire des corpus synthétiques construits")
+    parser.add_argument('--output', help="Fichier JSON des résultats (par défaut benchmarks/results/pipeline-<date>.json)")
+    parser.add_argument('--compare', help="Résultats JSON d'une exécution précédente")
+    args = parser.parse_args()
+
+    from app.corpus_store import CorpusStore
+    from app.index_builder import INDEX_TYPES
+
+    if args.index_type not in INDEX_TYPES:
+        parser.error(f"Type d'index inconnu : {args.index_type} (attendu : {', '.join(INDEX_TYPES)})")
+
+    output = {**environment(), 'parametres': vars(args), 'resultats': []}
+    for n_paragraphs in (parse_size(s) for s in args.sizes.split(',')):
+        directory = dataset_dir(args, n_paragraphs)
+        build_time = in_child(build_dataset, directory, n_paragraphs, args.dim, args.index_type, args.seed, args.fast_path)
+        print(f"Corpus de {n_paragraphs} passages prêt ({build_time:.1f} s) : {directory}")
+
+        store = CorpusStore.load(os.path.join(directory, 'store'))
+        sentences = document_sentences(store, Vocabulary(seed=args.seed), args.sentences, copy_ratio=args.copy_ratio,
+                                       paraphrase_ratio=args.paraphrase_ratio, short_ratio=args.short_ratio, seed=args.seed)
+        pdf_path = os.path.join(directory, f"document-{args.sentences}.pdf")
+        with open(pdf_path, 'wb') as f:
+            f.write(synthetic_pdf(sentences))
+        del store
+
+        result = in_child(measure, directory, pdf_path, args.dim, args.repeat, args.top_k, args.fast_path,
+                          args.encode_delay, args.rerank_delay)
+        output['resultats'].append({'passages': n_paragraphs, **result})
+
+        print(f"  {result['phrases_analysees']} phrases, {result['constats']} constats, "
+              f"{result['total_s']:.3f} s ({result['phrases_par_s']} phrases/s), pic mémoire {result['memoire_mo']['pic']} Mo")
+        for stage in STAGES:
+            print(f"    {stage:<13} {result['etapes_s'][stage]:8.3f} s")
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\nRésultats écrits dans {output_path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Durée de rendu des rapports en fonction du nombre de constats : HTML (gabarit précompilé),
+PDF complet (tous les constats détaillés) et PDF limité (APLAG_PDF_MAX_FINDINGS constats détaillés,
+les autres regroupés par source), avec la taille des fichiers produits.
+
+Les constats sont synthétiques (benchmarks/synthetic.py) : phrase, paraphrase de la source et diff HTML
+calculé par get_highlighted_diff_html, comme dans l'analyse.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_report --counts 10,100,500,1000
+    python -m benchmarks.bench_report --counts 500 --max-findings 50
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from app.functions.get_verdict import get_highlighted_diff_html
+from app.report_generator import PDF_MAX_FINDINGS, create_html_report, render_pdf_report
+from benchmarks.synthetic import Vocabulary, _paraphrase
+
+
+def synthetic_report(n_findings, n_sources=40, seed=0):
+    """Résultats d'analyse de `n_findings` constats, par score composite décroissant."""
+    rng = np.random.default_rng(seed)
+    vocabulary = Vocabulary(seed=seed)
+    scores = np.sort(rng.uniform(0.5, 1.0, n_findings))[::-1]
+    findings = []
+    for score in scores:
+        phrase = vocabulary.sentence(rng)
+        source = _paraphrase(phrase, vocabulary, rng, replaced=1.0 - score)
+        html_diff = get_highlighted_diff_html(phrase, source)
+        findings.append({
+            "phrase_suspecte": phrase,
+            "score_composite": round(float(score), 3),
+            "verdict": "Copié-collé" if score >= 0.9 else "Paraphrase",
+            "source_trouvee": source,
+            "document_source": f"synthetique_{rng.integers(n_sources):06d}.pdf",
+            "html_diff_suspecte": html_diff[0],
+            "html_diff_source": html_diff[1],
+        })
+    summary = {"phrases_analysees": n_findings * 4, "phrases_suspectes": n_findings, "ratio_suspicion": "25.0%"}
+    return {"summary": summary, "findings": findings, "version_corpus": "synthetique"}
+
+
+def timed(function, repeat):
+    """(durée médiane, dernier résultat)."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='10,50,100,250,500', help="Nombres de constats")
+    parser.add_argument('--max-findings', type=int, default=PDF_MAX_FINDINGS, help="Constats détaillés du PDF limité")
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'constats':>8} {'html':>8} {'pdf complet':>12} {'pdf limité':>11} {'Ko complet':>11} {'Ko limité':>10}")
+    for count in (int(c) for c in args.counts.split(',')):
+        report = synthetic_report(count)
+        html_time, _ = timed(lambda: create_html_report(report, "document.pdf"), args.repeat)
+        full_time, full_pdf = timed(lambda: render_pdf_report(report, "document.pdf", max_findings=0), args.repeat)
+        capped_time, capped_pdf = timed(lambda: render_pdf_report(report, "document.pdf", max_findings=args.max_findings), args.repeat)
+        print(f"{count:>8} {html_time:>7.3f}s {full_time:>11.3f}s {capped_time:>10.3f}s "
+              f"{len(full_pdf) / 1024:>11.0f} {len(capped_pdf) / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
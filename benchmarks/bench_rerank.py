@@ -0,0 +1,87 @@
+"""
+Compare le re-ranking phrase par phrase (ancienne boucle) au re-ranking par lots
+de `rerank_hits` sur un long document.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_rerank --pdf chemin/vers/memoire.pdf
+    python -m benchmarks.bench_rerank --sentences 3000
+"""
+import argparse
+import random
+import time
+
+import nltk
+import numpy as np
+
+from app.analysis_logic import (
+    load_bi_encoder, load_corpus_dataframe, load_cross_encoder,
+    load_faiss_index, rerank_hits
+)
+from app.functions.is_citation import is_citation_or_reference
+
+
+def load_sentences(pdf_path, n_sentences, df_corpus):
+    """Phrases du PDF fourni, ou à défaut des phrases tirées du corpus."""
+    if pdf_path:
+        import fitz
+        doc = fitz.open(pdf_path)
+        full_text = "".join(page.get_text() for page in doc)
+        doc.close()
+        sentences = nltk.sent_tokenize(full_text, language='french')
+        return [s for s in sentences if not is_citation_or_reference(s)][:n_sentences]
+
+    rng = random.Random(0)
+    ids = [rng.randrange(len(df_corpus)) for _ in range(n_sentences)]
+    return df_corpus.get_texts(ids)
+
+
+def rerank_loop(query_sentences, indices, df_corpus, cross_encoder):
+    """Reproduction de l'ancienne boucle : un appel au Cross-Encoder par phrase."""
+    best_hits = []
+    for i, query_sentence in enumerate(query_sentences):
+        retrieved_hits = [{'corpus_id': idx, 'sentence': text} for idx, text in zip(indices[i], df_corpus.get_texts(indices[i]))]
+        cross_scores = cross_encoder.predict([[query_sentence, hit['sentence']] for hit in retrieved_hits], show_progress_bar=False)
+        best_hit_idx = np.argmax(cross_scores)
+        best_hit = retrieved_hits[best_hit_idx]
+        best_hit['cross_score'] = cross_scores[best_hit_idx]
+        best_hits.append(best_hit)
+    return best_hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf', help="PDF à analyser (sinon phrases tirées du corpus)")
+    parser.add_argument('--sentences', type=int, default=2000, help="Nombre maximal de phrases")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--batch-sizes', default='32,128,256,512')
+    args = parser.parse_args()
+
+    bi_encoder = load_bi_encoder()
+    cross_encoder = load_cross_encoder()
+    index = load_faiss_index()
+    df_corpus = load_corpus_dataframe()
+
+    sentences = load_sentences(args.pdf, args.sentences, df_corpus)
+    embeddings = bi_encoder.encode(sentences, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+    _, indices = index.search(embeddings, args.top_k)
+    indices = df_corpus.positions_of(indices)
+    print(f"{len(sentences)} phrases x {args.top_k} hits = {len(sentences) * args.top_k} paires")
+
+    start = time.perf_counter()
+    reference = rerank_loop(sentences, indices, df_corpus, cross_encoder)
+    loop_time = time.perf_counter() - start
+    print(f"Boucle par phrase       : {loop_time:8.2f} s")
+
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        start = time.perf_counter()
+        batched = rerank_hits(sentences, indices, df_corpus, cross_encoder, batch_size=batch_size)
+        batch_time = time.perf_counter() - start
+
+        same_hits = all(a['corpus_id'] == b['corpus_id'] for a, b in zip(reference, batched))
+        max_diff = max(abs(float(a['cross_score']) - float(b['cross_score'])) for a, b in zip(reference, batched))
+        print(f"Lots de {batch_size:<4}           : {batch_time:8.2f} s "
+              f"(x{loop_time / batch_time:.1f}, hits identiques : {same_hits}, écart max : {max_diff:.2e})")
+
+
+if __name__ == "__main__":
+    main()
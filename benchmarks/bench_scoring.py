@@ -0,0 +1,71 @@
+"""
+Compare le calcul par paire (calculate_lexical_metrics, calculate_ngram_jaccard, get_final_verdict)
+au calcul groupé de functions/lexical_batch.py : durée et identité des scores et verdicts.
+
+Les paires sont formées de passages du corpus : chaque "requête" est comparée à `k` passages,
+comme les top-k hits d'une phrase.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_scoring --queries 2000 -k 10
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app.analysis_logic import load_corpus_dataframe
+from app.functions.get_verdict import get_final_verdict
+from app.functions.lexical_batch import score_pairs
+from app.functions.lexical_metrics import calculate_lexical_metrics
+from app.functions.ngram_jaccard import calculate_ngram_jaccard
+
+
+def score_loop(queries, candidates, cross_scores):
+    """Calcul d'origine, une paire à la fois."""
+    results = []
+    for query, candidate, cross_score in zip(queries, candidates, cross_scores):
+        lexical_metrics = calculate_lexical_metrics(query, candidate)
+        ngram_score = calculate_ngram_jaccard(query, candidate, n=3)
+        verdict, composite_score = get_final_verdict(cross_score, lexical_metrics, ngram_score)
+        results.append((lexical_metrics['levenshtein'], lexical_metrics['jaccard'], ngram_score, composite_score, verdict))
+    return results
+
+
+def check_identical(reference, batched):
+    """Nombre de paires dont une métrique, le score composite ou le verdict diffère."""
+    columns = [batched['levenshtein'], batched['jaccard'], batched['ngram'], batched['composite'], batched['verdicts']]
+    return sum(1 for p, ref in enumerate(reference) if any(ref[c] != columns[c][p] for c in range(5)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=10, help="Hits par requête")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = load_corpus_dataframe()
+    rng = random.Random(args.seed)
+    texts = corpus.get_texts([rng.randrange(len(corpus)) for _ in range(args.queries * (args.k + 1))])
+    queries = [texts[q] for q in range(args.queries) for _ in range(args.k)]
+    candidates = texts[args.queries:args.queries + len(queries)]
+    # Scores du Cross-Encoder en float32, comme en sortie du modèle
+    cross_scores = np.random.default_rng(args.seed).random(len(queries), dtype=np.float32)
+
+    start = time.perf_counter()
+    reference = score_loop(queries, candidates, cross_scores)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = score_pairs(queries, candidates, cross_scores, n=3)
+    batch_time = time.perf_counter() - start
+
+    print(f"{len(queries)} paires ({args.queries} requêtes x {args.k} hits)")
+    print(f"Par paire : {loop_time:8.3f} s")
+    print(f"Groupé    : {batch_time:8.3f} s ({loop_time / batch_time:.1f}x)")
+    print(f"Paires différentes : {check_identical(reference, batched)}")
+
+
+if __name__ == "__main__":
+    main()
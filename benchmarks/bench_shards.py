@@ -0,0 +1,168 @@
+"""
+Recherche répartie (app/sharding.py) sur un corpus synthétique : vérifie que les résultats sont identiques
+à ceux d'un index exact unique, puis mesure la latence en fonction du nombre de shards et du mode de service.
+
+Vérifications, pour chaque nombre de shards et chaque mode (arrêt en erreur à la première différence) :
+  - top-k des recherches FAISS : mêmes passages et mêmes scores, dans le même ordre à égalité de score près (check_equivalence) ;
+  - analyse complète d'un PDF synthétique (voie rapide, recherche, re-ranking, scoring) avec les modèles
+    factices de benchmarks/synthetic.py : mêmes constats et même résumé qu'avec l'index unique.
+Mesures (médianes) : recherche d'un paquet de requêtes, lecture des textes de leurs top-k (re-ranking)
+et analyse complète du PDF.
+
+Utilisation (depuis la racine du projet) :
+    python -m benchmarks.bench_shards --passages 100k --shards 1,2,4,8 --modes thread,process
+    python -m benchmarks.bench_shards --passages 20k --shards 2,4 --modes http
+Le mode http lance un serveur de shard (python -m app.shard_server) par shard sur 127.0.0.1.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+from benchmarks.synthetic import (
+    StubBiEncoder, StubCrossEncoder, Vocabulary, document_sentences, parse_size, synthetic_pdf, write_corpus
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+VERSION = 'synthetique'
+
+
+def build_corpus(directory, n_paragraphs, dim, seed):
+    """Corpus synthétique et embeddings de ses passages (réutilisés d'une exécution à l'autre)."""
+    from app.corpus_store import CorpusStore
+
+    embeddings_path = os.path.join(directory, 'embeddings.npy')
+    if not os.path.exists(embeddings_path):
+        encoder = StubBiEncoder(dim=dim, seed=seed)
+        parts = []
+        write_corpus(os.path.join(directory, 'store'), n_paragraphs, Vocabulary(seed=seed), seed=seed,
+                     on_chunk=lambda texts, _: parts.append(encoder.encode(texts, normalize_embeddings=True)))
+        np.save(embeddings_path, np.concatenate(parts))
+    return CorpusStore.load(os.path.join(directory, 'store')), np.load(embeddings_path)
+
+
+def start_servers(shards_dir, n_shards, base_port):
+    """Un serveur de shard par shard ; retourne (processus, adresses) une fois les serveurs prêts."""
+    processes, urls = [], []
+    for number in range(n_shards):
+        port = base_port + number
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'app.shard_server', '--shard', str(number), '--version', VERSION,
+             '--shards-dir', shards_dir, '--port', str(port)],
+            stdout=subprocess.DEVNULL
+        ))
+        urls.append(f"http://127.0.0.1:{port}")
+    deadline = time.monotonic() + 120
+    for url, process in zip(urls, processes):
+        while True:
+            try:
+                urllib.request.urlopen(f"{url}/info", timeout=1).read()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    stop_servers(processes)
+                    raise RuntimeError(f"Le serveur de shard {url} n'a pas démarré.")
+                time.sleep(0.2)
+    return processes, urls
+
+
+def stop_servers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def median_time(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def analysis(pdf, bi_encoder, cross_encoder, index, df_corpus, shingle_index):
+    from app.analysis_logic import analyze_pdf_for_plagiarism
+
+    return analyze_pdf_for_plagiarism(pdf, bi_encoder, cross_encoder, index, df_corpus, min_verdict_score=0.5,
+                                      shingle_index=shingle_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--passages', default='100k', help="Taille du corpus synthétique (ex. 20k, 1M)")
+    parser.add_argument('--shards', default='1,2,4,8', help="Nombres de shards")
+    parser.add_argument('--modes', default='thread,process', help="Modes de service : thread, process, http")
+    parser.add_argument('--queries', type=int, default=256, help="Requêtes par recherche (un paquet de phrases)")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--sentences', type=int, default=300, help="Phrases du PDF analysé")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base-port', type=int, default=8101, help="Premier port des serveurs de shards (mode http)")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    from app.index_builder import build_index
+    from app.shingle_index import ShingleIndex
+    from app.sharding import check_equivalence, load_sharded_corpus, read_shards_manifest, shards_directory, write_shards
+
+    n_paragraphs = parse_size(args.passages)
+    directory = os.path.join(args.data_dir, f"shards-{n_paragraphs}-d{args.dim}-s{args.seed}")
+    store, embeddings = build_corpus(directory, n_paragraphs, args.dim, args.seed)
+    reference = build_index(embeddings, 'flat')
+    reference_shingles = ShingleIndex.build(store.all_texts())
+
+    bi_encoder, cross_encoder = StubBiEncoder(dim=args.dim, seed=args.seed), StubCrossEncoder()
+    vocabulary = Vocabulary(seed=args.seed)
+    pdf = synthetic_pdf(document_sentences(store, vocabulary, args.sentences, seed=args.seed + 1))
+    queries = bi_encoder.encode(document_sentences(store, vocabulary, args.queries, seed=args.seed + 2), normalize_embeddings=True)
+    expected = json.dumps(analysis(pdf, bi_encoder, cross_encoder, reference, store, reference_shingles), sort_keys=True)
+
+    def measures(index, df_corpus, shingle_index):
+        _, positions = index.search(queries, args.top_k)
+        positions = df_corpus.positions_of(positions)
+        return (
+            median_time(lambda: index.search(queries, args.top_k), args.repeat),
+            median_time(lambda: df_corpus.get_texts(positions[positions >= 0]), args.repeat),
+            median_time(lambda: analysis(pdf, bi_encoder, cross_encoder, index, df_corpus, shingle_index), args.repeat),
+        )
+
+    print(f"Corpus : {n_paragraphs} passages, {len(store.sources)} documents ; {args.queries} requêtes, top-{args.top_k}")
+    print(f"{'mode':>8} {'shards':>6} {'recherche':>10} {'textes':>9} {'analyse':>9}  répartition")
+    search_time, texts_time, analysis_time = measures(reference, store, reference_shingles)
+    print(f"{'unique':>8} {1:>6} {search_time * 1000:>8.1f}ms {texts_time * 1000:>7.1f}ms {analysis_time:>8.3f}s")
+
+    for n_shards in (int(n) for n in args.shards.split(',')):
+        shards_dir = os.path.join(directory, f"shards-{n_shards}")
+        if read_shards_manifest(shards_directory(VERSION, shards_dir)) is None:
+            write_shards(shards_directory(VERSION, shards_dir), VERSION, store, embeddings, n_shards)
+        manifest = read_shards_manifest(shards_directory(VERSION, shards_dir))
+
+        for mode in args.modes.split(','):
+            servers, urls = start_servers(shards_dir, n_shards, args.base_port) if mode == 'http' else ([], [])
+            sharded = load_sharded_corpus(VERSION, mode=mode, urls=urls, shards_dir=shards_dir)
+            try:
+                problems = check_equivalence(reference, store, sharded, queries, args.top_k)
+                if json.dumps(analysis(pdf, bi_encoder, cross_encoder, sharded, sharded, sharded), sort_keys=True) != expected:
+                    problems.append("L'analyse du PDF diffère de celle de l'index unique.")
+                if problems:
+                    raise SystemExit(f"{mode}, {n_shards} shards : " + " ".join(problems))
+                search_time, texts_time, analysis_time = measures(sharded, sharded, sharded)
+            finally:
+                sharded.close()
+                stop_servers(servers)
+            print(f"{mode:>8} {n_shards:>6} {search_time * 1000:>8.1f}ms {texts_time * 1000:>7.1f}ms {analysis_time:>8.3f}s  {manifest['repartition']}")
+    print("✅ Recherches et analyses identiques à celles de l'index unique.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Données et modèles synthétiques pour mesurer la chaîne d'analyse sans les vrais modèles ni le vrai corpus :
+
+- corpus « à la française » de la taille voulue (mots outils fréquents et mots pleins formés de syllabes,
+  fréquences de Zipf, passages de 300 à 400 caractères comme ceux de update_corpus.py) ;
+- PDF de longueur réglable mêlant copies mot pour mot, paraphrases, phrases nouvelles et phrases courtes filtrées ;
+- `StubBiEncoder` et `StubCrossEncoder` : mêmes méthodes que SentenceTransformer et CrossEncoder,
+  déterministes et rapides (sac de mots haché, recouvrement de mots).
+
+Tout est déterminé par la graine : deux exécutions produisent les mêmes données.
+"""
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+from app.corpus_store import OFFSETS_FILE, SOURCE_CODES_FILE, SOURCES_FILE, TEXTS_FILE
+
+FUNCTION_WORDS = (
+    "de la le les des et en un une du dans pour que qui sur par au avec est sont ce cette ces il elle "
+    "nous on plus pas ne se son sa ses leur leurs aux comme mais ou dont entre sans sous être avoir"
+).split()
+ONSETS = ("b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "ch", "pr", "tr", "gr", "cl", "pl", "br")
+NUCLEI = ("a", "e", "i", "o", "u", "é", "ou", "ai", "an", "on", "in", "eu")
+SUFFIXES = ("", "", "", "tion", "ment", "ique", "eur", "age", "ité", "ance", "isme", "able", "er", "ée")
+PARAGRAPH_MIN_CHARS, PARAGRAPH_MAX_CHARS = 300, 400
+PARAGRAPHS_PER_DOCUMENT = 50
+
+
+def parse_size(text):
+    """'10k' -> 10000, '5M' -> 5000000."""
+    text = text.strip().lower()
+    factor = {'k': 1_000, 'm': 1_000_000}.get(text[-1], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+class Vocabulary:
+    """Mots outils puis mots pleins générés, tirés selon une loi de Zipf."""
+
+    def __init__(self, size=20_000, seed=0, zipf=1.1):
+        rng = np.random.default_rng(seed)
+        words, seen = list(FUNCTION_WORDS), set(FUNCTION_WORDS)
+        while len(words) < size:
+            n_syllables = rng.integers(1, 4)
+            word = "".join(ONSETS[rng.integers(len(ONSETS))] + NUCLEI[rng.integers(len(NUCLEI))] for _ in range(n_syllables))
+            word += SUFFIXES[rng.integers(len(SUFFIXES))]
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        self.words = words
+        weights = np.cumsum(1.0 / np.arange(1, size + 1) ** zipf)
+        self.cumulative = weights / weights[-1]
+
+    def sample(self, rng, n):
+        return [self.words[i] for i in self.sample_ids(rng, n)]
+
+    def sample_ids(self, rng, n):
+        return np.minimum(np.searchsorted(self.cumulative, rng.random(n), side='right'), len(self.words) - 1)
+
+    def sentence(self, rng, n_words=None):
+        words = self.sample(rng, int(n_words or rng.integers(8, 25)))
+        return words[0].capitalize() + " " + " ".join(words[1:]) + "."
+
+    def sentences(self, rng, batch=10_000):
+        """Phrases de 8 à 24 mots, sans fin ; les mots sont tirés par lots."""
+        while True:
+            lengths = rng.integers(8, 25, size=batch)
+            words = [self.words[i] for i in self.sample_ids(rng, int(lengths.sum()))]
+            end = 0
+            for length in lengths.tolist():
+                start, end = end, end + length
+                yield words[start].capitalize() + " " + " ".join(words[start + 1:end]) + "."
+
+
+def generate_paragraphs(n, vocabulary, seed=0):
+    """Passages de PARAGRAPH_MIN_CHARS à PARAGRAPH_MAX_CHARS caractères, faits de phrases entières quand c'est possible."""
+    sentences = vocabulary.sentences(np.random.default_rng(seed))
+    paragraphs = []
+    while len(paragraphs) < n:
+        paragraph = next(sentences)
+        while len(paragraph) < PARAGRAPH_MIN_CHARS:
+            paragraph += " " + next(sentences)
+        paragraphs.append(paragraph[:PARAGRAPH_MAX_CHARS])
+    return paragraphs
+
+
+def write_corpus(directory, n_paragraphs, vocabulary, seed=0, chunk_size=100_000, on_chunk=None):
+    """
+    Écrit un corpus synthétique au format de CorpusStore (sans identifiants stables), par tranches :
+    la mémoire ne dépend pas de la taille du corpus. `on_chunk(textes, première position)` reçoit
+    chaque tranche (encodage, index de shingles).
+    """
+    os.makedirs(directory, exist_ok=True)
+    offsets = np.zeros(n_paragraphs + 1, dtype=np.int64)
+    position = 0
+    with open(os.path.join(directory, TEXTS_FILE), 'wb') as texts_file:
+        for chunk_number, start in enumerate(range(0, n_paragraphs, chunk_size)):
+            texts = generate_paragraphs(min(chunk_size, n_paragraphs - start), vocabulary, seed=seed * 100_003 + chunk_number)
+            encoded = [text.encode('utf-8') for text in texts]
+            texts_file.write(b"".join(encoded))
+            offsets[start + 1:start + len(texts) + 1] = position + np.cumsum([len(e) for e in encoded])
+            position = int(offsets[start + len(texts)])
+            if on_chunk is not None:
+                on_chunk(texts, start)
+    source_codes = (np.arange(n_paragraphs) // PARAGRAPHS_PER_DOCUMENT).astype(np.int32)
+    n_documents = int(source_codes[-1]) + 1 if n_paragraphs else 0
+    np.save(os.path.join(directory, OFFSETS_FILE), offsets)
+    np.save(os.path.join(directory, SOURCE_CODES_FILE), source_codes)
+    with open(os.path.join(directory, SOURCES_FILE), 'w', encoding='utf-8') as f:
+        json.dump([f"synthetique_{d:06d}.pdf" for d in range(n_documents)], f)
+
+
+def _paraphrase(sentence, vocabulary, rng, replaced=0.3):
+    """Remplace une partie des mots et permute deux segments : proche du sens, loin du texte."""
+    words = sentence.rstrip(".").split()
+    for p in range(len(words)):
+        if rng.random() < replaced:
+            words[p] = vocabulary.sample(rng, 1)[0]
+    cut = len(words) // 2
+    words = words[cut:] + words[:cut]
+    return " ".join(words).capitalize() + "."
+
+
+def document_sentences(store, vocabulary, n_sentences, copy_ratio=0.3, paraphrase_ratio=0.2, short_ratio=0.05, seed=0):
+    """Phrases d'un document synthétique : copies de phrases du corpus, paraphrases, phrases courtes et phrases nouvelles."""
+    rng = np.random.default_rng(seed)
+    sentences = []
+    for _ in range(n_sentences):
+        draw = rng.random()
+        if draw < copy_ratio + paraphrase_ratio and len(store):
+            source = store.get_text(int(rng.integers(len(store))))
+            candidates = [s.strip() for s in source.split(".") if len(s.split()) >= 8] or [source]
+            sentence = candidates[int(rng.integers(len(candidates)))].rstrip(".") + "."
+            if draw >= copy_ratio:
+                sentence = _paraphrase(sentence, vocabulary, rng)
+        elif draw < copy_ratio + paraphrase_ratio + short_ratio:
+            # Moins de 5 mots : écartée par is_citation_or_reference
+            sentence = vocabulary.sentence(rng, n_words=3)
+        else:
+            sentence = vocabulary.sentence(rng)
+        sentences.append(sentence)
+    return sentences
+
+
+def synthetic_pdf(sentences, sentences_per_page=20, fontsize=9):
+    """Contenu d'un PDF dont chaque page porte `sentences_per_page` phrases."""
+    import fitz
+
+    document = fitz.open()
+    for start in range(0, len(sentences), sentences_per_page):
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), " ".join(sentences[start:start + sentences_per_page]), fontsize=fontsize)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def _tokens(text):
+    return text.lower().replace(".", " ").split()
+
+
+class StubBiEncoder:
+    """
+    Remplaçant déterministe de SentenceTransformer : chaque mot est projeté sur un vecteur aléatoire fixe
+    (empreinte CRC32), l'embedding d'un texte est la somme de ses mots. Deux textes qui partagent
+    des mots sont proches, comme avec le vrai modèle. `delay` simule la durée d'inférence par texte.
+    """
+
+    def __init__(self, dim=384, buckets=1 << 15, seed=0, delay=0.0):
+        self.dim = dim
+        self.buckets = buckets
+        self.delay = delay
+        self.projection = np.random.default_rng(seed).standard_normal((buckets, dim)).astype(np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        # Par lots de `batch_size` textes : le tableau des vecteurs de mots reste petit
+        for start in range(0, len(texts), batch_size):
+            token_lists = [_tokens(text) or [""] for text in texts[start:start + batch_size]]
+            buckets = np.fromiter((zlib.crc32(t.encode()) % self.buckets for tokens in token_lists for t in tokens), dtype=np.int64)
+            starts = np.cumsum([0] + [len(tokens) for tokens in token_lists[:-1]])
+            embeddings[start:start + len(token_lists)] = np.add.reduceat(self.projection[buckets], starts, axis=0)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if self.delay:
+            time.sleep(self.delay * len(texts))
+        return embeddings[0] if single else embeddings
+
+
+class StubCrossEncoder:
+    """
+    Remplaçant déterministe de CrossEncoder : le score d'une paire est la part des mots de la phrase
+    présents dans le passage (float32, entre 0 et 1). `delay` simule la durée d'inférence par paire.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def predict(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        scores = np.empty(len(sentences), dtype=np.float32)
+        for p, (query, passage) in enumerate(sentences):
+            query_tokens, passage_tokens = set(_tokens(query)), set(_tokens(passage))
+            scores[p] = len(query_tokens & passage_tokens) / len(query_tokens) if query_tokens else 0.0
+        if self.delay:
+            time.sleep(self.delay * len(sentences))
+        return scores
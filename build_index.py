@@ -0,0 +1,112 @@
+"""
+Construit un index FAISS approximatif (IVF-Flat, IVF-SQ8, IVF-PQ ou HNSW) à partir des
+embeddings du corpus, pour remplacer la recherche exacte quand le corpus devient trop grand.
+
+Exemples (depuis la racine du projet) :
+    python build_index.py --type ivf-flat --nlist 4096
+    python build_index.py --type ivf-pq --nlist 4096 --pq-m 48 --install
+    python build_index.py --type hnsw --hnsw-m 32 --ef-construction 200
+
+Les paramètres de recherche se règlent au démarrage de l'API :
+    APLAG_FAISS_NPROBE=32 (IVF)   APLAG_FAISS_EF_SEARCH=128 (HNSW)
+Utilisez benchmarks/bench_index.py pour choisir le compromis vitesse / rappel.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+
+from app.analysis_logic import BI_ENCODER_NAME, CORPUS_DIR, load_corpus_dataframe
+from app.embedding_cache import corpus_embedding_cache, encode_texts
+from app.index_builder import INDEX_TYPES, base_index, build_index, describe_index, index_ids, is_id_mapped, reconstruct_embeddings
+from app.snapshots import publish_snapshot, resolve_snapshot
+
+# Copie de l'index exact, conservée pour reconstruire d'autres types d'index et mesurer le rappel
+EXACT_INDEX_PATH = os.path.join(CORPUS_DIR, 'corpus_doc.flat.index')
+
+
+def load_exact_index():
+    """Index exact de référence : la copie conservée, ou l'index courant s'il est exact."""
+    for path in (EXACT_INDEX_PATH, resolve_snapshot()['index_path']):
+        if os.path.exists(path):
+            index = faiss.read_index(path)
+            if isinstance(base_index(index), faiss.IndexFlat):
+                return index
+    return None
+
+
+def corpus_embeddings(reencode=False):
+    """
+    Embeddings du corpus, relus depuis l'index exact ou recalculés avec le Bi-Encoder
+    (les passages déjà encodés sont relus dans le cache d'embeddings).
+    Retourne (embeddings, métrique, identifiants stables ou None pour un index positionnel).
+    """
+    exact_index = None if reencode else load_exact_index()
+    if exact_index is not None:
+        print(f"Lecture des embeddings depuis l'index exact : {describe_index(exact_index)}")
+        ids = index_ids(exact_index) if is_id_mapped(exact_index) else None
+        return reconstruct_embeddings(exact_index), exact_index.metric_type, ids
+
+    from sentence_transformers import SentenceTransformer
+    corpus = load_corpus_dataframe()
+    print(f"Encodage de {len(corpus)} passages avec {BI_ENCODER_NAME}...")
+    bi_encoder = SentenceTransformer(BI_ENCODER_NAME)
+    embeddings = encode_texts(bi_encoder, corpus.all_texts(), cache=corpus_embedding_cache(), show_progress_bar=True)
+    return embeddings, faiss.METRIC_INNER_PRODUCT, None if corpus.ids is None else np.asarray(corpus.ids)
+
+
+def install_index(path):
+    """
+    Publie un instantané du corpus avec ce nouvel index (le store courant est repris tel quel),
+    en conservant une copie de l'index exact. L'API le charge via /admin/reload-corpus.
+    """
+    snapshot = resolve_snapshot()
+    current_path = snapshot['index_path']
+    current = faiss.read_index(current_path) if os.path.exists(current_path) else None
+    if current is not None and isinstance(base_index(current), faiss.IndexFlat) and not os.path.exists(EXACT_INDEX_PATH):
+        shutil.copyfile(current_path, EXACT_INDEX_PATH)
+        print(f"Index exact conservé : {EXACT_INDEX_PATH}")
+
+    version = publish_snapshot(
+        faiss.read_index(path),
+        store_dir=snapshot['store_dir'],
+        metadata={"index_source": os.path.abspath(path)},
+        shingles_dir=snapshot['shingles_dir']
+    )
+    print(f"Index installé dans l'instantané : {version}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--type', choices=INDEX_TYPES, required=True)
+    parser.add_argument('--nlist', type=int, help="Nombre de listes IVF (défaut : ~4·√n)")
+    parser.add_argument('--pq-m', type=int, default=48, help="Nombre de sous-quantificateurs IVF-PQ")
+    parser.add_argument('--hnsw-m', type=int, default=32, help="Degré du graphe HNSW")
+    parser.add_argument('--ef-construction', type=int, default=200)
+    parser.add_argument('--output', help="Chemin de l'index produit (défaut : corpus_doc.<type>.index)")
+    parser.add_argument('--reencode', action='store_true', help="Réencoder le corpus au lieu de relire l'index exact")
+    parser.add_argument('--install', action='store_true', help="Publier un instantané du corpus avec cet index")
+    args = parser.parse_args()
+
+    embeddings, metric, ids = corpus_embeddings(args.reencode)
+
+    start = time.perf_counter()
+    index = build_index(
+        embeddings, args.type, metric=metric, nlist=args.nlist,
+        pq_m=args.pq_m, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction, ids=ids
+    )
+    print(f"Index construit en {time.perf_counter() - start:.1f} s : {describe_index(index)}")
+
+    output = args.output or os.path.join(CORPUS_DIR, f"corpus_doc.{args.type}.index")
+    faiss.write_index(index, output)
+    print(f"Index écrit : {output} ({os.path.getsize(output) / 1024 ** 2:.1f} Mo)")
+
+    if args.install:
+        install_index(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Partitionne la version courante du corpus en N shards (par empreinte du titre du document source)
+pour la recherche répartie : chaque shard a son index FAISS, son store et son index de shingles.
+
+Exemples (depuis la racine du projet) :
+    python build_shards.py --shards 4
+    python build_shards.py --shards 8 --type ivf-flat --nlist 1024 --check 500
+
+Les shards sont écrits dans app/corpus/shards/<version>/ et servis selon APLAG_SHARDS :
+    APLAG_SHARDS=thread    shards ouverts dans le processus de l'API, interrogés en parallèle
+    APLAG_SHARDS=process   un processus par shard
+    APLAG_SHARDS=http      un serveur par shard (python -m app.shard_server), listés dans APLAG_SHARD_URLS
+À reconstruire après chaque nouvelle version du corpus (manage_corpus.py, update_corpus.py).
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.analysis_logic import load_corpus_dataframe
+from app.index_builder import INDEX_TYPES, build_index
+from app.sharding import check_equivalence, load_sharded_corpus, shards_directory, write_shards
+from app.snapshots import resolve_snapshot
+from build_index import corpus_embeddings
+
+
+def store_order(embeddings, ids, store):
+    """Embeddings (dans l'ordre de l'index exact) remis dans l'ordre des passages du store."""
+    if len(embeddings) != len(store):
+        raise ValueError(f"L'index exact contient {len(embeddings)} vecteurs pour {len(store)} passages : réencodez le corpus (--reencode).")
+    if ids is None:
+        return embeddings
+    positions = store.positions_of(ids)
+    if np.any(positions < 0):
+        raise ValueError("Des vecteurs de l'index exact n'ont pas de passage dans le store : réencodez le corpus (--reencode).")
+    ordered = np.empty_like(embeddings)
+    ordered[positions] = embeddings
+    return ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, required=True, help="Nombre de shards")
+    parser.add_argument('--type', choices=INDEX_TYPES, default='flat', help="Type d'index de chaque shard")
+    parser.add_argument('--nlist', type=int, help="Nombre de listes IVF par shard (défaut : ~4·√n)")
+    parser.add_argument('--pq-m', type=int, default=48, help="Nombre de sous-quantificateurs IVF-PQ")
+    parser.add_argument('--hnsw-m', type=int, default=32, help="Degré du graphe HNSW")
+    parser.add_argument('--no-shingles', action='store_true', help="Ne pas construire l'index de shingles des shards")
+    parser.add_argument('--reencode', action='store_true', help="Réencoder le corpus au lieu de relire l'index exact")
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help="Comparer N recherches avec celles d'un index exact unique")
+    args = parser.parse_args()
+
+    snapshot = resolve_snapshot()
+    store = load_corpus_dataframe(snapshot['store_dir'])
+    embeddings, metric, ids = corpus_embeddings(args.reencode)
+    embeddings = store_order(embeddings, ids, store)
+
+    start = time.perf_counter()
+    directory = shards_directory(snapshot['version'])
+    manifest = write_shards(
+        directory, snapshot['version'], store, embeddings, args.shards, index_type=args.type, metric=metric,
+        shingles=not args.no_shingles, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m
+    )
+    print(f"{args.shards} shards écrits en {time.perf_counter() - start:.1f} s dans {directory}")
+    print(f"Passages par shard : {manifest['repartition']}")
+
+    if args.check:
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(store), min(args.check, len(store)), replace=False)
+        # Requêtes proches de passages du corpus, sans leur être identiques
+        queries = embeddings[sample] + rng.normal(0, 0.05, (len(sample), embeddings.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        reference = build_index(embeddings, 'flat', metric=metric)
+        sharded = load_sharded_corpus(snapshot['version'], mode='thread')
+        try:
+            problems = check_equivalence(reference, store, sharded, queries)
+        finally:
+            sharded.close()
+        for problem in problems:
+            print(f"⚠️  {problem}")
+        if not problems:
+            print(f"✅ {len(queries)} recherches identiques à celles d'un index exact unique.")
+
+
+if __name__ == "__main__":
+    main()
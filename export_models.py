@@ -0,0 +1,47 @@
+"""
+Exporte le Bi-Encoder et le Cross-Encoder au format ONNX, en fp32 et quantifiés dynamiquement
+en int8, pour les servir avec ONNX Runtime sur CPU (APLAG_INFERENCE_BACKEND=onnx ou onnx-int8).
+
+Dépendances : pip install "sentence-transformers[onnx]"   (optimum + onnxruntime)
+
+Exemples (depuis la racine du projet) :
+    python export_models.py                      # quantification pour AVX2
+    python export_models.py --quantization avx512_vnni
+
+Le jeu d'instructions doit correspondre à APLAG_ONNX_QUANTIZATION au démarrage de l'API.
+Vérifiez ensuite l'écart de verdicts avec benchmarks/bench_backend.py.
+"""
+import argparse
+import os
+
+from sentence_transformers import CrossEncoder, SentenceTransformer, export_dynamic_quantized_onnx_model
+
+from app.analysis_logic import BI_ENCODER_NAME, CROSS_ENCODER_NAME, exported_model_dir, quantized_model_file
+
+QUANTIZATIONS = ('arm64', 'avx2', 'avx512', 'avx512_vnni')
+
+
+def export_model(model_class, model_name, quantization):
+    """Exporte un modèle en ONNX fp32 (onnx/model.onnx) puis en int8 (onnx/model_qint8_<jeu>.onnx)."""
+    export_dir = exported_model_dir(model_name)
+    print(f"Export ONNX de {model_name} -> {export_dir}")
+    # Sans fichier ONNX dans le dépôt du modèle, sentence-transformers l'exporte à la volée
+    model = model_class(model_name, backend='onnx')
+    model.save_pretrained(export_dir)
+    export_dynamic_quantized_onnx_model(model, quantization, export_dir)
+    for file_name in ('onnx/model.onnx', quantized_model_file(quantization)):
+        path = os.path.join(export_dir, file_name)
+        print(f"  {file_name} : {os.path.getsize(path) / 1024 ** 2:.0f} Mo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default='avx2', help="Jeu d'instructions visé par la quantification int8")
+    args = parser.parse_args()
+
+    export_model(SentenceTransformer, BI_ENCODER_NAME, args.quantization)
+    export_model(CrossEncoder, CROSS_ENCODER_NAME, args.quantization)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Configuration gunicorn de l'API (voir procfile) : plusieurs workers uvicorn qui partagent
+les modèles, l'index FAISS et le corpus au lieu d'en charger chacun une copie.
+
+- preload_app : app.main est importé une seule fois par le processus parent, qui charge les
+  ressources (APLAG_PRELOAD=1) ; les workers sont ensuite créés par fork et partagent ces pages
+  en copie sur écriture.
+- APLAG_FAISS_MMAP=1 : l'index est projeté en mémoire en lecture seule ; une nouvelle version
+  du corpus chargée par les workers (/admin/reload-corpus) reste partagée via le cache de pages.
+- APLAG_SNAPSHOT_POLL_SECONDS=5 : chaque worker surveille snapshots/CURRENT. /admin/reload-corpus
+  ne recharge que le worker qui reçoit la requête ; les autres passent à la même version au plus
+  5 s plus tard, au lieu de servir l'ancienne et de vider tour à tour les caches partagés.
+
+Mesure de la mémoire par worker : python -m benchmarks.bench_memory
+"""
+import os
+
+os.environ.setdefault('APLAG_PRELOAD', '1')
+os.environ.setdefault('APLAG_FAISS_MMAP', '1')
+os.environ.setdefault('APLAG_SNAPSHOT_POLL_SECONDS', '5')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+# L'analyse tourne dans le pool de chaque worker : la boucle d'événements reste disponible
+timeout = int(os.environ.get('APLAG_WORKER_TIMEOUT', 120))
@@ -0,0 +1,213 @@
+"""
+Maintenance du corpus de référence sans reconstruction complète de l'index.
+
+Chaque opération publie un nouvel instantané (app/snapshots.py) que l'API charge sans redémarrer.
+Le retrait et le remplacement de documents demandent un index à identifiants stables
+(IndexIDMap2, un identifiant par texte de passage) : `migrate-ids` convertit le corpus courant.
+L'index de shingles de la voie rapide suit les positions du corpus : il est reconstruit à chaque opération
+(`build-shingles` le construit pour un corpus qui n'en a pas encore).
+
+Exemples (depuis la racine du projet) :
+    python manage_corpus.py check --sample 200
+    python manage_corpus.py build-shingles
+    python manage_corpus.py migrate-ids
+    python manage_corpus.py remove "these_retiree.pdf"
+    python manage_corpus.py replace "these_v1.pdf" these_v2.pdf
+"""
+import argparse
+import os
+
+import faiss
+import numpy as np
+
+from app.analysis_logic import BI_ENCODER_NAME, load_corpus_dataframe
+from app.corpus_store import CorpusStore, paragraph_ids
+from app.embedding_cache import corpus_embedding_cache, encode_texts
+from app.index_builder import (
+    check_consistency, describe_index, is_id_mapped, remove_from_index, with_id_map
+)
+from app.shingle_index import SHINGLE_SIZE, ShingleIndex
+from app.snapshots import publish_snapshot, resolve_snapshot
+from build_index import EXACT_INDEX_PATH, corpus_embeddings
+
+
+def load_current():
+    """Index et store de la version courante du corpus."""
+    snapshot = resolve_snapshot()
+    return faiss.read_index(snapshot['index_path']), load_corpus_dataframe(snapshot['store_dir'])
+
+
+def encode(texts):
+    from sentence_transformers import SentenceTransformer
+    print(f"Encodage de {len(texts)} passages avec {BI_ENCODER_NAME}...")
+    bi_encoder = SentenceTransformer(BI_ENCODER_NAME)
+    return encode_texts(bi_encoder, texts, cache=corpus_embedding_cache(), show_progress_bar=True)
+
+
+def update_exact_copy(removed_ids=(), embeddings=None, added_ids=None):
+    """La copie de l'index exact (build_index.py) suit les mêmes retraits et ajouts que l'index servi."""
+    if not os.path.exists(EXACT_INDEX_PATH):
+        return
+    exact_index = faiss.read_index(EXACT_INDEX_PATH)
+    if not is_id_mapped(exact_index):
+        return
+    if len(removed_ids):
+        remove_from_index(exact_index, removed_ids)
+    if embeddings is not None and len(embeddings):
+        exact_index.add_with_ids(embeddings, added_ids)
+    faiss.write_index(exact_index, EXACT_INDEX_PATH)
+
+
+def without_sources(index, store, titles):
+    """Retire de l'index et du store tous les passages des documents `titles`."""
+    if store.ids is None or not is_id_mapped(index):
+        raise SystemExit("Le corpus courant est positionnel : lancez d'abord `python manage_corpus.py migrate-ids`.")
+    positions = []
+    for title in titles:
+        found = store.positions_of_source(title)
+        if not len(found):
+            raise SystemExit(f"Aucun passage du document « {title} » dans le corpus.")
+        positions.append(found)
+    positions = np.concatenate(positions)
+    ids = np.asarray(store.ids)[positions]
+    try:
+        removed = remove_from_index(index, ids)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if removed != len(ids):
+        raise SystemExit(f"{removed} vecteurs retirés pour {len(ids)} passages : l'index n'est pas aligné sur le corpus (voir `check`).")
+    keep = np.setdiff1d(np.arange(len(store)), positions)
+    return store.select(keep), ids
+
+
+def cmd_check(args):
+    index, store = load_current()
+    print(f"Index : {describe_index(index)} ; corpus : {len(store)} passages")
+    bi_encoder = None
+    if args.sample:
+        from sentence_transformers import SentenceTransformer
+        bi_encoder = SentenceTransformer(BI_ENCODER_NAME)
+    problems = check_consistency(index, store, bi_encoder=bi_encoder, sample=args.sample)
+    for problem in problems:
+        print(f"  - {problem}")
+    if problems:
+        raise SystemExit(1)
+    print("Index et corpus cohérents.")
+
+
+def cmd_migrate_ids(args):
+    index, store = load_current()
+    if is_id_mapped(index):
+        raise SystemExit("L'index courant a déjà des identifiants stables.")
+
+    embeddings, metric, _ = corpus_embeddings(args.reencode)
+    if len(embeddings) != len(store):
+        print(f"L'index exact ({len(embeddings)}) ne correspond pas au corpus ({len(store)})")
+        embeddings = encode(store.all_texts())
+
+    # Une seule occurrence de chaque texte : première position conservée
+    ids = paragraph_ids(store.all_texts())
+    _, first = np.unique(ids, return_index=True)
+    keep = np.sort(first)
+    print(f"{len(store) - len(keep)} passage(s) en double retiré(s)")
+
+    new_store = store.select(keep)
+    new_store.ids = ids[keep]
+    new_index = with_id_map(index, embeddings[keep], ids[keep])
+    version = publish_snapshot(new_index, new_store, metadata={
+        "operation": "migration_identifiants", "doublons_retires": int(len(store) - len(keep))
+    }, shingle_index=ShingleIndex.build(new_store.all_texts()))
+    if os.path.exists(EXACT_INDEX_PATH):
+        faiss.write_index(with_id_map(faiss.IndexFlat(index.d, metric), embeddings[keep], ids[keep]), EXACT_INDEX_PATH)
+    print(f"Instantané publié : {version} ({describe_index(new_index)})")
+
+
+def cmd_remove(args):
+    index, store = load_current()
+    new_store, removed_ids = without_sources(index, store, args.titles)
+    version = publish_snapshot(index, new_store, metadata={
+        "operation": "retrait", "documents_retires": args.titles, "paragraphes_retires": len(removed_ids)
+    }, shingle_index=ShingleIndex.build(new_store.all_texts()))
+    update_exact_copy(removed_ids)
+    print(f"{len(removed_ids)} passage(s) retiré(s). Instantané publié : {version}")
+
+
+def cmd_replace(args):
+    from update_corpus import preparer_document
+
+    resultat = preparer_document(args.pdf)
+    if resultat["statut"] != "extrait" or not resultat["blocs"]:
+        raise SystemExit(f"Aucun bloc exploitable dans {args.pdf} : {resultat['erreur'] or 'document vide'}")
+
+    index, store = load_current()
+    kept_store, removed_ids = without_sources(index, store, [args.title])
+
+    # Dédoublonnage avant encodage : ni les textes déjà présents ni les doublons du document
+    seen = set(np.asarray(kept_store.ids).tolist())
+    blocks, block_ids = [], []
+    for block, block_id in zip(resultat["blocs"], paragraph_ids(resultat["blocs"]).tolist()):
+        if block_id not in seen:
+            seen.add(block_id)
+            blocks.append(block)
+            block_ids.append(block_id)
+    block_ids = np.asarray(block_ids, dtype=np.int64)
+
+    embeddings = encode(blocks).astype(np.float32) if blocks else np.zeros((0, index.d), dtype=np.float32)
+    if blocks:
+        index.add_with_ids(embeddings, block_ids)
+    new_store = CorpusStore.from_records(
+        kept_store.all_texts() + blocks,
+        kept_store.get_sources(np.arange(len(kept_store))) + [args.title] * len(blocks),
+        with_ids=True
+    )
+    version = publish_snapshot(index, new_store, metadata={
+        "operation": "remplacement", "document": args.title,
+        "paragraphes_retires": len(removed_ids), "paragraphes_ajoutes": len(blocks)
+    }, shingle_index=ShingleIndex.build(new_store.all_texts()))
+    update_exact_copy(removed_ids, embeddings, block_ids)
+    print(f"{len(removed_ids)} passage(s) retiré(s), {len(blocks)} ajouté(s). Instantané publié : {version}")
+
+
+def cmd_build_shingles(args):
+    snapshot = resolve_snapshot()
+    index, store = load_current()
+    shingles = ShingleIndex.build(store.all_texts(), size=args.size)
+    print(f"{len(shingles)} shingles de {shingles.size} mots pour {len(store)} passages")
+    # Le store et l'index FAISS sont repris tels quels
+    version = publish_snapshot(index, store_dir=snapshot['store_dir'], metadata={
+        "operation": "index_shingles", "taille_shingle": shingles.size
+    }, shingle_index=shingles)
+    print(f"Instantané publié : {version}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    check = commands.add_parser('check', help="Vérifier l'alignement de l'index et du corpus")
+    check.add_argument('--sample', type=int, default=0, help="Passages à réencoder pour vérifier leurs vecteurs")
+    check.set_defaults(func=cmd_check)
+
+    migrate = commands.add_parser('migrate-ids', help="Passer à un index à identifiants stables (et retirer les doublons)")
+    migrate.add_argument('--reencode', action='store_true', help="Réencoder le corpus au lieu de relire l'index exact")
+    migrate.set_defaults(func=cmd_migrate_ids)
+
+    remove = commands.add_parser('remove', help="Retirer un ou plusieurs documents sources")
+    remove.add_argument('titles', nargs='+', help="Titres des documents (colonne source du corpus)")
+    remove.set_defaults(func=cmd_remove)
+
+    replace = commands.add_parser('replace', help="Remplacer les passages d'un document par ceux d'un nouveau PDF")
+    replace.add_argument('title', help="Titre du document dans le corpus")
+    replace.add_argument('pdf', help="Nouvelle version du document")
+    replace.set_defaults(func=cmd_replace)
+
+    shingles = commands.add_parser('build-shingles', help="Construire l'index de shingles de la voie rapide")
+    shingles.add_argument('--size', type=int, default=SHINGLE_SIZE, help="Nombre de mots par shingle")
+    shingles.set_defaults(func=cmd_build_shingles)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les tests importent le paquet `app` depuis la racine du projet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+"""Sélection des candidats au re-ranking : les résultats manquants (-1) de FAISS ne sont jamais re-classés."""
+import numpy as np
+
+from app.analysis_logic import rerank_hits, select_candidates
+from app.corpus_store import CorpusStore
+from app.index_builder import build_index, configure_search
+
+
+class RecordingCrossEncoder:
+    """Cross-Encoder factice : note chaque paire 1.0 et garde les passages reçus."""
+
+    def __init__(self):
+        self.passages = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.passages.extend(passage for _, passage in pairs)
+        return np.ones(len(pairs), dtype=np.float32)
+
+
+def clustered_embeddings(n_clusters=16, per_cluster=8, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim))
+    points = np.repeat(centers, per_cluster, axis=0) + rng.normal(0, 0.05, (n_clusters * per_cluster, dim))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    return points.astype(np.float32)
+
+
+def test_select_candidates_drops_missing_hits():
+    indices = np.array([[3, 1, -1, -1], [-1, -1, -1, -1], [2, -1, 5, 0]])
+    similarities = np.array([[0.9, 0.8, -3e38, -3e38], [-3e38] * 4, [0.9, 0.8, 0.7, 0.6]], dtype=np.float32)
+    candidates = select_candidates(indices, similarities)
+    assert [c.tolist() for c in candidates] == [[3, 1], [], [2, 5, 0]]
+    # Même chose quand la cascade est active
+    candidates = select_candidates(indices, similarities, score_floor=0.5, score_margin=0.5, min_k=1)
+    assert [c.tolist() for c in candidates] == [[3, 1], [], [2, 5, 0]]
+
+
+def test_ivf_padding_is_not_reranked_against_last_passage():
+    embeddings = clustered_embeddings()
+    texts = [f"passage {p}" for p in range(len(embeddings))]
+    store = CorpusStore.from_records(texts, [f"doc{p // 8}.pdf" for p in range(len(embeddings))])
+    index = configure_search(build_index(embeddings, 'ivf-flat', nlist=16), nprobe=1)
+
+    # Une seule liste visitée (8 passages) pour 20 voisins demandés : le top-k est complété par des -1
+    distances, indices = index.search(embeddings[:4], 20)
+    assert np.any(indices < 0)
+    candidates = select_candidates(indices, distances)
+    assert all(np.all(ids >= 0) for ids in candidates)
+
+    cross_encoder = RecordingCrossEncoder()
+    hits = rerank_hits(texts[:4], candidates, store, cross_encoder, all_hits=True)
+    expected = sorted(texts[p] for row in indices for p in row if p >= 0)
+    assert sorted(cross_encoder.passages) == expected
+    assert texts[-1] not in cross_encoder.passages
+    assert sum(len(h) for h in hits) == len(expected)
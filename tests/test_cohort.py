@@ -0,0 +1,44 @@
+"""Analyse de cohorte : voisins des autres documents, noms uniques."""
+import faiss
+import numpy as np
+import pytest
+
+from app.cohort import cohort_neighbours, unique_names
+
+
+def brute_force_neighbours(vectors, owners, rows, top_k):
+    """Top-k par la matrice de similarité complète, les phrases du même document exclues."""
+    similarities = vectors[rows] @ vectors.T
+    similarities[owners[rows][:, None] == owners[None, :]] = -np.inf
+    order = np.lexsort((np.broadcast_to(np.arange(len(vectors)), similarities.shape), -similarities), axis=-1)[:, :top_k]
+    top = np.take_along_axis(similarities, order, axis=1)
+    return top, np.where(np.isfinite(top), order, -1)
+
+
+@pytest.mark.parametrize('top_k', [1, 5, 40])
+@pytest.mark.parametrize('block_size', [7, 64])
+def test_cohort_neighbours_equal_brute_force(top_k, block_size):
+    rng = np.random.default_rng(0)
+    sizes = [3, 12, 1, 20, 8]
+    owners = np.repeat(np.arange(len(sizes)), sizes)
+    vectors = rng.standard_normal((len(owners), 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+
+    for start in range(0, len(owners), block_size):
+        rows = np.arange(start, min(start + block_size, len(owners)))
+        similarities, positions = cohort_neighbours(index, vectors, owners, rows, top_k)
+        expected_similarities, expected_positions = brute_force_neighbours(vectors, owners, rows, top_k)
+        np.testing.assert_array_equal(positions, expected_positions)
+        found = positions >= 0
+        np.testing.assert_allclose(similarities[found], expected_similarities[found], rtol=1e-5, atol=1e-6)
+        # Jamais une phrase du même document
+        assert not np.any(found & (owners[np.maximum(positions, 0)] == owners[rows][:, None]))
+
+
+def test_unique_names():
+    assert unique_names(['a.pdf', 'b.pdf', 'a.pdf']) == ['a.pdf', 'b.pdf', 'a (2).pdf']
+    names = unique_names(['a.pdf', 'a.pdf', 'a (2).pdf', 'a.pdf'])
+    assert len(set(names)) == len(names)
+    assert names == ['a.pdf', 'a (2).pdf', 'a (2) (2).pdf', 'a (3).pdf']
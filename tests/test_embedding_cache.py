@@ -0,0 +1,55 @@
+"""Cache d'embeddings : éviction sans mélange de vecteurs et résultats indépendants de l'état du cache."""
+import numpy as np
+
+from app.embedding_cache import EmbeddingCache
+
+
+class CountingEncoder:
+    """Bi-Encoder factice : vecteur aléatoire fixe par texte, et nombre de textes encodés."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.encoded = 0
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False):
+        self.encoded += len(texts)
+        vectors = np.stack([np.random.default_rng(abs(hash(text)) % 2**32).standard_normal(self.dim) for text in texts])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def small_cache(tmp_path, capacity, dtype='float32', dim=8):
+    return EmbeddingCache('test', cache_dir=str(tmp_path), max_bytes=capacity * dim * np.dtype(dtype).itemsize, dtype=dtype)
+
+
+def test_eviction_keeps_each_key_on_its_own_vector(tmp_path):
+    cache, encoder = small_cache(tmp_path, capacity=4), CountingEncoder()
+    texts = [f"phrase {n}" for n in range(10)]
+    for start in range(0, len(texts), 3):
+        cache.encode(encoder, texts[start:start + 3])
+    keys = [cache.make_key(text) for text in texts]
+    found = cache.get_many(keys)
+    assert 0 < len(found) <= 4
+    for text, key in zip(texts, keys):
+        if key in found:
+            np.testing.assert_array_equal(found[key], encoder.encode([text])[0])
+
+
+def test_evicted_slot_is_not_readable_while_its_new_vector_is_written(tmp_path):
+    cache, encoder = small_cache(tmp_path, capacity=2), CountingEncoder()
+    cache.encode(encoder, ["ancienne 1", "ancienne 2"])
+    old_keys = [cache.make_key("ancienne 1"), cache.make_key("ancienne 2")]
+
+    # Première étape de put_many : les lignes sont réservées, les vecteurs pas encore écrits
+    reserved = cache._reserve_slots([cache.make_key("nouvelle")], encoder.dim)
+    assert len(reserved) == 1
+    assert len(cache.get_many(old_keys)) == 1
+    assert cache.get_many([cache.make_key("nouvelle")]) == {}
+
+
+def test_results_do_not_depend_on_cache_state(tmp_path):
+    for dtype in ('float32', 'float16'):
+        cache, encoder = small_cache(tmp_path / dtype, capacity=16, dtype=dtype), CountingEncoder()
+        miss = cache.encode(encoder, ["une phrase", "une autre"])
+        hit = cache.encode(encoder, ["une phrase", "une autre"])
+        assert encoder.encoded == 2
+        np.testing.assert_array_equal(miss, hit)
@@ -0,0 +1,62 @@
+"""Tâches asynchrones : reprise des tâches interrompues, distributeur."""
+import asyncio
+import os
+import subprocess
+import sys
+
+from app.jobs import STATUS_DONE, STATUS_FAILED, STATUS_PENDING, STATUS_RUNNING, JobRunner, JobStore
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_requeue_only_jobs_of_dead_processes(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    live, dead, legacy = (store.create(f"{name}.pdf", f"{name}.pdf", 0.5) for name in ("live", "dead", "legacy"))
+    for _ in range(3):
+        store.claim_next()
+    assert store.get(live)['owner_pid'] == os.getpid()
+    store.update(dead, owner_pid=dead_pid())
+    store.update(legacy, owner_pid=None)
+
+    # Un worker qui (re)démarre ne reprend pas la tâche d'un worker encore en vie
+    assert store.requeue_interrupted() == 2
+    assert store.get(live)['status'] == STATUS_RUNNING
+    assert store.get(dead)['status'] == STATUS_PENDING
+    assert store.get(legacy)['status'] == STATUS_PENDING
+    assert store.get(dead)['owner_pid'] is None
+
+
+class BrokenPool:
+    """Pool arrêté : refuse la première tâche, exécute les suivantes dans le processus du test."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def run(self, func, job_id, db_path):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        JobStore(db_path).update(job_id, status=STATUS_DONE)
+
+
+def test_dispatcher_survives_pool_errors(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    first, second = store.create("a.pdf", "a.pdf", 0.5), store.create("b.pdf", "b.pdf", 0.5)
+
+    async def scenario():
+        runner = JobRunner(store, BrokenPool(), concurrency=1)
+        runner.start()
+        for _ in range(200):
+            if store.get(second)['status'] == STATUS_DONE:
+                break
+            await asyncio.sleep(0.01)
+        await runner.stop()
+
+    asyncio.run(scenario())
+    assert store.get(first)['status'] == STATUS_FAILED
+    assert "RuntimeError" in store.get(first)['error']
+    assert store.get(second)['status'] == STATUS_DONE
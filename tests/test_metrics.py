@@ -0,0 +1,32 @@
+"""Métriques cumulées en mémoire puis écrites par lots dans la base partagée."""
+import multiprocessing
+
+from app.metrics import MetricsStore
+
+
+def record_in_child(db_path):
+    MetricsStore(db_path, flush_seconds=3600).record(counters=[('aplag_analyses_total', {'origine': 'analyse'}, 1)])
+
+
+def test_record_is_buffered_until_flush(tmp_path):
+    db_path = str(tmp_path / 'metrics.sqlite3')
+    writer, reader = MetricsStore(db_path, flush_seconds=3600), MetricsStore(db_path, flush_seconds=3600)
+    writer.record(counters=[('aplag_analyses_total', {'origine': 'cache'}, 1)],
+                  observations=[('aplag_analyse_duree_secondes', {}, 0.2)])
+    writer.record(counters=[('aplag_analyses_total', {'origine': 'cache'}, 1)])
+    assert reader.values() == {}
+
+    writer.flush()
+    values = reader.values()
+    assert values['aplag_analyses_total'] == {'origine="cache"': 2}
+    assert values['aplag_analyse_duree_secondes_count'] == {'': 1}
+    assert values['aplag_analyse_duree_secondes_bucket']['le="0.25"'] == 1
+    assert 'le="0.1"' not in values['aplag_analyse_duree_secondes_bucket']
+
+
+def test_pending_metrics_are_written_when_a_pool_process_exits(tmp_path):
+    db_path = str(tmp_path / 'metrics.sqlite3')
+    process = multiprocessing.get_context('spawn').Process(target=record_in_child, args=(db_path,))
+    process.start()
+    process.join()
+    assert MetricsStore(db_path).values()['aplag_analyses_total'] == {'origine="analyse"': 1}
@@ -0,0 +1,31 @@
+"""Cache de résultats : les versions du corpus cohabitent, l'éviction se fait par taille."""
+import os
+
+from app.result_cache import ResultCache
+
+
+def test_versions_share_the_cache(tmp_path):
+    old = ResultCache('v1', cache_dir=str(tmp_path))
+    old_key = old.make_key('doc', 0.5)
+    old.put_analysis(old_key, {'version_corpus': 'v1'})
+
+    # Un worker passé à la nouvelle version ne vide pas le cache de ceux restés sur l'ancienne
+    new = ResultCache('v2', cache_dir=str(tmp_path))
+    new_key = new.make_key('doc', 0.5)
+    assert new_key != old_key
+    assert new.get_analysis(new_key) is None
+    new.put_analysis(new_key, {'version_corpus': 'v2'})
+    assert ResultCache('v1', cache_dir=str(tmp_path)).get_analysis(old_key) == {'version_corpus': 'v1'}
+    assert new.get_analysis(new_key) == {'version_corpus': 'v2'}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache('v1', cache_dir=str(tmp_path), max_bytes=2500)
+    keys = [cache.make_key(f"doc{n}", 0.5) for n in range(3)]
+    for n, key in enumerate(keys[:2]):
+        cache.put_analysis(key, {'texte': 'x' * 1000})
+        os.utime(cache._analysis_path(key), (n, n))
+    cache.put_analysis(keys[2], {'texte': 'x' * 1000})
+    assert cache.get_analysis(keys[0]) is None
+    assert cache.get_analysis(keys[1]) is not None
+    assert cache.get_analysis(keys[2]) is not None
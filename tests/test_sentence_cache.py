@@ -0,0 +1,40 @@
+"""Cache de phrases : éviction par lots plutôt qu'à chaque enregistrement."""
+import sqlite3
+
+from app.sentence_cache import SentenceCache
+
+
+def entries_in(cache):
+    with sqlite3.connect(cache.db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM sentence_hits").fetchone()[0]
+
+
+def test_eviction_runs_every_evict_every_inserts(tmp_path):
+    cache = SentenceCache('v1', db_path=str(tmp_path / 'sentences.sqlite3'), max_entries=5, evict_every=8)
+    keys = [cache.make_key(f"phrase {n}", 'sig') for n in range(12)]
+    cache.put_many([(key, n, 0.5) for n, key in enumerate(keys[:7])])
+    assert entries_in(cache) == 7  # pas encore d'éviction
+
+    cache.put_many([(key, n, 0.5) for n, key in enumerate(keys[7:], start=7)])
+    assert entries_in(cache) == 5
+    # Les phrases les plus récentes sont conservées
+    assert set(cache.get_many(keys[7:])) == set(keys[7:])
+
+
+def test_lookups_do_not_write(tmp_path):
+    cache = SentenceCache('v1', db_path=str(tmp_path / 'sentences.sqlite3'), flush_seconds=3600)
+    keys = [cache.make_key(f"phrase {n}", 'sig') for n in range(3)]
+    cache.put_many([(keys[0], 0, 0.5)])
+
+    # Un autre worker tient le verrou d'écriture : la lecture n'attend pas
+    writer = sqlite3.connect(cache.db_path, timeout=0)
+    writer.execute("BEGIN IMMEDIATE")
+    cache._connect = lambda: sqlite3.connect(cache.db_path, timeout=0)
+    assert set(cache.get_many(keys)) == {keys[0]}
+    writer.rollback()
+    writer.close()
+
+    with sqlite3.connect(cache.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0] == 0
+    stats = cache.stats()
+    assert (stats["succes"], stats["echecs"]) == (1, 2)
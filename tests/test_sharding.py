@@ -0,0 +1,44 @@
+"""Recherche répartie : le top-k fusionné des shards est celui d'un index exact unique."""
+import numpy as np
+import pytest
+
+from app.corpus_store import CorpusStore
+from app.index_builder import build_index
+from app.sharding import load_sharded_corpus, partition_positions, write_shards
+
+VERSION = 'test'
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    rng = np.random.default_rng(0)
+    n_passages, dim = 60, 16
+    store = CorpusStore.from_records([f"passage {p}" for p in range(n_passages)], [f"doc{p // 5}.pdf" for p in range(n_passages)])
+    embeddings = rng.standard_normal((n_passages, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    queries = rng.standard_normal((25, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return store, embeddings, queries
+
+
+@pytest.mark.parametrize('n_shards', [1, 4])
+@pytest.mark.parametrize('k', [10, 30, 80])
+def test_sharded_top_k_equals_single_index(tmp_path, corpus, n_shards, k):
+    store, embeddings, queries = corpus
+    write_shards(str(tmp_path / VERSION), VERSION, store, embeddings, n_shards, shingles=False)
+    if k == 30 and n_shards > 1:
+        # Au moins un shard a moins de k passages : son top-k est complété par des -1
+        assert min(len(p) for p in partition_positions(store, n_shards)) < k
+
+    expected_distances, expected_positions = build_index(embeddings, 'flat').search(queries, k)
+    sharded = load_sharded_corpus(VERSION, mode='thread', shards_dir=str(tmp_path))
+    try:
+        distances, positions = sharded.search(queries, k)
+        np.testing.assert_array_equal(positions, expected_positions)
+        found = positions >= 0
+        np.testing.assert_allclose(distances[found], expected_distances[found], rtol=1e-5, atol=1e-6)
+        # Plus de k passages demandés que le corpus n'en compte : mêmes -1 en fin de ligne
+        assert np.all(found) == (k <= len(store))
+        assert sharded.get_texts(positions[found]) == store.get_texts(positions[found])
+    finally:
+        sharded.close()
@@ -1,23 +1,34 @@
+import argparse
+import json
 import os
+import re
 import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 import faiss
 from sentence_transformers import SentenceTransformer
-import fitz
-import nltk
-import pandas as pd
-import re
-import os
 import fitz  # Import de la bibliothèque PyMuPDF
 from tqdm import tqdm
 
+from app.corpus_store import CorpusStore, paragraph_ids
+from app.embedding_cache import corpus_embedding_cache, encode_texts
+from app.index_builder import is_id_mapped
+from app.pdf_extraction import extract_pdf_text, shutdown_extraction_pool
+from app.shingle_index import ShingleIndex, shingle_index_exists
+from app.snapshots import publish_snapshot, read_manifest, resolve_snapshot
+
 APP_DIR = "app"
 CORPUS_DIR = os.path.join(APP_DIR, "corpus")
-STAGING_DIR = "staging_files"
+# Documents mis en attente par l'API (app/staging.py) : <sha256>.pdf + <sha256>.json
+STAGING_DIR = os.path.join(CORPUS_DIR, "staging_files")
 ARCHIVE_DIR = "archived_files"
 CSV_FILES=os.path.join(CORPUS_DIR,"paragraphes-split.csv")
 FAISS_INDEX_PATH = os.path.join(CORPUS_DIR, 'corpus_doc.index')
 CORPUS_DF_PATH = os.path.join(CORPUS_DIR, 'corpus_dataframe_doc.pkl')
+CORPUS_STORE_DIR = os.path.join(CORPUS_DIR, 'corpus_store')
 BI_ENCODER_NAME = 'sentence-transformers/msmarco-distilbert-base-v4'
 TEXT_COLUMN = 'content_block'
 SOURCE_COLUMN = 'title'
@@ -83,6 +94,30 @@ def decouper_texte_en_blocs(texte, min_chars, max_chars):
     return blocs
 
 
+def charger_corpus(store_dir=CORPUS_STORE_DIR):
+    """Charge le corpus existant (store en colonnes, ou à défaut l'ancien pickle) sous forme de DataFrame."""
+    if os.path.exists(os.path.join(store_dir, 'offsets.npy')):
+        return CorpusStore.load(store_dir).to_dataframe(TEXT_COLUMN, SOURCE_COLUMN)
+    return pd.read_pickle(CORPUS_DF_PATH)
+
+
+def titre_du_document(file_path):
+    """Nom d'origine du document (fiche JSON écrite par l'API), ou à défaut le nom du fichier."""
+    fiche = os.path.splitext(file_path)[0] + ".json"
+    if os.path.exists(fiche):
+        with open(fiche, encoding="utf-8") as f:
+            return json.load(f).get("filename", os.path.basename(file_path))
+    return os.path.basename(file_path)
+
+def deplacer_document(file_path, dest_dir):
+    """Déplace un document en attente (et sa fiche JSON s'il en a une)."""
+    os.makedirs(dest_dir, exist_ok=True)
+    fiche = os.path.splitext(file_path)[0] + ".json"
+    if os.path.exists(fiche):
+        shutil.move(fiche, os.path.join(dest_dir, os.path.basename(fiche)))
+    shutil.move(file_path, os.path.join(dest_dir, os.path.basename(file_path)))
+
+
 # --- PIPELINE PRINCIPAL ---
 
 def traiter_et_ajouter_document(filename):
@@ -126,83 +161,262 @@ def traiter_et_ajouter_document(filename):
     print("\n✅ Opération terminée avec succès !")
     print(f"Nombre total de paragraphes ajoutés : {len(df_nouveau)}")
 
-def update_corpus():
-    os.makedirs(STAGING_DIR, exist_ok=True)
-    os.makedirs(ARCHIVE_DIR, exist_ok=True)
-
-    files_to_process=[f for f in os.listdir(STAGING_DIR) if f.endswith(".pdf") ]
-
-    if not files_to_process:
-        print("Aucun nouveau document à traiter")
-        return
-    
+# --- INGESTION PARALLÈLE ET REPRENABLE ---
+#   1. extraction : les PDF en attente sont nettoyés et découpés en blocs dans un pool de processus ;
+#      le résultat de chaque document est enregistré dès qu'il est prêt (INGESTION_DIR/documents).
+#      Un document par processus quand il y en a assez pour occuper le pool ; sinon (quelques gros mémoires),
+#      chaque document est extrait par tranches de pages sur tous les processus (app/pdf_extraction.py).
+#   2. encodage : les nouveaux blocs (dédoublonnés) sont encodés par tranches de SHARD_SIZE,
+#      chaque tranche d'embeddings est écrite sur disque (INGESTION_DIR/shards).
+#   3. fusion : le corpus, l'index FAISS et l'index de shingles (voie rapide des copies mot pour mot)
+#      complétés sont publiés comme nouvel instantané, puis les PDF archivés.
+#   Le manifeste (INGESTION_DIR/manifest.json) permet de reprendre un lot interrompu là où il s'est arrêté.
+
+INGESTION_DIR = os.path.join(CORPUS_DIR, "ingestion")
+MANIFEST_PATH = os.path.join(INGESTION_DIR, "manifest.json")
+INGESTION_WORKERS = int(os.environ.get('APLAG_INGESTION_WORKERS', os.cpu_count() or 1))
+SHARD_SIZE = int(os.environ.get('APLAG_INGESTION_SHARD_SIZE', 2048))
+ENCODE_BATCH_SIZE = int(os.environ.get('APLAG_INGESTION_BATCH_SIZE', 64))
+MIN_FILE_SIZE = 10000
+
+
+def ecrire_json_atomique(chemin, donnees):
+    tmp = f"{chemin}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(donnees, f, ensure_ascii=False)
+    os.replace(tmp, chemin)
+
+def lire_json(chemin):
+    with open(chemin, encoding="utf-8") as f:
+        return json.load(f)
+
+def chemin_document(filename):
+    return os.path.join(INGESTION_DIR, "documents", os.path.splitext(filename)[0] + ".json")
+
+def chemin_shard(numero):
+    return os.path.join(INGESTION_DIR, "shards", f"embeddings_{numero:05d}.npy")
+
+
+def preparer_document(file_path, extraction_workers=1):
+    """
+    Extrait, nettoie et découpe un PDF en blocs sans expression mathématique : dans le pool d'ingestion,
+    ou dans le processus principal avec `extraction_workers` processus d'extraction par tranches de pages.
+    Retourne {"statut": "extrait" | "ignore" | "erreur", "titre", "blocs", "erreur"}.
+    """
+    titre = titre_du_document(file_path)
+    if os.path.getsize(file_path) < MIN_FILE_SIZE:
+        return {"statut": "ignore", "titre": titre, "blocs": [], "erreur": "fichier trop petit"}
     try:
-        df_corpus=pd.read_pickle(CORPUS_DF_PATH)
-        index=faiss.read_index(FAISS_INDEX_PATH)
-        bi_encoder=SentenceTransformer(BI_ENCODER_NAME)
+        texte = extract_pdf_text(file_path, workers=extraction_workers)
+        blocs = decouper_texte_en_blocs(nettoyer_texte(texte), MIN_CHARS_PAR_BLOC, MAX_CHARS_PAR_BLOC)
+        blocs = [bloc for bloc in blocs if not contient_expression_math(bloc)]
+        return {"statut": "extrait", "titre": titre, "blocs": blocs, "erreur": None}
+    except Exception as e:
+        return {"statut": "erreur", "titre": titre, "blocs": [], "erreur": str(e)}
+
+
+def charger_manifeste(recommencer=False):
+    """Manifeste du lot en cours, ou un nouveau lot avec les PDF actuellement en attente."""
+    if os.path.exists(MANIFEST_PATH) and not recommencer:
+        manifeste = lire_json(MANIFEST_PATH)
+        print(f"Reprise du lot interrompu à l'étape : {manifeste['etape']}")
+        return manifeste
+
+    shutil.rmtree(INGESTION_DIR, ignore_errors=True)
+    os.makedirs(os.path.join(INGESTION_DIR, "documents"))
+    os.makedirs(os.path.join(INGESTION_DIR, "shards"))
+    fichiers = sorted(f for f in os.listdir(STAGING_DIR) if f.endswith(".pdf"))
+    manifeste = {
+        "lot": uuid.uuid4().hex, "etape": "extraction", "fichiers": fichiers,
+        "paragraphes": None, "shards": 0, "version_base": None, "taille_corpus": None
+    }
+    if fichiers:
+        ecrire_json_atomique(MANIFEST_PATH, manifeste)
+    return manifeste
+
+
+def enregistrer_extraction(restants, resultats):
+    """Enregistre le résultat de chaque document dès qu'il est prêt."""
+    for filename, resultat in tqdm(zip(restants, resultats), total=len(restants), desc="Extraction"):
+        if resultat["statut"] == "erreur":
+            print(f"Erreur lors du traitement du fichier {filename} : {resultat['erreur']}")
+        ecrire_json_atomique(chemin_document(filename), resultat)
+
+
+def etape_extraction(manifeste, workers):
+    """Prépare dans le pool les documents qui n'ont pas encore de résultat enregistré."""
+    restants = [f for f in manifeste["fichiers"] if not os.path.exists(chemin_document(f))]
+    if restants:
+        print(f"📄 Extraction de {len(restants)} document(s) sur {workers} processus")
+        chemins = [os.path.join(STAGING_DIR, f) for f in restants]
+        if len(restants) < workers:
+            # Trop peu de documents pour occuper le pool : les pages de chaque document sont réparties
+            try:
+                enregistrer_extraction(restants, (preparer_document(chemin, extraction_workers=workers) for chemin in chemins))
+            finally:
+                shutdown_extraction_pool()
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                enregistrer_extraction(restants, pool.map(preparer_document, chemins, chunksize=4))
+
+    manifeste["etape"] = "encodage"
+    ecrire_json_atomique(MANIFEST_PATH, manifeste)
+
+
+def nouveaux_paragraphes(manifeste, df_corpus):
+    """
+    Blocs à ajouter, dans l'ordre des fichiers du lot, sans ceux déjà présents dans le corpus
+    ni les doublons du lot : chaque bloc conservé a exactement un embedding.
+    """
+    deja_vus = set(df_corpus[TEXT_COLUMN])
+    paragraphes = []
+    for filename in manifeste["fichiers"]:
+        resultat = lire_json(chemin_document(filename))
+        for bloc in resultat["blocs"]:
+            if bloc not in deja_vus:
+                deja_vus.add(bloc)
+                paragraphes.append({TEXT_COLUMN: bloc, SOURCE_COLUMN: resultat["titre"]})
+    return paragraphes
+
+
+def etape_encodage(manifeste, paragraphes, shard_size):
+    """
+    Encode les blocs par tranches ; les tranches déjà écrites sur disque sont conservées.
+    Les blocs déjà encodés une fois (document réingéré, lot recommencé) sont relus dans le cache d'embeddings.
+    """
+    textes = [p[TEXT_COLUMN] for p in paragraphes]
+    n_shards = (len(textes) + shard_size - 1) // shard_size
+    a_encoder = [n for n in range(n_shards) if not os.path.exists(chemin_shard(n))]
+    if a_encoder:
+        print(f"🧮 Encodage de {len(a_encoder)} tranche(s) sur {n_shards}")
+        bi_encoder = SentenceTransformer(BI_ENCODER_NAME)
+        cache = corpus_embedding_cache()
+        for n in tqdm(a_encoder, desc="Encodage"):
+            embeddings = encode_texts(
+                bi_encoder,
+                textes[n * shard_size:(n + 1) * shard_size],
+                cache=cache,
+                batch_size=ENCODE_BATCH_SIZE,
+                show_progress_bar=False
+            )
+            tmp = chemin_shard(n) + ".tmp.npy"
+            np.save(tmp, embeddings.astype(np.float32))
+            os.replace(tmp, chemin_shard(n))
+
+    manifeste.update(etape="fusion", shards=n_shards)
+    ecrire_json_atomique(MANIFEST_PATH, manifeste)
+
+
+def etape_fusion(manifeste, snapshot, df_corpus, paragraphes):
+    """
+    Ajoute les embeddings à l'index et les blocs au corpus, puis publie le résultat comme
+    nouvel instantané (app/snapshots.py) : l'API le charge sans redémarrer.
+    Un index à identifiants (IndexIDMap2) reçoit l'identifiant stable de chaque bloc.
+    L'index de shingles est complété de la même façon (ou construit sur tout le corpus s'il n'existe pas encore).
+    """
+    index = faiss.read_index(snapshot["index_path"])
+    if index.ntotal != manifeste["taille_corpus"] or len(df_corpus) != manifeste["taille_corpus"]:
+        raise RuntimeError(
+            f"Le corpus ({len(df_corpus)}) ou l'index ({index.ntotal}) ne correspond pas à la version "
+            f"de départ du lot ({manifeste['taille_corpus']}) : relancez avec --restart."
+        )
+    print('\nMise à jour du corpus et de FAISS')
+    id_mapped = is_id_mapped(index)
+    ids = paragraph_ids([p[TEXT_COLUMN] for p in paragraphes])
+    debut = 0
+    for n in range(manifeste["shards"]):
+        embeddings = np.load(chemin_shard(n))
+        if id_mapped:
+            index.add_with_ids(embeddings, ids[debut:debut + len(embeddings)])
+        else:
+            index.add(embeddings)
+        debut += len(embeddings)
+
+    df_new = pd.DataFrame(paragraphes, columns=[TEXT_COLUMN, SOURCE_COLUMN])
+    df_updated = pd.concat([df_corpus, df_new], ignore_index=True)
+    print("Mise à jour de l'index de shingles")
+    if shingle_index_exists(snapshot["shingles_dir"]):
+        shingles = ShingleIndex.load(snapshot["shingles_dir"]).extend(df_new[TEXT_COLUMN].tolist(), first_position=len(df_corpus))
+    else:
+        shingles = ShingleIndex.build(df_updated[TEXT_COLUMN].tolist())
+    version = publish_snapshot(
+        index,
+        CorpusStore.from_dataframe(df_updated, TEXT_COLUMN, SOURCE_COLUMN, with_ids=id_mapped),
+        metadata={"lot": manifeste["lot"], "documents_ajoutes": len(manifeste["fichiers"]), "paragraphes_ajoutes": len(paragraphes)},
+        shingle_index=shingles
+    )
+    print(f"Instantané publié : {version}")
 
-    except FileNotFoundError:
-        return
-    
-    new_paragraphs=[]
+    manifeste["etape"] = "archivage"
+    ecrire_json_atomique(MANIFEST_PATH, manifeste)
 
-    for filename in files_to_process:
-        file_path=os.path.join(STAGING_DIR, filename)
 
-        if os.path.getsize(file_path)<10000:
-            print(f"fichier trop petit. Ignoré")
-            shutil.move(file_path, os.path.join(ARCHIVE_DIR, filename))
+def etape_archivage(manifeste):
+    """Les documents ne quittent la zone d'attente qu'une fois le corpus mis à jour."""
+    for filename in manifeste["fichiers"]:
+        file_path = os.path.join(STAGING_DIR, filename)
+        if not os.path.exists(file_path):
             continue
+        statut = lire_json(chemin_document(filename))["statut"]
+        deplacer_document(file_path, os.path.join(STAGING_DIR, "errors") if statut == "erreur" else ARCHIVE_DIR)
 
-        try:
-            doc=fitz.open(file_path)
-            full_text="".join(page.get_text() for page in doc).replace('\n', ' ')
-            doc.close()
-
-            sentences=nltk.sent_tokenize(full_text, language='french')
 
-            for sentence in sentences:
-                if len(sentence.split()>10):
-                    new_paragraphs.append({
-                        TEXT_COLUMN:sentence,
-                        SOURCE_COLUMN:filename
-                    })
-
-            shutil.move(file_path, os.path.join(ARCHIVE_DIR, filename))
-
-        except Exception as e:
-            print(f"Erreur lors du traitement du fichier{filename} : {e}")
-            error_dir=os.path.join(STAGING_DIR, "errors")
-            os.makedirs(error_dir, exist_ok=True)
-            shutil.move(file_path, os.path.join(error_dir, filename))
+def update_corpus(workers=INGESTION_WORKERS, shard_size=SHARD_SIZE, recommencer=False):
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
 
-    if not new_paragraphs:
-        print("Aucun Paragraphe valide à ajouter")
+    manifeste = charger_manifeste(recommencer)
+    if not manifeste["fichiers"]:
+        print("Aucun nouveau document à traiter")
         return
-    
-    print('\nMise à jour du Dataframe et de FAISS')
-
-    df_new=pd.DataFrame(new_paragraphs)
-    df_updated=pd.concat([df_corpus, df_new], ignore_index=True)
-    df_updated.drop_duplicates(subset=[TEXT_COLUMN], inplace=True, keep='first')
 
-    new_embeddings = bi_encoder.encode(
-        df_new[TEXT_COLUMN].tolist(), 
-        convert_to_numpy=True, 
-        show_progress_bar=True,
-        normalize_embeddings=True
-    )
-    index.add(new_embeddings)
-
-    df_updated.to_pickle(CORPUS_DF_PATH)
-    faiss.write_index(index, FAISS_INDEX_PATH)
+    snapshot = resolve_snapshot()
+    if manifeste["version_base"] is None:
+        manifeste["version_base"] = snapshot["version"]
+        ecrire_json_atomique(MANIFEST_PATH, manifeste)
+    elif snapshot["version"] != manifeste["version_base"] and manifeste["etape"] != "archivage":
+        # Arrêt entre la publication de l'instantané et l'enregistrement de l'étape suivante
+        if (read_manifest(snapshot["version"]) or {}).get("lot") != manifeste["lot"]:
+            raise RuntimeError("Une autre version du corpus a été publiée pendant le lot : relancez avec --restart.")
+        manifeste["etape"] = "archivage"
+
+    if manifeste["etape"] != "archivage":
+        try:
+            df_corpus=charger_corpus(snapshot["store_dir"])
+        except FileNotFoundError:
+            return
+        if manifeste["taille_corpus"] is None:
+            manifeste["taille_corpus"] = len(df_corpus)
+            ecrire_json_atomique(MANIFEST_PATH, manifeste)
+
+        if manifeste["etape"] == "extraction":
+            etape_extraction(manifeste, workers)
+
+        paragraphes = nouveaux_paragraphes(manifeste, df_corpus)
+        if manifeste["paragraphes"] is None:
+            manifeste["paragraphes"] = len(paragraphes)
+            ecrire_json_atomique(MANIFEST_PATH, manifeste)
+        elif manifeste["paragraphes"] != len(paragraphes):
+            raise RuntimeError("Les blocs du lot ne correspondent plus au manifeste : relancez avec --restart.")
+        print(f"📊 {len(paragraphes)} nouveaux blocs à ajouter")
+
+        if not paragraphes:
+            print("Aucun Paragraphe valide à ajouter")
+            manifeste["etape"] = "archivage"
+        else:
+            if manifeste["etape"] == "encodage":
+                etape_encodage(manifeste, paragraphes, shard_size)
+            etape_fusion(manifeste, snapshot, df_corpus, paragraphes)
 
+    etape_archivage(manifeste)
+    shutil.rmtree(INGESTION_DIR, ignore_errors=True)
     print(f"\n -- Mise à jour terminée")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajoute au corpus les PDF en attente (reprend un lot interrompu).")
+    parser.add_argument('--workers', type=int, default=INGESTION_WORKERS, help="Processus d'extraction")
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help="Blocs par tranche d'embeddings")
+    parser.add_argument('--restart', action='store_true', help="Abandonner le lot interrompu et repartir de zéro")
+    args = parser.parse_args()
 
-    update_corpus()
-
-
-
-
+    update_corpus(workers=args.workers, shard_size=args.shard_size, recommencer=args.restart)